@@ -0,0 +1,293 @@
+import io
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import zipfile
+from pathlib import Path
+from typing import IO, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from stores import SQLiteJobStore, JOBS_DB_PATH, BASE_DIR
+
+# --- Настройки пакетной генерации ---
+# Сколько документов пакетов обрабатывается одновременно
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_FILE_MB = float(os.getenv("BATCH_MAX_FILE_MB", "50"))
+# Повторы при временных ошибках (Gemini перегружен или не ответил вовремя)
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+BATCH_RETRY_DELAY_SECONDS = float(os.getenv("BATCH_RETRY_DELAY_SECONDS", "10"))
+# Здесь лежат входные файлы заданий, пока они не обработаны
+BATCH_JOBS_DIR = Path(os.getenv("BATCH_JOBS_DIR", str(BASE_DIR / "batch_jobs")))
+# Аренда элемента в running: обработчик продлевает её, пока работает. Элемент
+# с истёкшей арендой (процесс упал) забирает другой обработчик
+BATCH_LEASE_SECONDS = float(os.getenv("BATCH_LEASE_SECONDS", "300"))
+
+# Страховочный опрос очереди, даже если пробуждение было пропущено
+BATCH_POLL_SECONDS = 30.0
+
+TEXT_EXTENSIONS = (".txt", ".md")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BatchInputError(ValueError):
+    """Пакет не удалось принять (пустой, слишком большой, неподдерживаемый файл)."""
+
+
+class RetryLaterError(Exception):
+    """Временная ошибка: элемент пакета нужно повторить позже."""
+
+
+def _copy_with_hash(source: IO[bytes], target_path: Path, max_bytes: int) -> str:
+    hasher = hashlib.sha256()
+    written = 0
+    with open(target_path, "wb") as target:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise BatchInputError(f"{target_path.name}: file is too large.")
+            hasher.update(chunk)
+            target.write(chunk)
+    return hasher.hexdigest()
+
+
+def _item_kind(filename: str) -> Optional[str]:
+    lower_name = filename.lower()
+    if lower_name.endswith(".pdf"):
+        return "pdf"
+    if lower_name.endswith(TEXT_EXTENSIONS):
+        return "text"
+    return None
+
+
+def save_batch_inputs(
+    job_dir: Path,
+    texts: List[str],
+    files: List[Tuple[str, IO[bytes]]],
+) -> List[Dict]:
+    """
+    Сохраняет входы пакета в job_dir: тексты, PDF/txt-файлы и содержимое
+    ZIP-архивов (вложенные PDF/txt/md). Возвращает описания элементов.
+    """
+    max_bytes = int(BATCH_MAX_FILE_MB * 1024 * 1024)
+    items: List[Dict] = []
+
+    def add_item(name: str, kind: str, source: IO[bytes]) -> None:
+        if len(items) >= BATCH_MAX_ITEMS:
+            raise BatchInputError(f"Too many documents (max {BATCH_MAX_ITEMS}).")
+        suffix = ".pdf" if kind == "pdf" else ".txt"
+        source_path = job_dir / f"{len(items)}{suffix}"
+        source_hash = _copy_with_hash(source, source_path, max_bytes)
+        items.append(
+            {
+                "name": name,
+                "kind": kind,
+                "source_path": str(source_path),
+                "source_hash": source_hash,
+            }
+        )
+
+    for index, text in enumerate(texts):
+        if text and text.strip():
+            source = io.BytesIO(text.strip().encode("utf-8"))
+            add_item(f"text-{index + 1}", "text", source)
+
+    for filename, file_obj in files:
+        if filename.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(file_obj)
+            except zipfile.BadZipFile:
+                raise BatchInputError(f"{filename}: not a valid ZIP archive.")
+            with archive:
+                for entry in archive.infolist():
+                    kind = _item_kind(entry.filename)
+                    if entry.is_dir() or kind is None:
+                        continue
+                    if entry.file_size > max_bytes:
+                        raise BatchInputError(f"{entry.filename}: file is too large.")
+                    with archive.open(entry) as entry_file:
+                        add_item(entry.filename, kind, entry_file)
+            continue
+        kind = _item_kind(filename)
+        if kind is None:
+            raise BatchInputError(f"{filename}: unsupported file type.")
+        add_item(filename, kind, file_obj)
+
+    if not items:
+        raise BatchInputError("No documents to process.")
+    return items
+
+
+def job_status(items: List[Dict]) -> str:
+    """Статус задания по статусам элементов: queued, running, done или failed."""
+    statuses = {item["status"] for item in items}
+    if statuses <= {"pending"}:
+        return "queued"
+    if statuses & {"pending", "running"}:
+        return "running"
+    return "failed" if statuses == {"failed"} else "done"
+
+
+ProcessItem = Callable[[Dict], Awaitable[Dict]]
+
+
+class BatchJobQueue:
+    """
+    Очередь пакетных заданий поверх SQLiteJobStore с ограниченным пулом
+    воркеров (asyncio-задачи в процессе приложения). Элементы обрабатываются
+    функцией process_item, которую передаёт приложение при старте.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SQLiteJobStore],
+        workers: int = BATCH_WORKERS,
+        jobs_dir: Path = BATCH_JOBS_DIR,
+    ):
+        self.store = store
+        self.workers = workers
+        self.jobs_dir = jobs_dir
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._process_item: Optional[ProcessItem] = None
+
+    async def start(self, process_item: ProcessItem) -> None:
+        if self.store is None:
+            return
+        self._process_item = process_item
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        restored = await asyncio.to_thread(self.store.reset_running, BATCH_LEASE_SECONDS)
+        if restored:
+            print(f"Batch queue: {restored} abandoned items returned to the queue.")
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self, options: Dict, texts: List[str], files: List[Tuple[str, IO[bytes]]]
+    ) -> Tuple[str, int]:
+        """Сохраняет входы и ставит задание в очередь. Возвращает (job_id, число документов)."""
+        job_id = uuid.uuid4().hex
+        job_dir = self.jobs_dir / job_id
+
+        def save() -> List[Dict]:
+            job_dir.mkdir(parents=True)
+            try:
+                return save_batch_inputs(job_dir, texts, files)
+            except Exception:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                raise
+
+        items = await asyncio.to_thread(save)
+        await asyncio.to_thread(self.store.create_job, job_id, options, items)
+        self._wakeup.set()
+        return job_id, len(items)
+
+    async def get_job(self, job_id: str, with_results: bool = False) -> Optional[Dict]:
+        job = await asyncio.to_thread(self.store.get_job, job_id, with_results)
+        if job is not None:
+            job["status"] = job_status(job["items"])
+        return job
+
+    async def _wait_for_work(self) -> None:
+        """Ждёт нового задания или момента, когда отложенный элемент можно повторить."""
+        next_ready_at = await asyncio.to_thread(self.store.next_ready_at)
+        timeout = BATCH_POLL_SECONDS
+        if next_ready_at is not None:
+            timeout = min(max(next_ready_at - time.time(), 0.1), timeout)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self) -> None:
+        while True:
+            # Сбрасываем до выборки, чтобы не пропустить submit между ними
+            self._wakeup.clear()
+            item = await asyncio.to_thread(self.store.claim_next_item, BATCH_LEASE_SECONDS)
+            if item is None:
+                await self._wait_for_work()
+                continue
+            await self._run_item(item)
+
+    async def _keep_lease(self, item: Dict) -> None:
+        """Продлевает аренду элемента, пока он обрабатывается."""
+        while True:
+            await asyncio.sleep(BATCH_LEASE_SECONDS / 3)
+            kept = await asyncio.to_thread(
+                self.store.touch_item, item["job_id"], item["item_index"], item["attempts"]
+            )
+            if not kept:
+                print(f"Batch job {item['job_id']}: item {item['item_index']} lease lost.")
+                return
+
+    async def _run_item(self, item: Dict) -> None:
+        job_id, item_index = item["job_id"], item["item_index"]
+        lease_task = asyncio.create_task(self._keep_lease(item))
+        try:
+            result = await self._process_item(item)
+        except asyncio.CancelledError:
+            # Остановка приложения: возвращаем элемент в очередь сразу, не дожидаясь
+            # конца аренды (синхронно - задача уже отменена)
+            self.store.retry_item(job_id, item_index, item["attempts"], item["error"], 0)
+            raise
+        except RetryLaterError as e:
+            if item["attempts"] < BATCH_MAX_ATTEMPTS:
+                delay = BATCH_RETRY_DELAY_SECONDS * 2 ** (item["attempts"] - 1)
+                await asyncio.to_thread(
+                    self.store.retry_item,
+                    job_id,
+                    item_index,
+                    item["attempts"],
+                    str(e),
+                    delay,
+                )
+                return
+            await self._finish(item, error=str(e))
+        except Exception as e:
+            print(f"Batch job {job_id}: item {item_index} failed: {e}")
+            await self._finish(item, error=str(e) or type(e).__name__)
+        else:
+            await self._finish(item, result=result)
+        finally:
+            lease_task.cancel()
+
+    async def _finish(
+        self, item: Dict, result: Optional[Dict] = None, error: Optional[str] = None
+    ) -> None:
+        job_id = item["job_id"]
+        finished = await asyncio.to_thread(
+            self.store.finish_item,
+            job_id,
+            item["item_index"],
+            item["attempts"],
+            result,
+            error,
+        )
+        if not finished:
+            # Аренда истекла, элемент забрал другой обработчик - его результат и запишется
+            return
+        # Входной файл больше не нужен; каталог удаляется, когда задание завершено
+        Path(item["source_path"]).unlink(missing_ok=True)
+        if not await asyncio.to_thread(self.store.count_unfinished_items, job_id):
+            shutil.rmtree(self.jobs_dir / job_id, ignore_errors=True)
+
+
+def create_batch_queue() -> BatchJobQueue:
+    store = None
+    try:
+        store = SQLiteJobStore(JOBS_DB_PATH)
+    except Exception as e:
+        print(f"Warning: batch job store at {JOBS_DB_PATH} is unavailable: {e}")
+    return BatchJobQueue(store)
@@ -0,0 +1,95 @@
+"""
+Бенчмарк очистки текста PDF от служебных элементов (колонтитулы, номера
+страниц, оглавление, таблица версий): сколько символов и токенов промпта
+экономится на документ и сколько стоит сама очистка.
+
+Синтетические документы (synthetic_pdf с колонтитулами) проверяются на
+потерю содержания: все строки требований должны остаться после очистки.
+Настоящие документы можно передать через --pdf.
+
+Запуск: python benchmarks/bench_boilerplate.py [--pages 10 50 200]
+        [--pdf spec.pdf ...] [--repeat 5] [--json report.json]
+"""
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from gemini_client import estimate_tokens  # noqa: E402
+from utils import extract_pdf_pages, strip_pdf_boilerplate  # noqa: E402
+
+from report import write_json  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+
+
+def measure(name: str, page_texts: List[str], repeat: int) -> Dict:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        cleaned_texts = strip_pdf_boilerplate(page_texts)
+        best = min(best, time.perf_counter() - started_at)
+    raw_text = "\n".join(page_texts)
+    cleaned_text = "\n".join(cleaned_texts)
+    result = {
+        "document": name,
+        "pages": len(page_texts),
+        "chars_before": len(raw_text),
+        "chars_after": len(cleaned_text),
+        "chars_saved": len(raw_text) - len(cleaned_text),
+        "tokens_saved": estimate_tokens(raw_text) - estimate_tokens(cleaned_text),
+        "strip_ms": round(best * 1000, 2),
+    }
+    share = result["chars_saved"] / result["chars_before"] if result["chars_before"] else 0.0
+    print(
+        f"{name:<24} {result['pages']:>4} pages: {result['chars_before']:>8} -> "
+        f"{result['chars_after']:>8} chars, saved {result['chars_saved']:>7} "
+        f"({share:5.1%}, ~{result['tokens_saved']} tokens), strip {result['strip_ms']:.2f} ms"
+    )
+    return result
+
+
+def requirements_kept(page_texts: List[str], cleaned_texts: List[str]) -> bool:
+    """Все строки требований синтетического документа пережили очистку."""
+    cleaned_lines = {line for text in cleaned_texts for line in text.splitlines()}
+    return all(
+        " ".join(line.split()) in cleaned_lines
+        for text in page_texts
+        for line in text.splitlines()
+        if line.startswith("Section") and "..." not in line or " The system " in line
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--pdf", nargs="*", default=[], help="настоящие PDF-документы")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="файл для JSON-отчёта, - для stdout")
+    args = parser.parse_args()
+
+    results = []
+    content_kept = True
+    for pages in args.pages:
+        pdf_bytes = make_pdf(pages, seed=args.seed, boilerplate=True)
+        page_texts = extract_pdf_pages(io.BytesIO(pdf_bytes))
+        results.append(measure(f"synthetic-{pages}", page_texts, args.repeat))
+        if not requirements_kept(page_texts, strip_pdf_boilerplate(page_texts)):
+            print(f"synthetic-{pages}: requirement lines LOST")
+            content_kept = False
+    for path in args.pdf:
+        results.append(measure(Path(path).name, extract_pdf_pages(path), args.repeat))
+
+    if args.json:
+        write_json(args.json, "boilerplate", vars(args), results)
+    sys.exit(0 if content_kept else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Бенчмарк и проверка схлопывания почти одинаковых тест-кейсов (dedup.py).
+
+Проверка: пары кейсов, которые отличаются одним словом в шагах и значением
+"Тип" (позитивный "корректный номер" и негативный "некорректный номер"),
+не должны схлопываться, а копии кейса с другими отступами и регистром -
+должны. Затем замеряется время collapse_near_duplicates на наборах
+случайных кейсов.
+
+Запуск: python benchmarks/bench_dedup.py [--cases 100 1000] [--pairs 200]
+        [--repeat 5] [--seed 0]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedup import DEDUP_THRESHOLD, collapse_near_duplicates  # noqa: E402
+
+WORDS = (
+    "пользователь открыть страницу ввести логин пароль email телефон номер карты "
+    "заказ корзину товар нажать кнопку сохранить оплатить подтвердить адрес "
+    "профиль настройки сообщение ошибка список фильтр поиск отчёт файл загрузить"
+).split()
+# Слова, которые превращают позитивный шаг в негативный
+NEGATIONS = (
+    ("корректный", "некорректный"),
+    ("верный", "неверный"),
+    ("существующий", "несуществующий"),
+    ("заполненное", "пустое"),
+)
+
+
+def random_case(rng: random.Random, case_type: str = "Позитивный") -> Dict[str, str]:
+    steps = [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 7)))
+        for _ in range(rng.randint(2, 5))
+    ]
+    return {
+        "Название": " ".join(rng.choice(WORDS) for _ in range(4)),
+        "Шаги": "\n".join(f"{n}. {step}" for n, step in enumerate(steps, 1)),
+        "Ожидаемый результат": " ".join(rng.choice(WORDS) for _ in range(5)),
+        "Тип": case_type,
+    }
+
+
+def opposite_pair(rng: random.Random) -> List[Dict[str, str]]:
+    """Позитивный и негативный кейсы, отличающиеся одним словом в шаге."""
+    positive = random_case(rng)
+    word, negated = rng.choice(NEGATIONS)
+    steps = positive["Шаги"].split("\n")
+    position = rng.randrange(len(steps))
+    steps[position] = f"{steps[position]} {word} {rng.choice(WORDS)}"
+    positive["Шаги"] = "\n".join(steps)
+    negative = {
+        **positive,
+        "Шаги": positive["Шаги"].replace(f" {word} ", f" {negated} "),
+        "Тип": "Негативный",
+    }
+    return [positive, negative]
+
+
+def reformatted_copy(test_case: Dict[str, str]) -> Dict[str, str]:
+    """Тот же кейс с другими отступами шагов и регистром - дубль."""
+    return {
+        **test_case,
+        "Название": test_case["Название"].capitalize(),
+        "Шаги": test_case["Шаги"].replace("\n", "\n   "),
+        "Ожидаемый результат": test_case["Ожидаемый результат"].upper(),
+    }
+
+
+def check(pairs: int, seed: int, threshold: float) -> int:
+    """Число ошибок: схлопнутых пар разного типа и не найденных копий."""
+    rng = random.Random(seed)
+    errors = 0
+    for _ in range(pairs):
+        _, clusters = collapse_near_duplicates(opposite_pair(rng), threshold)
+        errors += bool(clusters)
+        test_case = random_case(rng, rng.choice(("Позитивный", "Негативный")))
+        _, clusters = collapse_near_duplicates(
+            [test_case, reformatted_copy(test_case)], threshold
+        )
+        errors += clusters != [[0, 1]]
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    errors = check(args.pairs, args.seed, args.threshold)
+    print(f"check: {errors} errors in {args.pairs} opposite-type pairs and copies")
+
+    rng = random.Random(args.seed)
+    for size in args.cases:
+        test_cases = [random_case(rng) for _ in range(size)]
+        # Каждый десятый кейс - копия одного из предыдущих
+        for position in range(10, size, 10):
+            test_cases[position] = reformatted_copy(test_cases[rng.randrange(position)])
+        best = float("inf")
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            kept, _ = collapse_near_duplicates(test_cases, args.threshold)
+            best = min(best, time.perf_counter() - started_at)
+        print(f"{size} cases: {len(kept)} kept, {best * 1000:.2f} ms")
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
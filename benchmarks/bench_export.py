@@ -0,0 +1,193 @@
+"""
+Бенчмарк экспорта тест-кейсов в CSV и Excel.
+
+Сравнивает exporters.iter_csv_chunks и exporters.build_excel_file с прежними
+реализациями на pandas (скопированы ниже как эталон): проверяет, что
+содержимое совпадает, и замеряет время и пиковое потребление памяти (tracemalloc).
+
+Запуск: python benchmarks/bench_export.py [--cases 1000 10000] [--seed 0]
+"""
+
+import argparse
+import io
+import random
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from exporters import CSV_BOM, iter_csv_chunks, build_excel_file  # noqa: E402
+
+
+def legacy_export_csv(test_cases_data: List[Dict[str, str]]) -> str:
+    """Прежняя реализация /export_csv (эталон для сравнения)."""
+    test_cases_data = [dict(tc_item) for tc_item in test_cases_data]
+    for tc_item in test_cases_data:
+        if "Шаги" in tc_item and isinstance(tc_item["Шаги"], str):
+            steps_str = tc_item["Шаги"]
+            steps_str = re.sub(r"(?<=[^\n])\s+(?=\d+\.\s)", r"\n", steps_str)
+            steps_str = re.sub(
+                r"^(?!\s*\d+\.\s)([^\n]*?)\s*(1\.\s)",
+                r"\1\n\2",
+                steps_str,
+                count=1,
+                flags=re.MULTILINE,
+            )
+            tc_item["Шаги"] = steps_str.replace("\n", "; ")
+
+    df = pd.DataFrame(test_cases_data)
+    stream = io.StringIO()
+    df.to_csv(stream, index=False, encoding="utf-8-sig")
+    return stream.getvalue()
+
+
+def streaming_export_csv(test_cases_data: List[Dict[str, str]]) -> str:
+    """Собирает ответ потокового экспорта; для замера памяти куски не копятся."""
+    size = 0
+    first_chunk = None
+    for chunk in iter_csv_chunks(test_cases_data):
+        size += len(chunk)
+        if first_chunk is None:
+            first_chunk = chunk
+    return first_chunk or ""
+
+
+def legacy_export_excel(test_cases_data: List[Dict[str, str]]) -> io.BytesIO:
+    """Прежняя реализация /export_excel (эталон для сравнения)."""
+    test_cases_data = [dict(item) for item in test_cases_data]
+    for item in test_cases_data:
+        if "Шаги" in item and isinstance(item["Шаги"], str):
+            steps_str = item["Шаги"]
+            item["Шаги"] = re.sub(r"(?<=[^\n])\s+(?=\d+\.\s)", r"\n", steps_str)
+            item["Шаги"] = re.sub(
+                r"^(?!\s*\d+\.\s)([^\n]*?)\s*(1\.\s)",
+                r"\1\n\2",
+                item["Шаги"],
+                count=1,
+                flags=re.MULTILINE,
+            )
+
+    df = pd.DataFrame(test_cases_data)
+    stream = io.BytesIO()
+    with pd.ExcelWriter(stream, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Test-Cases")
+        worksheet = writer.sheets["Test-Cases"]
+        steps_col_idx_df_coord = df.columns.get_loc("Шаги")
+        steps_col_letter = get_column_letter(steps_col_idx_df_coord + 1)
+        openpyxl_col_idx = steps_col_idx_df_coord + 1
+        for row_idx in range(2, worksheet.max_row + 1):
+            cell = worksheet.cell(row=row_idx, column=openpyxl_col_idx)
+            cell.alignment = Alignment(wrap_text=True, vertical="top")
+        max_width = 0
+        for row_cells in worksheet.iter_rows(
+            min_col=openpyxl_col_idx,
+            max_col=openpyxl_col_idx,
+            min_row=1,
+            max_row=worksheet.max_row,
+        ):
+            for cell in row_cells:
+                if cell.value:
+                    for line in str(cell.value).split("\n"):
+                        max_width = max(max_width, len(line))
+        adjusted_width = min(max_width + 5, 70)
+        if adjusted_width > 10:
+            worksheet.column_dimensions[steps_col_letter].width = adjusted_width
+    stream.seek(0)
+    return stream
+
+
+def workbook_summary(file_obj) -> Tuple[list, float, list]:
+    """Значения ячеек, ширина колонки шагов и перенос строк в ней."""
+    worksheet = load_workbook(file_obj)["Test-Cases"]
+    values = [list(row) for row in worksheet.iter_rows(values_only=True)]
+    wrapped = [
+        worksheet.cell(row=row_idx, column=2).alignment.wrap_text
+        for row_idx in range(2, worksheet.max_row + 1)
+    ]
+    return values, worksheet.column_dimensions["B"].width, wrapped
+
+
+WORDS = (
+    "открыть страницу ввести логин пароль нажать кнопку войти проверить "
+    "сообщение об ошибке поле email форма, регистрации \"пользователь\" корзина"
+).split()
+
+
+def _phrase(rng: random.Random, low: int = 2, high: int = 8) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def generate_test_cases(rng: random.Random, count: int) -> List[Dict[str, str]]:
+    test_cases = []
+    for _ in range(count):
+        steps = [f"{n}. {_phrase(rng)}" for n in range(1, rng.randint(1, 7) + 1)]
+        separator = rng.choice(["\n", " ", "\n\n"])
+        intro = f"{_phrase(rng)}: " if rng.random() < 0.2 else ""
+        test_cases.append(
+            {
+                "Название": _phrase(rng),
+                "Шаги": intro + separator.join(steps),
+                "Ожидаемый результат": _phrase(rng, 0, 10),
+                "Тип": rng.choice(["Позитивный", "Негативный", "Не определен"]),
+            }
+        )
+    return test_cases
+
+
+def measure(func: Callable, data) -> Tuple[float, int]:
+    """Возвращает (время в секундах, пик памяти в байтах) для одного вызова."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(data)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sample = generate_test_cases(rng, 2000)
+    expected = legacy_export_csv(sample)
+    actual = "".join(iter_csv_chunks(sample))
+    # Прежняя реализация писала в StringIO, поэтому BOM из utf-8-sig терялся
+    identical = actual == CSV_BOM + expected
+    print(f"csv equivalence: {'identical' if identical else 'MISMATCH'} (BOM aside)")
+    excel_identical = workbook_summary(legacy_export_excel(sample)) == workbook_summary(
+        build_excel_file(sample)
+    )
+    print(f"xlsx equivalence: {'identical' if excel_identical else 'MISMATCH'}")
+
+    for count in args.cases:
+        data = generate_test_cases(rng, count)
+        for label, legacy, new in (
+            ("csv", legacy_export_csv, streaming_export_csv),
+            ("xlsx", legacy_export_excel, lambda rows: build_excel_file(rows).close()),
+        ):
+            legacy_time, legacy_peak = measure(legacy, data)
+            new_time, new_peak = measure(new, data)
+            print(
+                f"{label} {count} cases: pandas {legacy_time * 1000:.1f} ms / "
+                f"{legacy_peak / 1e6:.1f} MB peak, new {new_time * 1000:.1f} ms / "
+                f"{new_peak / 1e6:.2f} MB peak"
+            )
+
+    sys.exit(0 if identical and excel_identical else 1)
+
+
+if __name__ == "__main__":
+    main()
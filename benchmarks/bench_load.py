@@ -0,0 +1,220 @@
+"""
+Нагрузочный бенчмарк приложения: конкурентные запросы к FastAPI-приложению
+с локальной заменой Gemini (fake_gemini.FakeGeminiModel), полностью офлайн.
+
+Приложение запускается в этом же процессе (httpx.ASGITransport, lifespan
+выполняется), поэтому измеряются собственные накладные расходы сервиса:
+пул вызовов Gemini, разбор PDF в пуле процессов, парсинг, экспорт. Кэш
+генерации, история и прогрев выключены; каждый запрос получает уникальный
+текст, чтобы не срабатывало объединение одинаковых вызовов (--same-input
+включает его обратно).
+
+Выводит пропускную способность, p50/p95/p99 полной длительности и времени
+до первого байта ответа, коды ответов; с --json - отчёт для сравнения прогонов.
+Нужен httpx.
+
+Запуск: python benchmarks/bench_load.py [--endpoint generate] [--requests 200]
+        [--concurrency 16] [--latency 0.5] [--error-rate 0.0] [--pdf-pages 0]
+        [--recorded responses.jsonl] [--json report.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from utils import parse_gemini_response  # noqa: E402
+
+from fake_gemini import (  # noqa: E402
+    FakeGeminiModel,
+    generate_response_text,
+    load_recorded_responses,
+)
+from report import summarize_ms, write_json  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+
+ENDPOINTS = ("generate", "generate_stream", "export_csv", "export_excel")
+
+
+def configure_environment(state_dir: str, use_cache: bool) -> None:
+    """Настройки приложения для бенчмарка; должны быть заданы до import main."""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["STARTUP_WARMUP"] = "off"
+    os.environ["HISTORY_ENABLED"] = "0"
+    os.environ["GENERATION_CACHE_ENABLED"] = "1" if use_cache else "0"
+    os.environ["PDF_TEXT_CACHE_ENABLED"] = "1" if use_cache else "0"
+    os.environ["PROFILE_SLOW_REQUEST_SECONDS"] = "0"
+    os.environ["CACHE_DB_PATH"] = os.path.join(state_dir, "cache.sqlite3")
+    os.environ["JOBS_DB_PATH"] = os.path.join(state_dir, "jobs.sqlite3")
+    os.environ["DOCUMENTS_DB_PATH"] = os.path.join(state_dir, "documents.sqlite3")
+    os.environ["DATABASE_URL"] = (
+        f"sqlite+aiosqlite:///{os.path.join(state_dir, 'history.sqlite3')}"
+    )
+    os.environ["BATCH_JOBS_DIR"] = os.path.join(state_dir, "batch_jobs")
+
+
+def build_request(args, number: int, pdf_bytes: Optional[bytes], test_cases: List[Dict]):
+    """Аргументы httpx для запроса номер number."""
+    path = "/" + args.endpoint
+    if args.endpoint in ("export_csv", "export_excel"):
+        return {"method": "POST", "url": path, "json": {"test_cases": test_cases}}
+    suffix = "" if args.same_input else f" (request {number})"
+    data = {"output_format": args.output_format} if args.endpoint == "generate" else {}
+    if pdf_bytes is not None:
+        data["custom_prompt"] = (
+            f"Сгенерируй тест-кейсы по требованиям{suffix}:\n{{requirements_text}}"
+        )
+        files = {"pdf_file": ("requirements.pdf", pdf_bytes, "application/pdf")}
+        return {"method": "POST", "url": path, "data": data, "files": files}
+    data["requirements_text"] = f"Пользователь входит по логину и паролю{suffix}."
+    return {"method": "POST", "url": path, "data": data}
+
+
+async def send(client, request: Dict) -> Dict:
+    started_at = time.perf_counter()
+    first_byte_at = None
+    async with client.stream(**request) as response:
+        async for _ in response.aiter_raw():
+            if first_byte_at is None:
+                first_byte_at = time.perf_counter()
+        status = response.status_code
+    finished_at = time.perf_counter()
+    return {
+        "status": status,
+        "seconds": finished_at - started_at,
+        "ttfb": (first_byte_at or finished_at) - started_at,
+    }
+
+
+async def run_load(args) -> Dict:
+    import httpx
+
+    import main
+
+    responses = load_recorded_responses(Path(args.recorded)) if args.recorded else None
+    fake_model = FakeGeminiModel(
+        responses,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    main.model = fake_model
+    pdf_bytes = make_pdf(args.pdf_pages, seed=args.seed) if args.pdf_pages else None
+    test_cases = []
+    if args.endpoint in ("export_csv", "export_excel"):
+        test_cases = parse_gemini_response(
+            generate_response_text(random.Random(args.seed), args.cases)
+        )
+
+    transport = httpx.ASGITransport(app=main.app)
+    results: List[Dict] = []
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+            for number in range(args.warmup):
+                await send(client, build_request(args, -1 - number, pdf_bytes, test_cases))
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for number in range(args.requests):
+                queue.put_nowait(number)
+
+            async def worker():
+                while True:
+                    try:
+                        number = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        result = await send(
+                            client, build_request(args, number, pdf_bytes, test_cases)
+                        )
+                    except Exception as e:
+                        result = {"status": type(e).__name__, "seconds": 0.0, "ttfb": 0.0}
+                    results.append(result)
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started_at
+
+    ok = [result for result in results if result["status"] == 200]
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "ok_throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "status_codes": dict(Counter(str(result["status"]) for result in results)),
+        "latency": summarize_ms([result["seconds"] for result in ok]),
+        "ttfb": summarize_ms([result["ttfb"] for result in ok]),
+        "fake_gemini": dict(fake_model.stats),
+        "gemini_pool": dict(main.gemini_pool.stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="generate")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=2, help="запросов до замера")
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка Gemini, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержки, доля")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ошибок 503/429")
+    parser.add_argument("--recorded", help="записанные ответы: JSONL или каталог .txt")
+    parser.add_argument("--pdf-pages", type=int, default=0, help="отправлять PDF из N страниц")
+    parser.add_argument("--cases", type=int, default=200, help="тест-кейсов в запросе экспорта")
+    parser.add_argument("--output-format", choices=("text", "json"), default="text")
+    parser.add_argument("--same-input", action="store_true", help="одинаковые запросы")
+    parser.add_argument("--use-cache", action="store_true", help="не выключать кэши")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="показывать лог приложения")
+    parser.add_argument("--json", help="файл для JSON-отчёта, - для stdout")
+    args = parser.parse_args()
+
+    # Приложение пишет лог через print: без --verbose он не смешивается с отчётом
+    app_log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as state_dir:
+        configure_environment(state_dir, args.use_cache)
+        with app_log:
+            summary = asyncio.run(run_load(args))
+
+    latency, ttfb = summary["latency"], summary["ttfb"]
+    print(
+        f"\n/{args.endpoint}: {summary['requests']} requests, concurrency "
+        f"{args.concurrency}, {summary['elapsed_s']:.2f} s"
+    )
+    print(
+        f"throughput: {summary['throughput_rps']:.2f} req/s "
+        f"({summary['ok_throughput_rps']:.2f} ok/s)"
+    )
+    print(f"status codes: {summary['status_codes']}")
+    if latency["count"]:
+        for label, stats in (("latency", latency), ("ttfb", ttfb)):
+            print(
+                f"{label:<8} p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  "
+                f"p99 {stats['p99_ms']:9.1f} ms  max {stats['max_ms']:9.1f} ms"
+            )
+    print(f"fake gemini: {summary['fake_gemini']}")
+    pool = summary["gemini_pool"]
+    print(f"gemini pool: calls {pool['calls']}, retries {pool['retries']}, "
+          f"coalesced {pool['coalesced']}")
+
+    if args.json:
+        write_json(args.json, "load", vars(args), [summary])
+
+
+if __name__ == "__main__":
+    main()
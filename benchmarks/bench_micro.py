@@ -0,0 +1,127 @@
+"""
+Микро-бенчмарки горячих функций: извлечение текста из PDF, разбор ответа
+Gemini и оба экспорта.
+
+Данные синтетические и детерминированные (--seed): PDF из synthetic_pdf,
+ответы в формате промпта из fake_gemini, тест-кейсы - результат их разбора.
+Каждая функция вызывается --repeat раз после одного прогревочного вызова;
+выводятся min / p50 / p95 и пропускная способность, с --json - отчёт для
+сравнения прогонов.
+
+Запуск: python benchmarks/bench_micro.py [--pages 10 50] [--cases 100 1000]
+        [--repeat 10] [--only pdf parser csv xlsx] [--json report.json]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from exporters import build_excel_file, iter_csv_chunks  # noqa: E402
+from utils import extract_text_from_pdf, parse_gemini_response  # noqa: E402
+
+from fake_gemini import generate_response_text  # noqa: E402
+from report import summarize_ms, write_json  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+
+GROUPS = ("pdf", "parser", "csv", "xlsx")
+
+
+def run(func: Callable[[], object], repeat: int) -> List[float]:
+    """Длительности repeat вызовов (секунды); вывод функции подавляется."""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()  # прогрев: ленивые импорты, кэши регулярных выражений
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started_at)
+    return samples
+
+
+def report(results: List[Dict], name: str, size: int, unit: str, samples: List[float]):
+    summary = summarize_ms(samples)
+    per_second = size / (summary["p50_ms"] / 1000) if summary["p50_ms"] else 0.0
+    results.append(
+        {"name": name, "size": size, "unit": unit, **summary, f"{unit}_per_s": round(per_second, 1)}
+    )
+    print(
+        f"{name:<28} {size:>6} {unit:<6} min {summary['min_ms']:9.2f} ms  "
+        f"p50 {summary['p50_ms']:9.2f} ms  p95 {summary['p95_ms']:9.2f} ms  "
+        f"{per_second:10.1f} {unit}/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--cases", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="файл для JSON-отчёта, - для stdout")
+    args = parser.parse_args()
+
+    results: List[Dict] = []
+
+    if "pdf" in args.only:
+        for pages in args.pages:
+            pdf_bytes = make_pdf(pages, seed=args.seed)
+            report(
+                results,
+                "extract_text_from_pdf",
+                pages,
+                "pages",
+                run(lambda: extract_text_from_pdf(io.BytesIO(pdf_bytes)), args.repeat),
+            )
+            # Пустые страницы дочитываются через PyPDF2
+            pdf_bytes = make_pdf(pages, blank_every=4, seed=args.seed)
+            report(
+                results,
+                "extract_text_from_pdf+blank",
+                pages,
+                "pages",
+                run(lambda: extract_text_from_pdf(io.BytesIO(pdf_bytes)), args.repeat),
+            )
+
+    for cases in args.cases:
+        response = generate_response_text(random.Random(args.seed), cases)
+        test_cases = parse_gemini_response(response)
+        if "parser" in args.only:
+            report(
+                results,
+                "parse_gemini_response",
+                cases,
+                "cases",
+                run(lambda: parse_gemini_response(response), args.repeat),
+            )
+        if "csv" in args.only:
+            report(
+                results,
+                "iter_csv_chunks",
+                cases,
+                "cases",
+                run(lambda: sum(map(len, iter_csv_chunks(test_cases))), args.repeat),
+            )
+        if "xlsx" in args.only:
+            report(
+                results,
+                "build_excel_file",
+                cases,
+                "cases",
+                run(lambda: build_excel_file(test_cases).close(), args.repeat),
+            )
+
+    if args.json:
+        write_json(args.json, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
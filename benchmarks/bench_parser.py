@@ -0,0 +1,272 @@
+"""
+Микро-бенчмарк и проверка эквивалентности для utils.parse_gemini_response.
+
+Сравнивает однопроходный парсер с прежней реализацией на регулярных выражениях
+(скопирована ниже как эталон): сначала случайные варианты текущего формата
+ответа Gemini должны давать одинаковый результат, затем замеряется время
+на больших ответах и на патологическом вводе. Те же ответы, поданные
+кусками в IncrementalResponseParser (как в /generate_stream), должны
+разбираться так же, как целиком.
+
+Запуск: python benchmarks/bench_parser.py [--cases 500] [--fuzz 2000] [--seed 0]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import IncrementalResponseParser, parse_gemini_response  # noqa: E402
+
+
+def legacy_parse_gemini_response(text_response: str) -> List[Dict[str, str]]:
+    """Прежняя реализация parse_gemini_response (эталон для сравнения)."""
+    test_cases = []
+    raw_cases = re.split(r"(?=\b(?:[0-9]+\.\s*)?Название:)", text_response.strip())
+
+    for case_text in raw_cases:
+        case_text = case_text.strip()
+        if not case_text:
+            continue
+
+        name = ""
+        steps_str = ""
+        expected_result = ""
+        test_type = ""
+
+        name_match = re.search(
+            r"(?:[0-9]+\.\s*)?Название:\s*(.+)", case_text, re.IGNORECASE
+        )
+        if name_match:
+            name = name_match.group(1).strip()
+
+        steps_match = re.search(
+            r'Шаги:\s*\n((?:\s*\d+\.\s*(?:(?!Ожидаемый результат:|Тип:)[\s\S])+(?:\n|$))+)',
+            case_text,
+            re.IGNORECASE
+        )
+        if steps_match:
+            steps_str = steps_match.group(1).strip()
+        else:
+            steps_match_alt = re.search(
+                r'Шаги:\s*\n([\s\S]+?)(?=\s*\n\s*(?:Ожидаемый результат:|Тип:|$))',
+                case_text,
+                re.IGNORECASE
+            )
+            if steps_match_alt:
+                steps_str = steps_match_alt.group(1).strip()
+
+        er_match = re.search(r"Ожидаемый результат:\s*(.+)", case_text, re.IGNORECASE)
+        if er_match:
+            expected_result = er_match.group(1).strip()
+            if "Тип:" in expected_result:
+                expected_result = expected_result.split("Тип:")[0].strip()
+
+        type_match = re.search(
+            r"Тип:\s*(Позитивный|Негативный)", case_text, re.IGNORECASE
+        )
+        if type_match:
+            test_type = type_match.group(1).strip().capitalize()
+
+        if name:
+            test_cases.append(
+                {
+                    "Название": name,
+                    "Шаги": steps_str,
+                    "Ожидаемый результат": expected_result,
+                    "Тип": (
+                        test_type
+                        if test_type in ["Позитивный", "Негативный"]
+                        else "Не определен"
+                    ),
+                }
+            )
+        elif case_text and len(case_text) > 20:
+            print(f"Could not parse block: {case_text[:100]}...")
+
+    return test_cases
+
+
+# --- Генерация ответов в текущем формате ---
+WORDS = (
+    "открыть страницу ввести логин пароль нажать кнопку войти проверить "
+    "сообщение об ошибке поле email форма регистрации пользователь корзина"
+).split()
+
+
+def _phrase(rng: random.Random, low: int = 2, high: int = 7) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def _marker(rng: random.Random, marker: str) -> str:
+    variant = rng.random()
+    if variant < 0.1:
+        return marker.lower()
+    if variant < 0.15:
+        return marker.upper()
+    return marker
+
+
+def generate_case(rng: random.Random, number: int) -> str:
+    indent = rng.choice(["", "   ", "\t"])
+    numbered = rng.random() < 0.8
+    lines = []
+
+    name_prefix = f"{number}. " if rng.random() < 0.7 else ""
+    if rng.random() < 0.05:
+        lines.append(f"{name_prefix}Название:")
+        lines.append(_phrase(rng))
+    else:
+        lines.append(f"{name_prefix}Название: {_phrase(rng)}")
+
+    if rng.random() < 0.95:
+        lines.append(rng.choice(["2. ", "", "**"]) + _marker(rng, "Шаги:") + rng.choice(["", " "]))
+        for step in range(1, rng.randint(1, 6) + 1):
+            if numbered:
+                step_text = f"{indent}{step}. {_phrase(rng)}"
+            else:
+                step_text = f"{indent}{rng.choice(['-', '*'])} {_phrase(rng)}"
+            if rng.random() < 0.03:
+                step_text += " (тип: admin)"
+            lines.append(step_text)
+            if rng.random() < 0.05:
+                lines.append("")
+
+    if rng.random() < 0.1:
+        lines.append("")
+    if rng.random() < 0.9:
+        expected = f"{rng.choice(['3. ', ''])}{_marker(rng, 'Ожидаемый результат:')} {_phrase(rng)}"
+        if rng.random() < 0.1:
+            expected += f" Тип: {rng.choice(['Позитивный', 'Негативный'])}"
+        lines.append(expected)
+        if rng.random() < 0.1:
+            lines.append(_phrase(rng))
+
+    if rng.random() < 0.9:
+        value = rng.choice(
+            ["Позитивный", "Негативный", "позитивный", "НЕГАТИВНЫЙ", "Граничный", ""]
+        )
+        type_marker = f"{rng.choice(['4. ', ''])}{_marker(rng, 'Тип:')}"
+        if value and rng.random() < 0.05:
+            # Значение на следующей строке
+            lines.extend([type_marker, value])
+        else:
+            lines.append(f"{type_marker} {value}".rstrip())
+    return "\n".join(lines)
+
+
+def generate_response(rng: random.Random, cases: int) -> str:
+    parts = []
+    if rng.random() < 0.3:
+        parts.append("Вот тест-кейсы, сгенерированные по требованиям:")
+    for number in range(1, cases + 1):
+        parts.append(generate_case(rng, number))
+    if rng.random() < 0.2:
+        parts.append("Если нужно, могу добавить ещё тест-кейсы.")
+    separator = rng.choice(["\n\n", "\n", "\n\n\n", "\n---\n"])
+    return separator.join(parts)
+
+
+def check_equivalence(iterations: int, seed: int) -> int:
+    rng = random.Random(seed)
+    mismatches = 0
+    for iteration in range(iterations):
+        response = generate_response(rng, rng.randint(1, 8))
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = legacy_parse_gemini_response(response)
+            actual = parse_gemini_response(response)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"Mismatch on iteration {iteration}:\n{response}\n")
+                print(f"  legacy: {expected}\n  new:    {actual}\n")
+    return mismatches
+
+
+def parse_streamed(rng: random.Random, text_response: str) -> List[Dict[str, str]]:
+    """Разбор ответа, пришедшего кусками случайной длины."""
+    parser = IncrementalResponseParser()
+    test_cases: List[Dict[str, str]] = []
+    position = 0
+    while position < len(text_response):
+        size = rng.randint(1, 80)
+        test_cases.extend(parser.feed(text_response[position : position + size]))
+        position += size
+    test_cases.extend(parser.close())
+    return test_cases
+
+
+def check_streaming(iterations: int, seed: int) -> int:
+    rng = random.Random(seed)
+    mismatches = 0
+    for iteration in range(iterations):
+        response = generate_response(rng, rng.randint(1, 8))
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = parse_gemini_response(response)
+            actual = parse_streamed(rng, response)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 3:
+                print(f"Streaming mismatch on iteration {iteration}:\n{response}\n")
+                print(f"  whole:    {expected}\n  streamed: {actual}\n")
+    return mismatches
+
+
+def bench(func, text: str, repeat: int) -> float:
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func(text)
+            best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--fuzz", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mismatches = check_equivalence(args.fuzz, args.seed)
+    print(f"equivalence: {args.fuzz - mismatches}/{args.fuzz} responses identical")
+    streaming_mismatches = check_streaming(args.fuzz, args.seed)
+    print(
+        f"streaming: {args.fuzz - streaming_mismatches}/{args.fuzz} responses "
+        f"parsed the same as whole"
+    )
+
+    rng = random.Random(args.seed)
+    response = "\n\n".join(generate_case(rng, n) for n in range(1, args.cases + 1))
+    legacy_time = bench(legacy_parse_gemini_response, response, args.repeat)
+    new_time = bench(parse_gemini_response, response, args.repeat)
+    print(
+        f"{args.cases} cases ({len(response)} chars): "
+        f"legacy {legacy_time * 1000:.2f} ms, single-pass {new_time * 1000:.2f} ms"
+    )
+
+    # Патологический ввод: на каждом "Шаги:" старые шаблоны просматривают
+    # весь хвост ответа, время растёт квадратично; новый парсер линеен
+    for size in (500, 1000, 2000):
+        pathological = "Название: x\n" + "Шаги:\n" * size + "x"
+        legacy_time = bench(legacy_parse_gemini_response, pathological, 1)
+        new_time = bench(parse_gemini_response, pathological, 1)
+        print(
+            f"pathological n={size}: legacy {legacy_time * 1000:.2f} ms, "
+            f"single-pass {new_time * 1000:.2f} ms"
+        )
+
+    sys.exit(1 if mismatches or streaming_mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
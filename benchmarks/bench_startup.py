@@ -0,0 +1,125 @@
+"""
+Бенчмарк старта воркера: сколько стоит import main и что при этом импортируется.
+
+Запускает `python -X importtime -c "import main"` в отдельном процессе (чистый
+кэш модулей) несколько раз и выводит медиану общего времени импорта,
+накопленное время по модулям проекта и самым долгим зависимостям, а также
+отдельно цену импорта отложенных зависимостей. Тяжёлые зависимости (pandas,
+openpyxl, pdfplumber, PyPDF2, google.generativeai) должны подгружаться лениво;
+если какая-то из них импортируется при старте или время импорта превышает
+--max-ms, скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/bench_startup.py [--runs 5] [--top 15] [--max-ms 0]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROJECT_MODULES = (
+    "main",
+    "utils",
+    "gemini_client",
+    "cache",
+    "database",
+    "stores",
+    "models",
+    "history",
+    "dedup",
+    "batch",
+    "documents",
+    "exporters",
+    "serialization",
+)
+# Эти зависимости не должны импортироваться при старте
+LAZY_MODULES = (
+    "pandas",
+    "openpyxl",
+    "pdfplumber",
+    "PyPDF2",
+    "google.generativeai",
+    "google.api_core",
+    "sqlalchemy",
+    "numpy",
+)
+
+# "import time:       123 |       4567 |   package.module"
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+
+def measure_import(module: str) -> Dict[str, int]:
+    """Накопленное время импорта (мкс) каждого модуля при одном `import module`."""
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "benchmark"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="сколько самых долгих модулей показать")
+    parser.add_argument("--max-ms", type=float, default=0, help="порог для import main, 0 - без порога")
+    args = parser.parse_args()
+
+    # Первый запуск прогревает файловый кэш и байткод зависимостей и не учитывается
+    measure_import("main")
+    runs: List[Dict[str, int]] = [measure_import("main") for _ in range(args.runs)]
+
+    def median_ms(name: str) -> float:
+        return statistics.median(run.get(name, 0) for run in runs) / 1000
+
+    total_ms = median_ms("main")
+    print(f"import main: {total_ms:.1f} ms (median of {args.runs})")
+
+    print("\nproject modules (cumulative):")
+    for name in PROJECT_MODULES:
+        if name in runs[0]:
+            print(f"  {name:<24} {median_ms(name):8.1f} ms")
+
+    print(f"\ntop {args.top} imports (cumulative):")
+    names = sorted(runs[0], key=median_ms, reverse=True)
+    for name in [n for n in names if n not in PROJECT_MODULES][: args.top]:
+        print(f"  {name:<40} {median_ms(name):8.1f} ms")
+
+    eager = [name for name in LAZY_MODULES if name in runs[0]]
+    print("\nlazy dependencies imported at startup:", ", ".join(eager) or "none")
+
+    # Цена, которую платит прогрев или первый запрос, которому модуль нужен
+    print("\ndeferred import cost (standalone):")
+    for name in LAZY_MODULES:
+        try:
+            standalone = [measure_import(name).get(name, 0) for _ in range(args.runs)]
+        except subprocess.CalledProcessError:
+            print(f"  {name:<24} not installed")
+            continue
+        print(f"  {name:<24} {statistics.median(standalone) / 1000:8.1f} ms")
+
+    ok = not eager and (not args.max_ms or total_ms <= args.max_ms)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Бенчмарк проверки и сериализации больших списков тест-кейсов: стоимость
+на один тест-кейс до и после перехода на общий адаптер и компактные строки.
+
+Прежний путь (скопирован ниже как эталон): FastAPI разбирает тело json.loads,
+проверяет ExportRequest моделью pydantic, эндпоинт вызывает model_dump на каждой
+строке, CSV собирается из словарей, ответ /generate проходит jsonable_encoder
+и json.dumps. Новый путь: один вызов TypeAdapter.validate_json по байтам тела,
+кортежи вместо словарей при экспорте, ответ сразу в байты (orjson).
+Перед замером проверяется, что результаты совпадают.
+
+Запуск: python benchmarks/bench_validation.py [--cases 1000 10000 50000]
+        [--repeat 5] [--json report.json]
+"""
+
+import argparse
+import csv
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from exporters import (  # noqa: E402
+    CSV_BOM,
+    EXPORT_COLUMNS,
+    _ChunkBuffer,
+    iter_csv_rows,
+    normalize_steps,
+    test_case_rows,
+)
+from serialization import dumps_bytes, orjson, validate_export_payload  # noqa: E402
+from utils import parse_gemini_response  # noqa: E402
+
+from fake_gemini import generate_response_text  # noqa: E402
+from report import write_json  # noqa: E402
+
+
+class TestCase(BaseModel):
+    """Прежняя модель запроса экспорта (эталон для сравнения)."""
+
+    Название: str
+    Шаги: str
+    Ожидаемый_результат: str = Field(..., alias="Ожидаемый результат")
+    Тип: str
+
+
+class ExportRequest(BaseModel):
+    test_cases: List[TestCase]
+
+
+def legacy_validate(body: bytes) -> List[Dict[str, str]]:
+    payload = ExportRequest.model_validate(json.loads(body))
+    return [tc.model_dump(by_alias=True) for tc in payload.test_cases]
+
+
+def new_validate(body: bytes) -> List[tuple]:
+    return list(test_case_rows(validate_export_payload(body)))
+
+
+def legacy_csv(test_cases: List[Dict[str, str]]) -> str:
+    """Прежний iter_csv_chunks: строка списком из словаря, по одной записи."""
+    buffer = _ChunkBuffer()
+    writer = csv.writer(buffer, lineterminator="\n")
+    buffer.write(CSV_BOM)
+    writer.writerow(EXPORT_COLUMNS)
+    for test_case in test_cases:
+        row = [test_case.get(column, "") for column in EXPORT_COLUMNS]
+        row[1] = normalize_steps(row[1]).replace("\n", "; ")
+        writer.writerow(row)
+    return buffer.drain()
+
+
+def new_csv(rows: List[tuple]) -> str:
+    return "".join(iter_csv_rows(rows))
+
+
+def legacy_encode(result: Dict) -> bytes:
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+def new_encode(result: Dict) -> bytes:
+    return dumps_bytes(result)
+
+
+def best_of(func: Callable, data, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def generate_test_cases(count: int, seed: int) -> List[Dict[str, str]]:
+    rng = random.Random(seed)
+    test_cases: List[Dict[str, str]] = []
+    while len(test_cases) < count:
+        test_cases.extend(parse_gemini_response(generate_response_text(rng, 100)))
+    return test_cases[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="файл для JSON-отчёта, - для stdout")
+    args = parser.parse_args()
+
+    sample = generate_test_cases(500, args.seed)
+    body = json.dumps({"test_cases": sample}, ensure_ascii=False).encode("utf-8")
+    rows = new_validate(body)
+    checks = {
+        "validate": [tuple(tc.values()) for tc in legacy_validate(body)] == rows,
+        "csv": legacy_csv(sample) == new_csv(rows),
+        "encode": json.loads(legacy_encode({"test_cases": sample}))
+        == json.loads(new_encode({"test_cases": sample})),
+    }
+    for name, identical in checks.items():
+        print(f"{name} equivalence: {'identical' if identical else 'MISMATCH'}")
+    print(f"json encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+
+    results = []
+    for count in args.cases:
+        test_cases = generate_test_cases(count, args.seed)
+        body = json.dumps({"test_cases": test_cases}, ensure_ascii=False).encode("utf-8")
+        rows = new_validate(body)
+        result = {"test_cases": test_cases, "usage": {"calls": 1}}
+        for stage, legacy, new, legacy_input, new_input in (
+            ("validate", legacy_validate, new_validate, body, body),
+            ("csv", legacy_csv, new_csv, test_cases, rows),
+            ("encode", legacy_encode, new_encode, result, result),
+        ):
+            legacy_time = best_of(legacy, legacy_input, args.repeat)
+            new_time = best_of(new, new_input, args.repeat)
+            results.append(
+                {
+                    "stage": stage,
+                    "cases": count,
+                    "legacy_us_per_case": round(legacy_time / count * 1e6, 3),
+                    "new_us_per_case": round(new_time / count * 1e6, 3),
+                    "speedup": round(legacy_time / new_time, 2) if new_time else None,
+                }
+            )
+            print(
+                f"{stage:<8} {count:>6} cases: legacy {legacy_time / count * 1e6:7.2f} us/case, "
+                f"new {new_time / count * 1e6:7.2f} us/case ({legacy_time / new_time:.1f}x)"
+            )
+
+    if args.json:
+        write_json(args.json, "validation", vars(args), results)
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Локальная замена модели Gemini для бенчмарков: без сети и API-ключа.
+
+FakeGeminiModel повторяет интерфейс google.generativeai.GenerativeModel, которым
+пользуется приложение (generate_content_async, в том числе stream=True,
+model_name), и по кругу отдаёт записанные ответы с настраиваемой задержкой и
+долей ошибок. Ошибки - исключения google.api_core (503 и 429), поэтому
+срабатывают настоящие повторы и учёт ошибок в GeminiCallPool.
+
+Записанные ответы - файл JSONL с полем "text" (или "response") на строку либо
+каталог с .txt-файлами; без записей ответы генерируются детерминированно.
+
+Подключение: main.model = FakeGeminiModel(...) после import main.
+"""
+
+import asyncio
+import json
+import random
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+WORDS = (
+    "открыть страницу ввести логин пароль нажать кнопку войти проверить "
+    "сообщение об ошибке поле email форма регистрации пользователь корзина"
+).split()
+
+# Примерно столько символов ответа приходится на один токен
+CHARS_PER_TOKEN = 3
+
+
+def _phrase(rng: random.Random, low: int = 2, high: int = 7) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def generate_response_text(rng: random.Random, cases: int) -> str:
+    """Ответ в формате, который просит промпт по умолчанию."""
+    blocks = []
+    for number in range(1, cases + 1):
+        steps = "\n".join(
+            f"   {step}. {_phrase(rng)}" for step in range(1, rng.randint(2, 6) + 1)
+        )
+        blocks.append(
+            f"{number}. Название: {_phrase(rng)}\n"
+            f"2. Шаги:\n{steps}\n"
+            f"3. Ожидаемый результат: {_phrase(rng)}\n"
+            f"4. Тип: {rng.choice(['Позитивный', 'Негативный'])}"
+        )
+    return "\n\n".join(blocks)
+
+
+def text_to_json_response(text: str) -> str:
+    """Тот же ответ в режиме output_format=json (массив объектов по схеме)."""
+    from utils import parse_gemini_response
+
+    return json.dumps(parse_gemini_response(text), ensure_ascii=False)
+
+
+def load_recorded_responses(path: Path) -> List[str]:
+    if path.is_dir():
+        return [
+            response_file.read_text(encoding="utf-8")
+            for response_file in sorted(path.glob("*.txt"))
+        ]
+    responses = []
+    with open(path, encoding="utf-8") as recorded_file:
+        for line in recorded_file:
+            if line.strip():
+                record = json.loads(line)
+                responses.append(record.get("text") or record.get("response") or "")
+    return responses
+
+
+def _response(text: str, prompt_chars: int):
+    """Объект с теми полями ответа SDK, которые читает приложение."""
+    prompt_tokens = prompt_chars // CHARS_PER_TOKEN + 1
+    output_tokens = len(text) // CHARS_PER_TOKEN + 1
+    return SimpleNamespace(
+        text=text,
+        parts=[SimpleNamespace(text=text)],
+        prompt_feedback=None,
+        candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name="STOP"))],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        ),
+    )
+
+
+class FakeGeminiModel:
+    """
+    latency - средняя задержка ответа (секунды), jitter - разброс в долях от неё,
+    error_rate - доля вызовов, завершающихся ошибкой; среди ошибок
+    rate_limit_share приходится на 429, остальные - 503.
+    """
+
+    model_name = "models/fake-gemini"
+
+    def __init__(
+        self,
+        responses: Optional[List[str]] = None,
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        rate_limit_share: float = 0.5,
+        stream_chunks: int = 8,
+        seed: int = 0,
+    ):
+        self.rng = random.Random(seed)
+        self.responses = responses or [
+            generate_response_text(self.rng, self.rng.randint(5, 15)) for _ in range(20)
+        ]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share
+        self.stream_chunks = max(stream_chunks, 1)
+        self._next = 0
+        self.stats: Dict[str, int] = {"calls": 0, "errors": 0, "streams": 0}
+
+    def _delay(self) -> float:
+        spread = self.latency * self.jitter
+        return max(0.0, self.rng.uniform(self.latency - spread, self.latency + spread))
+
+    def _maybe_fail(self) -> None:
+        if self.rng.random() >= self.error_rate:
+            return
+        self.stats["errors"] += 1
+        if self.rng.random() < self.rate_limit_share:
+            raise google_exceptions.TooManyRequests("fake Gemini: rate limited")
+        raise google_exceptions.ServiceUnavailable("fake Gemini: unavailable")
+
+    def _next_text(self, generation_config: Optional[Dict]) -> str:
+        text = self.responses[self._next % len(self.responses)]
+        self._next += 1
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            text = text_to_json_response(text)
+        return text
+
+    async def generate_content_async(
+        self, contents, stream: bool = False, generation_config=None, **kwargs
+    ):
+        self.stats["calls"] += 1
+        prompt_chars = len(json.dumps(contents, ensure_ascii=False, default=str))
+        if stream:
+            self.stats["streams"] += 1
+            # Задержка до первого куска, остальное время - между кусками
+            await asyncio.sleep(self._delay() / 2)
+            self._maybe_fail()
+            return self._stream(self._next_text(generation_config), prompt_chars)
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        return _response(self._next_text(generation_config), prompt_chars)
+
+    async def _stream(self, text: str, prompt_chars: int):
+        step = max(1, -(-len(text) // self.stream_chunks))
+        pause = self._delay() / 2 / self.stream_chunks
+        for position in range(0, len(text), step):
+            await asyncio.sleep(pause)
+            chunk = _response(text[position : position + step], 0)
+            if position + step >= len(text):
+                # Итоговый расход токенов SDK отдаёт в последнем куске
+                chunk.usage_metadata = _response(text, prompt_chars).usage_metadata
+            yield chunk
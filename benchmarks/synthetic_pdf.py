@@ -0,0 +1,137 @@
+"""
+Генератор синтетических PDF с требованиями для бенчмарков: N страниц текста
+без внешних зависимостей (PDF 1.4 собирается вручную, шрифт Helvetica).
+
+Текст латиницей: стандартные шрифты PDF не содержат кириллицы. Каждая
+blank_every-я страница пустая, чтобы задействовать запасной путь через PyPDF2.
+С boilerplate на страницах есть колонтитулы и номера, а первая страница -
+оглавление и таблица версий, как в настоящих спецификациях.
+
+Запуск: python benchmarks/synthetic_pdf.py --pages 50 --out requirements.pdf
+"""
+
+import argparse
+import random
+from typing import List
+
+WORDS = (
+    "user login password page button form field email cart order payment "
+    "must should display error message valid invalid account profile search"
+).split()
+
+
+def requirement_lines(rng: random.Random, page: int, count: int) -> List[str]:
+    lines = [f"Section {page + 1}. Requirements"]
+    for number in range(1, count):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 12)))
+        lines.append(f"{page + 1}.{number} The system {words}.")
+    return lines
+
+
+def boilerplate_lines(page: int, pages: int) -> tuple:
+    """Колонтитулы страницы: (строки сверху, строки снизу)."""
+    header = ["ACME Corp. Software Requirements Specification v2.3   Confidential"]
+    footer = [f"Document SRS-2024-17, revision 2.3, printed 2024-03-0{page % 9 + 1}",
+              f"Page {page + 1} of {pages}"]
+    if page == 0:
+        toc = ["Table of Contents"] + [
+            f"Section {number}. Requirements {'.' * 40} {number}"
+            for number in range(1, min(pages, 20) + 1)
+        ]
+        revisions = ["Revision History", "Version  Date  Author  Description"] + [
+            f"2.{number} 2024-0{number % 9 + 1}-1{number} J. Smith Updated requirements"
+            for number in range(4)
+        ]
+        header += toc + revisions
+    return header, footer
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(
+    pages: int,
+    lines_per_page: int = 40,
+    blank_every: int = 0,
+    seed: int = 0,
+    boilerplate: bool = False,
+) -> bytes:
+    """PDF из pages страниц по lines_per_page строк (плюс колонтитулы с boilerplate)."""
+    rng = random.Random(seed)
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    content_ids = []
+    for page in range(pages):
+        if blank_every and page % blank_every == blank_every - 1:
+            stream = b""
+        else:
+            lines = requirement_lines(rng, page, lines_per_page)
+            if boilerplate:
+                header, footer = boilerplate_lines(page, pages)
+                lines = header + lines + footer
+            # Строки, не поместившиеся на страницу, уходят ниже края - текст
+            # всё равно извлекается
+            stream = "\n".join(
+                f"BT /F1 10 Tf 40 {800 - index * 18} Td ({_escape(line)}) Tj ET"
+                for index, line in enumerate(lines)
+            ).encode("latin-1")
+        content_ids.append(
+            add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        )
+
+    # Страницы ссылаются на узел /Pages, который добавляется после них
+    pages_id = len(objects) + pages + 1
+    page_ids = [
+        add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id, font_id)
+        )
+        for content_id in content_ids
+    ]
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for object_id, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        catalog_id,
+        xref_offset,
+    )
+    return bytes(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=40, help="строк на странице")
+    parser.add_argument("--blank-every", type=int, default=0, help="каждая N-я страница пустая")
+    parser.add_argument("--boilerplate", action="store_true", help="колонтитулы и оглавление")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic.pdf")
+    args = parser.parse_args()
+
+    pdf_bytes = make_pdf(
+        args.pages, args.lines, args.blank_every, args.seed, args.boilerplate
+    )
+    with open(args.out, "wb") as pdf_file:
+        pdf_file.write(pdf_bytes)
+    print(f"{args.out}: {args.pages} pages, {len(pdf_bytes)} bytes")
+
+
+if __name__ == "__main__":
+    main()
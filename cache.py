@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import PDF_FINGERPRINT_PREFIX
+from stores import (
+    SQLiteCacheStore,
+    SQLitePdfTextStore,
+    SQLiteResultStore,
+    CACHE_DB_PATH,
+)
+
+# --- Настройки кэша генераций ---
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "1") == "1"
+GENERATION_CACHE_TTL_SECONDS = float(
+    os.getenv("GENERATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600))
+)
+GENERATION_CACHE_MEMORY_ENTRIES = int(os.getenv("GENERATION_CACHE_MEMORY_ENTRIES", "256"))
+GENERATION_CACHE_DISK_ENTRIES = int(os.getenv("GENERATION_CACHE_DISK_ENTRIES", "10000"))
+
+# --- Настройки кэша извлечённого текста PDF ---
+PDF_TEXT_CACHE_ENABLED = os.getenv("PDF_TEXT_CACHE_ENABLED", "1") == "1"
+PDF_TEXT_CACHE_MAX_MB = float(os.getenv("PDF_TEXT_CACHE_MAX_MB", "256"))
+PDF_TEXT_CACHE_MAX_DOCUMENTS = int(os.getenv("PDF_TEXT_CACHE_MAX_DOCUMENTS", "10000"))
+
+# --- Настройки хранилища результатов для экспорта по ID ---
+RESULT_STORE_ENABLED = os.getenv("RESULT_STORE_ENABLED", "1") == "1"
+RESULT_TTL_SECONDS = float(os.getenv("RESULT_TTL_SECONDS", str(24 * 3600)))
+RESULT_MEMORY_ENTRIES = int(os.getenv("RESULT_MEMORY_ENTRIES", "64"))
+RESULT_DISK_ENTRIES = int(os.getenv("RESULT_DISK_ENTRIES", "10000"))
+
+
+def make_cache_key(prompt: str, model_name: str, generation_config: Dict) -> str:
+    """SHA-256 от финального промпта, имени модели и настроек генерации."""
+    hasher = hashlib.sha256()
+    hasher.update(model_name.encode("utf-8"))
+    hasher.update(b"\x00")
+    hasher.update(json.dumps(generation_config, sort_keys=True).encode("utf-8"))
+    hasher.update(b"\x00")
+    hasher.update(prompt.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class LRUCache:
+    """In-process LRU с ограничением по числу записей и TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        created_at, value = item
+        if self.ttl_seconds and time.monotonic() - created_at > self.ttl_seconds:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> int:
+        return 1 if self._data.pop(key, None) is not None else 0
+
+    def clear(self) -> int:
+        count = len(self._data)
+        self._data.clear()
+        return count
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class GenerationCache:
+    """
+    Двухуровневый кэш распарсенных тест-кейсов: LRU в памяти + SQLite на диске.
+    Обращения к SQLite выполняются в отдельном потоке.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCacheStore] = None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        """Возвращает (значение, уровень), где уровень - "memory" или "disk"."""
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.memory.set(key, value)
+                return value, "disk"
+        return None, None
+
+    async def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    async def purge(self, key: Optional[str] = None) -> int:
+        """Удаляет одну запись (если указан key) или весь кэш. Возвращает число удалённых."""
+        if key:
+            removed = self.memory.delete(key)
+            if self.disk is not None:
+                removed = max(removed, await asyncio.to_thread(self.disk.delete, key))
+            return removed
+        removed = self.memory.clear()
+        if self.disk is not None:
+            removed = max(removed, await asyncio.to_thread(self.disk.clear))
+        return removed
+
+
+def create_generation_cache() -> GenerationCache:
+    disk_store = None
+    try:
+        disk_store = SQLiteCacheStore(
+            CACHE_DB_PATH,
+            ttl_seconds=GENERATION_CACHE_TTL_SECONDS,
+            max_entries=GENERATION_CACHE_DISK_ENTRIES,
+        )
+    except Exception as e:
+        print(f"Warning: SQLite cache at {CACHE_DB_PATH} is unavailable: {e}")
+    return GenerationCache(
+        LRUCache(GENERATION_CACHE_MEMORY_ENTRIES, GENERATION_CACHE_TTL_SECONDS),
+        disk_store,
+    )
+
+
+class PdfTextCache:
+    """
+    Асинхронная обёртка над SQLitePdfTextStore. Без хранилища (кэш выключен
+    или SQLite недоступен) ничего не находит и ничего не сохраняет.
+    """
+
+    def __init__(self, store: Optional[SQLitePdfTextStore] = None):
+        self.store = store
+
+    async def get_page_hashes(self, doc_hash: str) -> Optional[List[str]]:
+        if self.store is None:
+            return None
+        page_hashes = await asyncio.to_thread(self.store.get_page_hashes, doc_hash)
+        # Отпечатки прежнего формата (без ресурсов страницы) могли совпадать у
+        # разных документов: такой документ отпечатывается заново
+        if page_hashes and not all(
+            page_hash.startswith(PDF_FINGERPRINT_PREFIX) for page_hash in page_hashes
+        ):
+            return None
+        return page_hashes
+
+    async def get_pages(self, page_hashes: List[str]) -> Dict[str, str]:
+        if self.store is None or not page_hashes:
+            return {}
+        return await asyncio.to_thread(self.store.get_pages, page_hashes)
+
+    async def put(
+        self, doc_hash: str, page_hashes: List[str], pages: Dict[str, str]
+    ) -> None:
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, doc_hash, page_hashes, pages)
+
+    async def purge(self) -> int:
+        if self.store is None:
+            return 0
+        return await asyncio.to_thread(self.store.clear)
+
+
+def create_pdf_text_cache() -> PdfTextCache:
+    if not PDF_TEXT_CACHE_ENABLED:
+        return PdfTextCache()
+    try:
+        return PdfTextCache(
+            SQLitePdfTextStore(
+                CACHE_DB_PATH,
+                max_bytes=int(PDF_TEXT_CACHE_MAX_MB * 1024 * 1024),
+                max_documents=PDF_TEXT_CACHE_MAX_DOCUMENTS,
+            )
+        )
+    except Exception as e:
+        print(f"Warning: PDF text cache at {CACHE_DB_PATH} is unavailable: {e}")
+        return PdfTextCache()
+
+
+class ResultStore:
+    """
+    Результаты генераций под случайным ID, чтобы экспорт не пересылал
+    тест-кейсы обратно на сервер. Свежие результаты - в LRU процесса, все -
+    в SQLite (экспорт может прийти в другой воркер). Тест-кейсы сохраняются
+    уже проверенными и отдаются как есть.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteResultStore] = None):
+        self.memory = memory
+        self.disk = disk
+
+    @property
+    def enabled(self) -> bool:
+        return self.disk is not None
+
+    async def put(self, test_cases: List[Dict[str, str]]) -> Optional[str]:
+        """Сохраняет тест-кейсы и возвращает ID результата (None, если хранилище выключено)."""
+        if self.disk is None:
+            return None
+        result_id = uuid.uuid4().hex
+        test_cases_jsonl = "\n".join(
+            json.dumps(test_case, ensure_ascii=False) for test_case in test_cases
+        )
+        await asyncio.to_thread(self.disk.set, result_id, test_cases_jsonl)
+        self.memory.set(result_id, test_cases)
+        return result_id
+
+    async def get(self, result_id: str) -> Optional[List[Dict[str, str]]]:
+        test_cases = self.memory.get(result_id)
+        if test_cases is not None or self.disk is None:
+            return test_cases
+        test_cases_jsonl = await asyncio.to_thread(self.disk.get, result_id)
+        if test_cases_jsonl is None:
+            return None
+        test_cases = [json.loads(line) for line in test_cases_jsonl.splitlines() if line]
+        self.memory.set(result_id, test_cases)
+        return test_cases
+
+
+def create_result_store() -> ResultStore:
+    memory = LRUCache(RESULT_MEMORY_ENTRIES, RESULT_TTL_SECONDS)
+    if not RESULT_STORE_ENABLED:
+        return ResultStore(memory)
+    try:
+        return ResultStore(
+            memory,
+            SQLiteResultStore(
+                CACHE_DB_PATH,
+                ttl_seconds=RESULT_TTL_SECONDS,
+                max_entries=RESULT_DISK_ENTRIES,
+            ),
+        )
+    except Exception as e:
+        print(f"Warning: result store at {CACHE_DB_PATH} is unavailable: {e}")
+        return ResultStore(memory)
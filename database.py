@@ -0,0 +1,47 @@
+import os
+from typing import TYPE_CHECKING
+
+from stores import BASE_DIR
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+# --- SQLAlchemy: история генераций ---
+# В docker-compose это PostgreSQL (asyncpg), локально по умолчанию - файл SQLite
+DATABASE_URL = os.getenv(
+    "DATABASE_URL", f"sqlite+aiosqlite:///{BASE_DIR / 'history.sqlite3'}"
+)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def create_db_engine(url: str = DATABASE_URL) -> "AsyncEngine":
+    """
+    Асинхронный движок. Для SQLite включается WAL (чтения не ждут пакетную
+    запись истории), для серверных БД - пул с проверкой и пересозданием соединений.
+    SQLAlchemy импортируется здесь: при HISTORY_ENABLED=0 она не загружается вовсе.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if url.startswith("sqlite"):
+        engine = create_async_engine(url, connect_args={"timeout": DB_POOL_TIMEOUT})
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+        return engine
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
@@ -0,0 +1,162 @@
+import os
+import re
+import hashlib
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# --- Схлопывание почти одинаковых тест-кейсов ---
+# Выключено по умолчанию: включается формой (dedup=true) или DEDUP_ENABLED=1
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "0") == "1"
+# Порог сходства Жаккара по шинглам, начиная с которого кейсы считаются дублями
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+DEDUP_NUM_PERM = 64
+SHINGLE_SIZE = 2
+
+# Шинглы - 32-битные хэши, перестановки (a * x + b) mod p с p = 2^31 - 1:
+# произведение укладывается в uint64
+_PRIME = (1 << 31) - 1
+_WORD_RE = re.compile(r"\w+")
+# Нумерация шагов не влияет на смысл кейса
+_STEP_NUMBER_RE = re.compile(r"(?m)^\s*\d+\.\s*")
+
+
+@lru_cache(maxsize=None)
+def _permutations() -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    Одни и те же перестановки для всех индексов, чтобы сигнатуры были сравнимы.
+    numpy импортируется при первом схлопывании, а не при старте воркера.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    return (
+        rng.integers(1, _PRIME, DEDUP_NUM_PERM, dtype=np.uint64),
+        rng.integers(0, _PRIME, DEDUP_NUM_PERM, dtype=np.uint64),
+    )
+
+
+def case_shingles(test_case: Dict[str, str]) -> Set[int]:
+    """Хэши словесных n-грамм названия, шагов и ожидаемого результата."""
+    text = " ".join(
+        (
+            test_case.get("Название", ""),
+            _STEP_NUMBER_RE.sub(" ", test_case.get("Шаги", "")),
+            test_case.get("Ожидаемый результат", ""),
+        )
+    )
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        words = words + [""] * (SHINGLE_SIZE - len(words))
+    return {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(words[i : i + SHINGLE_SIZE]).encode("utf-8"), digest_size=4
+            ).digest(),
+            "little",
+        )
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def case_type(test_case: Dict[str, str]) -> str:
+    return " ".join(test_case.get("Тип", "").split()).lower()
+
+
+def minhash_signature(shingles: Set[int]) -> "np.ndarray":
+    import numpy as np
+
+    perm_a, perm_b = _permutations()
+    values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    return ((np.outer(values, perm_a) + perm_b) % _PRIME).min(axis=0)
+
+
+def jaccard(first: Set[int], second: Set[int]) -> float:
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    Разбиение сигнатуры на bands полос по rows значений. Порог LSH
+    (1/bands)^(1/rows) берём заметно ниже порога сходства, чтобы не терять
+    дубли: кандидаты всё равно проверяются точным Жаккаром.
+    """
+    target = threshold * 0.8
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= target:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Инкрементальный LSH-индекс по MinHash-сигнатурам тест-кейсов.
+    add() возвращает номер уже добавленного кейса, дублем которого является
+    новый, или None, если кейс новый (тогда он попадает в индекс).
+    Корзины LSH свои для каждого значения "Тип": позитивный и негативный
+    кейсы, отличающиеся одним словом в шагах, дублями не считаются.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.bands, self.rows = choose_bands(DEDUP_NUM_PERM, threshold)
+        self._buckets: List[Dict[Tuple[str, bytes], List[int]]] = [
+            {} for _ in range(self.bands)
+        ]
+        self._shingles: List[Set[int]] = []
+
+    def add(self, test_case: Dict[str, str]) -> Optional[int]:
+        shingles = case_shingles(test_case)
+        signature = minhash_signature(shingles)
+        test_case_type = case_type(test_case)
+        band_keys = [
+            (
+                test_case_type,
+                signature[band * self.rows : (band + 1) * self.rows].tobytes(),
+            )
+            for band in range(self.bands)
+        ]
+        candidates: Set[int] = set()
+        for buckets, key in zip(self._buckets, band_keys):
+            candidates.update(buckets.get(key, ()))
+        for candidate in sorted(candidates):
+            if jaccard(shingles, self._shingles[candidate]) >= self.threshold:
+                return candidate
+
+        index = len(self._shingles)
+        self._shingles.append(shingles)
+        for buckets, key in zip(self._buckets, band_keys):
+            buckets.setdefault(key, []).append(index)
+        return None
+
+
+def collapse_near_duplicates(
+    test_cases: List[Dict[str, str]], threshold: float = DEDUP_THRESHOLD
+) -> Tuple[List[Dict[str, str]], List[List[int]]]:
+    """
+    Оставляет первый кейс из каждой группы почти одинаковых.
+    Возвращает (оставшиеся кейсы, группы [индекс оставленного, индексы дублей...]).
+    """
+    index = NearDuplicateIndex(threshold)
+    kept: List[Dict[str, str]] = []
+    kept_positions: List[int] = []
+    groups: Dict[int, List[int]] = {}
+    for position, test_case in enumerate(test_cases):
+        original = index.add(test_case)
+        if original is None:
+            kept.append(test_case)
+            kept_positions.append(position)
+        else:
+            groups.setdefault(kept_positions[original], []).append(position)
+    clusters = [
+        [kept_position, *groups[kept_position]] for kept_position in sorted(groups)
+    ]
+    return kept, clusters
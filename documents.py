@@ -0,0 +1,145 @@
+import os
+import re
+import asyncio
+import hashlib
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from stores import SQLiteDocumentStore, DOCUMENTS_DB_PATH
+
+# --- Настройки инкрементальной генерации по версиям документа ---
+DOCUMENTS_ENABLED = os.getenv("DOCUMENTS_ENABLED", "1") == "1"
+DOCUMENT_VERSIONS_KEPT = int(os.getenv("DOCUMENT_VERSIONS_KEPT", "5"))
+# Разделы короче присоединяются к следующему: у заголовка без текста нет тест-кейсов
+DOCUMENT_SECTION_MIN_CHARS = int(os.getenv("DOCUMENT_SECTION_MIN_CHARS", "400"))
+
+# Статусы разделов (и тест-кейсов) относительно предыдущей версии
+SECTION_NEW = "new"
+SECTION_CHANGED = "changed"
+SECTION_CARRIED_OVER = "carried_over"
+SECTION_STATUSES = (SECTION_NEW, SECTION_CHANGED, SECTION_CARRIED_OVER)
+
+# Номер раздела в начале заголовка ("3.", "2.1"): удаление раздела сдвигает
+# номера следующих, но не делает их изменёнными
+_SECTION_NUMBER_RE = re.compile(r"^\s*(?:\d+\.)*\d+\.?\s+")
+
+
+def section_heading(section: str) -> str:
+    """Первая непустая строка раздела - по ней изменённый раздел узнаётся в новой версии."""
+    for line in section.splitlines():
+        if line.strip():
+            return " ".join(line.split())[:200]
+    return ""
+
+
+def _heading_key(heading: str) -> str:
+    return _SECTION_NUMBER_RE.sub("", heading).lower()
+
+
+def section_hash(section: str, settings_key: str) -> str:
+    """
+    Хэш раздела без учёта номера в заголовке, переносов строк и пробелов.
+    В хэш входит ключ настроек генерации (промпт, модель, формат): при их
+    смене все разделы считаются изменёнными.
+    """
+    hasher = hashlib.sha256(settings_key.encode("utf-8"))
+    hasher.update(b"\n")
+    text = " ".join(_SECTION_NUMBER_RE.sub("", section.lstrip(), count=1).split())
+    hasher.update(text.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def diff_sections(
+    previous_sections: List[Dict[str, Any]], sections: List[str], settings_key: str
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Сравнивает разделы новой версии с разделами предыдущей. Раздел с тем же
+    хэшем переносится вместе с тест-кейсами, раздел с тем же заголовком (без
+    учёта номера), но другим текстом - изменён, остальные - новые.
+    Возвращает (план по разделам в порядке документа, сколько разделов
+    прошлой версии удалено).
+    """
+    positions_by_hash: Dict[str, List[int]] = {}
+    for position, previous in enumerate(previous_sections):
+        positions_by_hash.setdefault(previous["hash"], []).append(position)
+
+    plan: List[Dict[str, Any]] = []
+    matched = set()
+    for index, section in enumerate(sections):
+        entry = {
+            "index": index,
+            "heading": section_heading(section),
+            "hash": section_hash(section, settings_key),
+            "text": section,
+            "status": None,
+        }
+        positions = positions_by_hash.get(entry["hash"])
+        if positions:
+            position = positions.pop(0)
+            matched.add(position)
+            entry["status"] = SECTION_CARRIED_OVER
+            entry["test_cases"] = previous_sections[position]["test_cases"]
+        plan.append(entry)
+
+    positions_by_heading: Dict[str, List[int]] = {}
+    for position, previous in enumerate(previous_sections):
+        if position not in matched:
+            positions_by_heading.setdefault(_heading_key(previous["heading"]), []).append(
+                position
+            )
+    for entry in plan:
+        if entry["status"] is not None:
+            continue
+        positions = positions_by_heading.get(_heading_key(entry["heading"]))
+        if positions:
+            matched.add(positions.pop(0))
+            entry["status"] = SECTION_CHANGED
+        else:
+            entry["status"] = SECTION_NEW
+    return plan, len(previous_sections) - len(matched)
+
+
+class DocumentStore:
+    """
+    Асинхронная обёртка над SQLite-хранилищем версий документов. Генерации
+    одного документа в процессе выполняются по очереди: иначе две версии
+    сравнивались бы с одной и той же предыдущей.
+    """
+
+    def __init__(self, store: Optional[SQLiteDocumentStore] = None):
+        self.store = store
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def lock(self, document_id: str) -> asyncio.Lock:
+        lock = self._locks.get(document_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[document_id] = lock
+        return lock
+
+    async def latest(self, document_id: str) -> Optional[Dict[str, Any]]:
+        if self.store is None:
+            return None
+        return await asyncio.to_thread(self.store.latest, document_id)
+
+    async def add_version(self, document_id: str, sections: List[Dict[str, Any]]) -> int:
+        return await asyncio.to_thread(self.store.add_version, document_id, sections)
+
+    async def delete(self, document_id: str) -> int:
+        if self.store is None:
+            return 0
+        return await asyncio.to_thread(self.store.delete, document_id)
+
+
+def create_document_store() -> DocumentStore:
+    if not DOCUMENTS_ENABLED:
+        return DocumentStore()
+    try:
+        return DocumentStore(
+            SQLiteDocumentStore(DOCUMENTS_DB_PATH, versions_kept=DOCUMENT_VERSIONS_KEPT)
+        )
+    except Exception as e:
+        print(f"Warning: document store at {DOCUMENTS_DB_PATH} is unavailable: {e}")
+        return DocumentStore()
@@ -0,0 +1,192 @@
+import csv
+import json
+import re
+import tempfile
+from itertools import islice
+from operator import itemgetter
+from typing import IO, Dict, Iterable, Iterator, List, Tuple
+
+# Порядок колонок в экспортируемых файлах
+EXPORT_COLUMNS = ["Название", "Шаги", "Ожидаемый результат", "Тип"]
+
+# BOM, чтобы Excel открывал CSV в UTF-8
+CSV_BOM = "\ufeff"
+# Сколько строк CSV и JSON Lines накапливать перед отправкой очередного куска ответа
+CSV_ROWS_PER_CHUNK = 256
+
+EXCEL_SHEET_NAME = "Test-Cases"
+EXCEL_MAX_STEPS_WIDTH = 70
+# Готовый xlsx держится в памяти до этого размера, дальше уходит во временный файл
+EXCEL_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+EXCEL_READ_CHUNK_SIZE = 64 * 1024
+
+# Перенос строки перед каждым "N. " внутри шагов
+_STEP_NUMBER_RE = re.compile(r"(?<=[^\n])\s+(?=\d+\.\s)")
+# Перенос строки между вступительной фразой и первым шагом "1. "
+_FIRST_STEP_RE = re.compile(r"^(?!\s*\d+\.\s)([^\n]*?)\s*(1\.\s)", re.MULTILINE)
+
+
+# Компактная строка экспорта: поля тест-кейса в порядке EXPORT_COLUMNS
+TestCaseRow = Tuple[str, str, str, str]
+_row_getter = itemgetter(*EXPORT_COLUMNS)
+
+
+def test_case_rows(test_cases: Iterable[Dict[str, str]]) -> Iterator[TestCaseRow]:
+    """Строки экспорта из словарей тест-кейсов; отсутствующие поля - пустые строки."""
+    for test_case in test_cases:
+        try:
+            yield _row_getter(test_case)
+        except KeyError:
+            yield tuple(test_case.get(column, "") for column in EXPORT_COLUMNS)
+
+
+def normalize_steps(steps: str) -> str:
+    """Ставит каждый нумерованный шаг на отдельную строку."""
+    steps = _STEP_NUMBER_RE.sub("\n", steps)
+    return _FIRST_STEP_RE.sub(r"\1\n\2", steps, count=1)
+
+
+class _ChunkBuffer:
+    """Минимальный file-like объект для csv.writer: копит строки в список."""
+
+    __slots__ = ("parts",)
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def write(self, text: str) -> int:
+        self.parts.append(text)
+        return len(text)
+
+    def drain(self) -> str:
+        text = "".join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def iter_csv_rows(
+    rows: Iterable[TestCaseRow], rows_per_chunk: int = CSV_ROWS_PER_CHUNK
+) -> Iterator[str]:
+    """
+    Генерирует CSV (BOM, заголовок, строки) кусками по rows_per_chunk строк.
+    Шаги нормализуются и склеиваются через "; ", как в прежнем экспорте.
+    """
+    buffer = _ChunkBuffer()
+    writer = csv.writer(buffer, lineterminator="\n")
+    buffer.write(CSV_BOM)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = iter(rows)
+    while True:
+        chunk = [
+            (title, normalize_steps(steps).replace("\n", "; "), expected, test_type)
+            for title, steps, expected, test_type in islice(rows, rows_per_chunk)
+        ]
+        writer.writerows(chunk)
+        text = buffer.drain()
+        if text:
+            yield text
+        if len(chunk) < rows_per_chunk:
+            return
+
+
+def iter_csv_chunks(
+    test_cases: Iterable[Dict[str, str]], rows_per_chunk: int = CSV_ROWS_PER_CHUNK
+) -> Iterator[str]:
+    """iter_csv_rows для словарей тест-кейсов."""
+    return iter_csv_rows(test_case_rows(test_cases), rows_per_chunk)
+
+
+def iter_jsonl_chunks(
+    test_cases: Iterable[Dict[str, str]], rows_per_chunk: int = CSV_ROWS_PER_CHUNK
+) -> Iterator[str]:
+    """JSON Lines: тест-кейс на строку, поля как в ответе /generate, шаги не меняются."""
+    lines: List[str] = []
+    for test_case in test_cases:
+        lines.append(json.dumps(test_case, ensure_ascii=False) + "\n")
+        if len(lines) >= rows_per_chunk:
+            yield "".join(lines)
+            lines.clear()
+    if lines:
+        yield "".join(lines)
+
+
+def _steps_width(steps: str) -> int:
+    return max((len(line) for line in steps.split("\n")), default=0)
+
+
+def write_excel(rows: Iterable[TestCaseRow], target: IO[bytes]) -> None:
+    """
+    Пишет xlsx в режиме write-only (строки не держатся в памяти как объекты
+    ячеек). Ширина колонки шагов в xlsx должна предшествовать строкам, поэтому
+    она считается заранее, в том же проходе, что нормализует шаги.
+    """
+    # openpyxl импортируется при первом экспорте, а не при старте приложения
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+    from openpyxl.utils import get_column_letter
+
+    normalized_rows = []
+    steps_width = len("Шаги")
+    for title, steps, expected, test_type in rows:
+        steps = normalize_steps(steps)
+        steps_width = max(steps_width, _steps_width(steps))
+        normalized_rows.append((title, steps, expected, test_type))
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(EXCEL_SHEET_NAME)
+    adjusted_width = min(steps_width + 5, EXCEL_MAX_STEPS_WIDTH)
+    if adjusted_width > 10:
+        worksheet.column_dimensions[get_column_letter(2)].width = adjusted_width
+
+    # Заголовок оформлен так же, как его писал pandas.to_excel
+    thin = Side(style="thin")
+    header_font = Font(bold=True)
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_alignment = Alignment(horizontal="center", vertical="top")
+    header = []
+    for column in EXPORT_COLUMNS:
+        cell = WriteOnlyCell(worksheet, value=column)
+        cell.font = header_font
+        cell.border = header_border
+        cell.alignment = header_alignment
+        header.append(cell)
+    worksheet.append(header)
+
+    steps_alignment = Alignment(wrap_text=True, vertical="top")
+    for title, steps, expected, test_type in normalized_rows:
+        steps_cell = WriteOnlyCell(worksheet, value=steps)
+        steps_cell.alignment = steps_alignment
+        worksheet.append((title, steps_cell, expected, test_type))
+    workbook.save(target)
+
+
+def build_excel_file_from_rows(rows: Iterable[TestCaseRow]) -> IO[bytes]:
+    """Собирает xlsx во временный файл (в памяти или на диске) и перематывает его."""
+    target = tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_MAX_BYTES)
+    try:
+        write_excel(rows, target)
+    except Exception:
+        target.close()
+        raise
+    target.seek(0)
+    return target
+
+
+def build_excel_file(test_cases: Iterable[Dict[str, str]]) -> IO[bytes]:
+    """build_excel_file_from_rows для словарей тест-кейсов."""
+    return build_excel_file_from_rows(test_case_rows(test_cases))
+
+
+def iter_file_chunks(
+    file_obj: IO[bytes], chunk_size: int = EXCEL_READ_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Читает файл кусками и закрывает его по окончании отправки."""
+    try:
+        while True:
+            chunk = file_obj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file_obj.close()
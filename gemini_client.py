@@ -0,0 +1,454 @@
+import os
+import copy
+import json
+import time
+import random
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+# --- Настройки пула вызовов Gemini ---
+# Сколько запросов к Gemini может выполняться одновременно в одном воркере
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# Сколько запросов может ждать свободного слота, прежде чем мы начнём отвечать 503
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "32"))
+# Таймаут на один вызов Gemini (секунды)
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+# Ограничение частоты вызовов (token bucket): запросов в секунду и размер всплеска.
+# 0 - без ограничения
+GEMINI_RATE_LIMIT_RPS = float(os.getenv("GEMINI_RATE_LIMIT_RPS", "0"))
+GEMINI_RATE_LIMIT_BURST = int(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+# Повторы при 429/5xx: экспоненциальная задержка со случайным разбросом (full jitter)
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "0.5"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "8"))
+# Несколько ключей через запятую: вызовы распределяются по кругу, ключ,
+# упёршийся в квоту, отдыхает GEMINI_KEY_COOLDOWN_SECONDS
+GEMINI_API_KEYS = [
+    key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()
+]
+GEMINI_KEY_COOLDOWN_SECONDS = float(os.getenv("GEMINI_KEY_COOLDOWN_SECONDS", "30"))
+# Неверный ключ выключается надолго
+GEMINI_INVALID_KEY_COOLDOWN_SECONDS = 3600.0
+
+# --- Бюджет выходных токенов ---
+# Оценка длины без обращения к API: символов на токен (для кириллицы меньше,
+# чем для латиницы, поэтому оценка с запасом)
+GEMINI_CHARS_PER_TOKEN = float(os.getenv("GEMINI_CHARS_PER_TOKEN", "3"))
+# Потолок модели на длину одного ответа
+GEMINI_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
+# Ожидаемая длина ответа: минимум плюс столько токенов на каждый токен промпта.
+# Обычный ответ из 10-15 тест-кейсов занимает 3-6 тыс. токенов; ответ,
+# оборванный по лимиту, дозапрашивается с повторной отправкой всего промпта,
+# поэтому минимум не меньше такого ответа
+GEMINI_MIN_OUTPUT_TOKENS = int(os.getenv("GEMINI_MIN_OUTPUT_TOKENS", "8192"))
+GEMINI_OUTPUT_TOKENS_PER_PROMPT_TOKEN = float(
+    os.getenv("GEMINI_OUTPUT_TOKENS_PER_PROMPT_TOKEN", "1")
+)
+# Сколько раз можно дозапросить ответ, оборванный по лимиту токенов
+GEMINI_MAX_CONTINUATIONS = int(os.getenv("GEMINI_MAX_CONTINUATIONS", "3"))
+
+
+def _google_exceptions():
+    """
+    google.api_core.exceptions импортируется только при разборе ошибки: на
+    старте воркера SDK Gemini ещё не загружен (см. get_model в main.py).
+    """
+    from google.api_core import exceptions as google_exceptions
+
+    return google_exceptions
+
+
+def is_retryable_error(e: Exception) -> bool:
+    """Ошибка, после которой вызов имеет смысл повторить (429/5xx, таймаут Gemini)."""
+    google_exceptions = _google_exceptions()
+    return isinstance(
+        e,
+        (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.Aborted,
+        ),
+    )
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    google_exceptions = _google_exceptions()
+    return isinstance(
+        e, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+    )
+
+
+class GeminiBusyError(Exception):
+    """Очередь ожидания вызовов Gemini переполнена."""
+
+
+class GeminiTimeoutError(Exception):
+    """Вызов Gemini не уложился в отведённое время."""
+
+
+class TokenBucket:
+    """Token bucket: не больше rate вызовов в секунду с всплеском до capacity."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        # Ожидающие обслуживаются по очереди, пока держат блокировку
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ApiKeyPool:
+    """
+    Круговая ротация API-ключей с «отдыхом» ключей, упёршихся в квоту.
+    Для каждого ключа создаётся копия модели со своим клиентом.
+    """
+
+    def __init__(self, keys: List[str]):
+        self.keys = keys
+        self._next = 0
+        self._cooldown_until: Dict[str, float] = {}
+        self._models: Dict[Tuple[int, str], Tuple[Any, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def pick(self) -> Tuple[str, float]:
+        """Следующий доступный ключ и сколько секунд ждать, если все отдыхают."""
+        now = time.monotonic()
+        for offset in range(len(self.keys)):
+            key = self.keys[(self._next + offset) % len(self.keys)]
+            if self._cooldown_until.get(key, 0) <= now:
+                self._next = (self._next + offset + 1) % len(self.keys)
+                return key, 0.0
+        key = min(self.keys, key=lambda k: self._cooldown_until.get(k, 0))
+        return key, self._cooldown_until[key] - now
+
+    def cool_down(self, key: str, seconds: float) -> None:
+        self._cooldown_until[key] = time.monotonic() + seconds
+
+    def model_for(self, model, key: str):
+        cached = self._models.get((id(model), key))
+        if cached is not None and cached[0] is model:
+            return cached[1]
+        import google.ai.generativelanguage as glm
+
+        key_model = copy.copy(model)
+        # У GenerativeModel нет публичного способа передать ключ на вызов,
+        # поэтому у копии подменяется асинхронный клиент
+        key_model._async_client = glm.GenerativeServiceAsyncClient(
+            client_options={"api_key": key}
+        )
+        self._models[(id(model), key)] = (model, key_model)
+        return key_model
+
+
+def is_invalid_key_error(e: Exception) -> bool:
+    google_exceptions = _google_exceptions()
+    return isinstance(
+        e,
+        (
+            google_exceptions.PermissionDenied,
+            google_exceptions.Unauthenticated,
+            google_exceptions.InvalidArgument,
+        ),
+    ) and ("API key" in str(e) or "API_KEY" in str(e))
+
+
+class GeminiCallPool:
+    """
+    Ограничивает число одновременных вызовов Gemini и длину очереди ожидания,
+    частоту вызовов (token bucket), повторяет вызовы при 429/5xx, распределяет
+    их по пулу API-ключей и объединяет одинаковые одновременные запросы.
+    Вызовы выполняются через async API SDK, поэтому event loop не блокируется.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        max_queue: int = GEMINI_MAX_QUEUE,
+        timeout: float = GEMINI_TIMEOUT_SECONDS,
+        rate_limiter: Optional[TokenBucket] = None,
+        api_keys: Optional[ApiKeyPool] = None,
+        max_retries: int = GEMINI_MAX_RETRIES,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or TokenBucket(0, 1)
+        self.api_keys = api_keys or ApiKeyPool([])
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        # Одинаковые запросы в полёте: ключ -> задача первого из них
+        self._flights: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "coalesced": 0,
+            "rate_limited": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0,
+        }
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def _acquire(self) -> None:
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise GeminiBusyError(
+                f"Gemini call queue is full ({self._waiting} waiting)."
+            )
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    async def _pick_model(self, model) -> Tuple[Any, Optional[str]]:
+        """Модель с ключом из пула (если ключей несколько) и сам ключ."""
+        if len(self.api_keys) < 2:
+            return model, None
+        key, wait = self.api_keys.pick()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self.api_keys.model_for(model, key), key
+
+    def _retry_delay(self, e: Exception, key: Optional[str], attempt: int) -> float:
+        """
+        Задержка перед повтором после ошибки e; если повторять нельзя,
+        пробрасывает e. Ключ, упёршийся в квоту, отправляется отдыхать.
+        """
+        if key is not None and is_invalid_key_error(e):
+            print("Warning: Gemini API key was rejected, taking it out of rotation.")
+            self.api_keys.cool_down(key, GEMINI_INVALID_KEY_COOLDOWN_SECONDS)
+            if attempt < self.max_retries:
+                return 0.0
+        if not is_retryable_error(e) or attempt >= self.max_retries:
+            raise e
+        if is_rate_limit_error(e):
+            self.stats["rate_limited"] += 1
+            if key is not None:
+                self.api_keys.cool_down(key, GEMINI_KEY_COOLDOWN_SECONDS)
+        self.stats["retries"] += 1
+        return random.uniform(
+            0, min(GEMINI_RETRY_MAX_SECONDS, GEMINI_RETRY_BASE_SECONDS * 2**attempt)
+        )
+
+    async def _generate_once(self, model, prompt: str, **kwargs) -> Any:
+        await self._acquire()
+        try:
+            await self.rate_limiter.acquire()
+            self.stats["calls"] += 1
+            response = await asyncio.wait_for(
+                model.generate_content_async(prompt, **kwargs), timeout=self.timeout
+            )
+            add_token_usage(self.stats, response)
+            return response
+        except asyncio.TimeoutError:
+            raise GeminiTimeoutError(
+                f"Gemini call exceeded {self.timeout:g}s timeout."
+            )
+        finally:
+            self._release()
+
+    async def _generate_with_retries(self, model, prompt: str, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            key_model, key = await self._pick_model(model)
+            try:
+                return await self._generate_once(key_model, prompt, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, key, attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _flight_key(model, prompt: str, kwargs: Dict) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(str(getattr(model, "model_name", id(model))).encode("utf-8"))
+        hasher.update(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8"))
+        # Промпт - строка или история диалога (при дозапросе продолжения)
+        hasher.update(json.dumps(prompt, ensure_ascii=False, default=str).encode("utf-8"))
+        return hasher.hexdigest()
+
+    async def generate(self, model, prompt, **kwargs) -> Any:
+        """
+        Вызывает model.generate_content_async с учётом лимитов пула. Если такой же
+        запрос (модель, промпт, параметры) уже выполняется, ждёт его результата.
+        """
+        flight_key = self._flight_key(model, prompt, kwargs)
+        flight = self._flights.get(flight_key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+        else:
+            flight = asyncio.ensure_future(
+                self._generate_with_retries(model, prompt, **kwargs)
+            )
+            self._flights[flight_key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(flight_key, None))
+            # Исключение забирают ожидающие; если все отменились - не шумим в лог
+            flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+        # shield: отмена одного ожидающего не отменяет вызов для остальных
+        return await asyncio.shield(flight)
+
+    async def stream(self, model, prompt, **kwargs) -> AsyncIterator[Any]:
+        """
+        Потоковый вызов Gemini (stream=True): отдаёт куски ответа по мере прихода.
+        Слот пула занят до конца потока, таймаут действует на ожидание каждого куска.
+        Повтор возможен, только пока не отдан ни один кусок.
+        """
+        attempt = 0
+        while True:
+            key_model, key = await self._pick_model(model)
+            yielded = False
+            await self._acquire()
+            try:
+                await self.rate_limiter.acquire()
+                self.stats["calls"] += 1
+                try:
+                    response = await asyncio.wait_for(
+                        key_model.generate_content_async(prompt, stream=True, **kwargs),
+                        timeout=self.timeout,
+                    )
+                    chunks = response.__aiter__()
+                    chunk = None
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                chunks.__anext__(), timeout=self.timeout
+                            )
+                        except StopAsyncIteration:
+                            # Итоговый расход токенов приходит в последнем куске
+                            add_token_usage(self.stats, chunk)
+                            return
+                        yielded = True
+                        yield chunk
+                except asyncio.TimeoutError:
+                    raise GeminiTimeoutError(
+                        f"Gemini stream stalled for more than {self.timeout:g}s."
+                    )
+                except Exception as e:
+                    if yielded:
+                        raise
+                    delay = self._retry_delay(e, key, attempt)
+            finally:
+                self._release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def extract_response_text(response) -> str:
+    """Достаёт текст из ответа Gemini (response.text, parts или строка)."""
+    generated_text = ""
+    try:
+        if hasattr(response, "text") and response.text:
+            generated_text = response.text
+    except ValueError:
+        # response.text бросает ValueError, если ответ заблокирован или пуст
+        generated_text = ""
+    if not generated_text:
+        if hasattr(response, "parts") and response.parts:
+            generated_text = "".join(
+                part.text for part in response.parts if hasattr(part, "text")
+            )
+        elif isinstance(response, str):
+            generated_text = response
+    return generated_text
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов в тексте без вызова count_tokens."""
+    return int(len(text) / GEMINI_CHARS_PER_TOKEN) + 1
+
+
+def estimate_output_tokens(prompt_tokens: int) -> int:
+    """Бюджет ответа под размер промпта, не больше потолка модели."""
+    expected = GEMINI_MIN_OUTPUT_TOKENS + int(
+        prompt_tokens * GEMINI_OUTPUT_TOKENS_PER_PROMPT_TOKEN
+    )
+    return min(expected, GEMINI_MAX_OUTPUT_TOKENS)
+
+
+def get_finish_reason(response) -> Optional[str]:
+    """Причина завершения ответа (STOP, MAX_TOKENS, SAFETY...) или None."""
+    try:
+        finish_reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return None
+    return getattr(finish_reason, "name", str(finish_reason))
+
+
+def is_truncated(response) -> bool:
+    """Ответ оборван, потому что кончился бюджет выходных токенов."""
+    return get_finish_reason(response) == "MAX_TOKENS"
+
+
+def new_token_usage() -> Dict[str, int]:
+    return {
+        "calls": 0,
+        "continuations": 0,
+        "truncated": 0,
+        "estimated_prompt_tokens": 0,
+        "prompt_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+    }
+
+
+def add_token_usage(usage: Dict[str, int], response) -> None:
+    """Прибавляет к usage расход токенов из usage_metadata ответа Gemini."""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if usage_metadata is None:
+        return
+    usage["prompt_tokens"] += getattr(usage_metadata, "prompt_token_count", 0) or 0
+    usage["output_tokens"] += getattr(usage_metadata, "candidates_token_count", 0) or 0
+    usage["total_tokens"] += getattr(usage_metadata, "total_token_count", 0) or 0
+
+
+def get_blocked_category(response) -> Optional[str]:
+    """Возвращает категорию безопасности, по которой Gemini заблокировал запрос."""
+    prompt_feedback = getattr(response, "prompt_feedback", None)
+    if prompt_feedback:
+        for rating in getattr(prompt_feedback, "safety_ratings", []):
+            if getattr(rating, "blocked", False):
+                return str(rating.category)
+    return None
+
+
+gemini_pool = GeminiCallPool(
+    rate_limiter=TokenBucket(GEMINI_RATE_LIMIT_RPS, GEMINI_RATE_LIMIT_BURST),
+    api_keys=ApiKeyPool(GEMINI_API_KEYS),
+)
@@ -0,0 +1,211 @@
+import os
+import base64
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import DATABASE_URL, create_db_engine
+
+# --- Настройки истории генераций ---
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+# Записи копятся в памяти и пишутся пачкой: до HISTORY_BATCH_SIZE штук
+# или раз в HISTORY_FLUSH_INTERVAL_SECONDS
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("HISTORY_FLUSH_INTERVAL_SECONDS", "1"))
+# Сколько записей может ждать записи; сверх этого новые отбрасываются
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "10000"))
+HISTORY_PAGE_SIZE_MAX = 100
+
+# Колонки для листинга (без промпта и тест-кейсов)
+LIST_COLUMNS = (
+    "id",
+    "created_at",
+    "endpoint",
+    "input_hash",
+    "input_chars",
+    "model",
+    "output_format",
+    "chunks",
+    "cache_status",
+    "test_case_count",
+    "timings",
+)
+
+
+class InvalidCursorError(ValueError):
+    """Курсор пагинации повреждён."""
+
+
+def encode_cursor(created_at: datetime, entry_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{entry_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor).decode("ascii")
+        created_at, entry_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursorError(str(e))
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    item = dict(row._mapping)
+    item["created_at"] = item["created_at"].isoformat()
+    return item
+
+
+class HistoryRecorder:
+    """
+    Пишет историю генераций вне пути запроса: record() только кладёт запись
+    в очередь, фоновая задача вставляет их пачками одной транзакцией.
+    Движок БД (и SQLAlchemy вместе с моделями) создаётся в start(): воркер
+    без истории их не загружает.
+    """
+
+    def __init__(
+        self,
+        database_url: str = DATABASE_URL,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL_SECONDS,
+        max_pending: int = HISTORY_MAX_PENDING,
+    ):
+        self.database_url = database_url
+        self.engine = None
+        self.session_factory = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(max_pending)
+        self._writer_task: Optional[asyncio.Task] = None
+        # Пачка, которую фоновая задача уже забрала из очереди, но ещё не записала
+        self._batch: List[Dict[str, Any]] = []
+        self.dropped = 0
+
+    async def start(self) -> None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        from models import Base
+
+        if self.engine is None:
+            self.engine = create_db_engine(self.database_url)
+            self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и дописывает то, что осталось в очереди."""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        await self._write_batch(self._batch)
+        self._batch = []
+        while not self._queue.empty():
+            await self._write_batch(self._take_batch())
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    @property
+    def running(self) -> bool:
+        return self._writer_task is not None
+
+    def record(self, **entry: Any) -> None:
+        """Ставит запись в очередь, не блокируя вызывающего."""
+        if not self.running:
+            return
+        entry.setdefault("created_at", datetime.now(timezone.utc))
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        from sqlalchemy import insert
+        from models import GenerationHistory
+
+        try:
+            async with self.session_factory() as session:
+                await session.execute(insert(GenerationHistory), batch)
+                await session.commit()
+        except Exception as e:
+            # История не должна ломать генерацию: теряем пачку и пишем в лог
+            self.dropped += len(batch)
+            print(f"Warning: failed to write {len(batch)} history entries: {e}")
+
+    async def list_entries(
+        self, user_id: str, limit: int, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Страница истории пользователя от новых к старым. Курсор - позиция
+        (created_at, id) последней записи предыдущей страницы.
+        """
+        from sqlalchemy import and_, or_, select
+        from models import GenerationHistory
+
+        columns = [getattr(GenerationHistory, name) for name in LIST_COLUMNS]
+        query = select(*columns).where(GenerationHistory.user_id == user_id)
+        if cursor:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+            query = query.where(
+                or_(
+                    GenerationHistory.created_at < cursor_created_at,
+                    and_(
+                        GenerationHistory.created_at == cursor_created_at,
+                        GenerationHistory.id < cursor_id,
+                    ),
+                )
+            )
+        query = query.order_by(
+            GenerationHistory.created_at.desc(), GenerationHistory.id.desc()
+        ).limit(limit + 1)
+        async with self.session_factory() as session:
+            rows = (await session.execute(query)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return [_row_to_dict(row) for row in rows], next_cursor
+
+    async def get_entry(self, user_id: str, entry_id: int) -> Optional[Dict[str, Any]]:
+        from models import GenerationHistory
+
+        async with self.session_factory() as session:
+            entry = await session.get(GenerationHistory, entry_id)
+        if entry is None or entry.user_id != user_id:
+            return None
+        item = {
+            column.name: getattr(entry, column.name)
+            for column in GenerationHistory.__table__.columns
+        }
+        item["created_at"] = entry.created_at.isoformat()
+        return item
+
+
+history_recorder = HistoryRecorder()
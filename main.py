@@ -1,21 +1,119 @@
 import os
-import io
-import re
+import asyncio
+import time
+import hashlib
+import tempfile
+import multiprocessing
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 import json  # Добавляем json
 from pathlib import Path  # Для работы с путями
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi import (
+    FastAPI,
+    File,
+    UploadFile,
+    Form,
+    HTTPException,
+    Request,
+    Response,
+    Query,
+    Header,
+)
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Literal
-import pandas as pd
-import google.generativeai as genai
-from openpyxl.styles import Alignment
-from openpyxl.utils import get_column_letter
+from pydantic import ValidationError
+from typing import Any, AsyncIterator, Iterable, List, Optional, Dict, Literal, Tuple
 
-from utils import extract_text_from_pdf, parse_gemini_response, DEFAULT_PROMPT_TEMPLATE
+# .env загружается до импорта модулей проекта: их настройки читаются из
+# окружения при импорте
+load_dotenv()
+
+from utils import (
+    count_pdf_pages,
+    fingerprint_pdf_pages,
+    extract_pdf_page_texts,
+    strip_pdf_boilerplate,
+    parse_gemini_response_with_stats,
+    complete_cases_prefix,
+    complete_json_items_prefix,
+    split_requirements_into_chunks,
+    split_into_document_sections,
+    IncrementalResponseParser,
+    DEFAULT_PROMPT_TEMPLATE,
+    DEFAULT_JSON_PROMPT_TEMPLATE,
+    TEST_CASES_RESPONSE_SCHEMA,
+)
+from gemini_client import (
+    gemini_pool,
+    GEMINI_API_KEYS,
+    is_rate_limit_error,
+    GEMINI_MAX_OUTPUT_TOKENS,
+    GEMINI_MAX_CONTINUATIONS,
+    estimate_tokens,
+    estimate_output_tokens,
+    is_truncated,
+    new_token_usage,
+    add_token_usage,
+    extract_response_text,
+    get_blocked_category,
+    GeminiBusyError,
+    GeminiTimeoutError,
+)
+from history import history_recorder, InvalidCursorError, HISTORY_ENABLED, HISTORY_PAGE_SIZE_MAX
+from dedup import (
+    collapse_near_duplicates,
+    NearDuplicateIndex,
+    DEDUP_ENABLED,
+    DEDUP_THRESHOLD,
+)
+from batch import create_batch_queue, BatchInputError, RetryLaterError
+from documents import (
+    create_document_store,
+    diff_sections,
+    DOCUMENT_SECTION_MIN_CHARS,
+    SECTION_CARRIED_OVER,
+    SECTION_STATUSES,
+)
+from exporters import (
+    TestCaseRow,
+    build_excel_file_from_rows,
+    iter_csv_rows,
+    iter_file_chunks,
+    iter_jsonl_chunks,
+    test_case_rows,
+)
+from serialization import (
+    EXPORT_REQUEST_OPENAPI,
+    TEST_CASE_ADAPTER,
+    TEST_CASE_LIST_ADAPTER,
+    fast_json_response,
+    validate_export_payload,
+)
+from metrics import (
+    REGISTRY,
+    PDF_BOILERPLATE_REMOVED,
+    UPSTREAM_ERRORS,
+    CallbackMetric,
+    MetricsMiddleware,
+    record_stage,
+    span,
+    start_request_timings,
+    timed_iter,
+)
+from profiling import slow_request_profiler
+from cache import (
+    create_generation_cache,
+    create_pdf_text_cache,
+    create_result_store,
+    make_cache_key,
+    GENERATION_CACHE_ENABLED,
+)
 
 # --- Локализация ---
 BASE_DIR = Path(__file__).resolve().parent
@@ -41,10 +139,9 @@ def load_translations():
     print(f"Loaded translations for: {list(translations.keys())}")
 
 
-load_translations()  # Загружаем переводы при старте приложения
-
-
 def get_locale_strings(lang: Optional[str] = None) -> Dict[str, str]:
+    if not translations:
+        load_translations()  # Переводы читаются при прогреве или первом запросе
     if lang and lang in translations:
         return translations[lang]
     return translations[DEFAULT_LANGUAGE]
@@ -53,20 +150,28 @@ def get_locale_strings(lang: Optional[str] = None) -> Dict[str, str]:
 # --- Конец блока локализации ---
 
 
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# При пуле ключей (GEMINI_API_KEYS) первый из них становится ключом по умолчанию
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or (GEMINI_API_KEYS or [None])[0]
 
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY не найден в .env файле.")
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 GENERATION_CONFIG = {
     "temperature": 0.7,
     "top_p": 1,
     "top_k": 1,
-    "max_output_tokens": 8192,
+    # Потолок; фактический бюджет каждого вызова подбирается под размер промпта
+    "max_output_tokens": GEMINI_MAX_OUTPUT_TOKENS,
 }
+# Режим структурированного вывода: Gemini отвечает JSON по схеме TEST_CASES_RESPONSE_SCHEMA
+OUTPUT_FORMATS = Literal["text", "json"]
+EXPORT_FORMATS = Literal["csv", "xlsx", "jsonl"]
+JSON_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": TEST_CASES_RESPONSE_SCHEMA,
+}
+# Повторы запроса, если в JSON-ответе не нашлось ни одного целого тест-кейса
+JSON_PARSE_RETRIES = int(os.getenv("JSON_PARSE_RETRIES", "1"))
 SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
     {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
@@ -80,26 +185,163 @@ SAFETY_SETTINGS = [
     },
 ]
 
-try:
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash-latest",
-        generation_config=GENERATION_CONFIG,
-        safety_settings=SAFETY_SETTINGS,
-    )
-    print("Using model: gemini-1.5-flash-latest")
-except Exception as e:
-    print(f"Failed to load gemini-1.5-flash-latest, trying gemini-pro. Error: {e}")
+# Модель создаётся при прогреве или первом обращении (get_model): импорт
+# google.generativeai - самая долгая часть старта воркера
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash-latest")
+GEMINI_FALLBACK_MODEL_NAME = "gemini-pro"
+model = None
+
+
+def create_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=GEMINI_API_KEY)
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-pro",
+        gemini_model = genai.GenerativeModel(
+            model_name=GEMINI_MODEL_NAME,
             generation_config=GENERATION_CONFIG,
             safety_settings=SAFETY_SETTINGS,
         )
-        print("Using model: gemini-pro")
-    except Exception as e_pro:
-        raise RuntimeError(f"Could not initialize any Gemini model. Error: {e_pro}")
+        print(f"Using model: {GEMINI_MODEL_NAME}")
+    except Exception as e:
+        print(
+            f"Failed to load {GEMINI_MODEL_NAME}, trying {GEMINI_FALLBACK_MODEL_NAME}. "
+            f"Error: {e}"
+        )
+        try:
+            gemini_model = genai.GenerativeModel(
+                model_name=GEMINI_FALLBACK_MODEL_NAME,
+                generation_config=GENERATION_CONFIG,
+                safety_settings=SAFETY_SETTINGS,
+            )
+            print(f"Using model: {GEMINI_FALLBACK_MODEL_NAME}")
+        except Exception as e_pro:
+            raise RuntimeError(f"Could not initialize any Gemini model. Error: {e_pro}")
+    return gemini_model
+
+
+def get_model():
+    global model
+    if model is None:
+        model = create_model()
+    return model
+
+
+def current_model_name() -> str:
+    """
+    Имя модели для ключей кэша и истории. Не создаёт модель: попадание в кэш
+    не должно ждать импорта google.generativeai. Имя - в том же виде
+    ("models/..."), что и у созданной модели.
+    """
+    if model is not None:
+        return model.model_name
+    if "/" in GEMINI_MODEL_NAME:
+        return GEMINI_MODEL_NAME
+    return f"models/{GEMINI_MODEL_NAME}"
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Тексты длиннее MAX_INPUT_CHARS обрабатываются по кускам (map-reduce)
+MAX_INPUT_CHARS = 60000
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "20000"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+MAX_CHUNKED_INPUT_CHARS = int(os.getenv("MAX_CHUNKED_INPUT_CHARS", "1500000"))
+
+# Извлечение текста из PDF выполняется в пуле процессов вне event loop
+PDF_EXTRACT_WORKERS = int(
+    os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+UPLOAD_COPY_CHUNK_SIZE = 1024 * 1024
+# Колонтитулы, номера страниц и оглавление убираются из текста PDF до промпта
+PDF_STRIP_BOILERPLATE = os.getenv("PDF_STRIP_BOILERPLATE", "1") == "1"
+pdf_executor: Optional[ProcessPoolExecutor] = None
 
-app = FastAPI(title="Генератор Тест-кейсов на AI")
+generation_cache = create_generation_cache()
+pdf_text_cache = create_pdf_text_cache()
+result_store = create_result_store()
+batch_queue = create_batch_queue()
+document_store = create_document_store()
+
+
+# Прогрев при старте: "background" - в фоне, запросы принимаются сразу, а /ready
+# отвечает 503 до его окончания; "blocking" - старт ждёт прогрева; "off" - всё
+# инициализируется при первом обращении
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+warmup_state = {"status": "pending", "duration_ms": None, "error": None}
+
+
+def import_heavy_modules() -> None:
+    """Импортирует зависимости, которые иначе подгружаются первым запросом."""
+    import google.generativeai  # noqa: F401
+    import pdfplumber  # noqa: F401
+    import PyPDF2  # noqa: F401
+    import openpyxl  # noqa: F401
+
+
+async def warm_up() -> None:
+    """Загружает переводы, тяжёлые модули и создаёт модель Gemini."""
+    started_at = time.perf_counter()
+    warmup_state["status"] = "running"
+    try:
+        get_locale_strings()
+        # Импорт в потоке, чтобы фоновый прогрев не останавливал event loop
+        await asyncio.to_thread(import_heavy_modules)
+        get_model()
+    except Exception as e:
+        print(f"Warning: startup warm-up failed: {e}")
+        warmup_state["status"] = "failed"
+        warmup_state["error"] = str(e)
+    else:
+        warmup_state["status"] = "done"
+    warmup_state["duration_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = None
+    if STARTUP_WARMUP == "blocking":
+        await warm_up()
+    elif STARTUP_WARMUP == "background":
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        warmup_state["status"] = "off"
+    slow_request_profiler.start()
+    # Воркеры пакетных заданий и запись истории живут вместе с приложением
+    if HISTORY_ENABLED:
+        try:
+            await history_recorder.start()
+        except Exception as e:
+            print(f"Warning: generation history is unavailable: {e}")
+    await batch_queue.start(process_batch_item)
+    try:
+        yield
+    finally:
+        if warmup_task is not None:
+            warmup_task.cancel()
+            await asyncio.gather(warmup_task, return_exceptions=True)
+        await batch_queue.stop()
+        await history_recorder.stop()
+        slow_request_profiler.stop()
+        shutdown_pdf_executor()
+
+
+app = FastAPI(title="Генератор Тест-кейсов на AI", lifespan=lifespan)
+# Пути, для которых собираются длительности, этапы и число запросов в работе
+TRACKED_ENDPOINTS = (
+    "/generate",
+    "/generate_stream",
+    "/export_csv",
+    "/export_excel",
+    "/export/{result_id}",
+    "/deduplicate",
+    "/batch",
+    "/documents/{document_id}/generate",
+)
+app.add_middleware(
+    MetricsMiddleware, endpoints=TRACKED_ENDPOINTS, profiler=slow_request_profiler
+)
 app.mount(
     "/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static"
 )  # Используем BASE_DIR
@@ -108,46 +350,697 @@ templates = Jinja2Templates(
 )  # Используем BASE_DIR
 
 
-class TestCase(BaseModel):
-    Название: str
-    Шаги: str
-    Ожидаемый_результат: str = Field(..., alias="Ожидаемый результат")
-    Тип: str
+# Сколько тест-кейсов распознано и сколько блоков/элементов отброшено, по режимам
+parse_counters: Dict[str, Dict[str, int]] = {
+    mode: {"recovered": 0, "dropped": 0} for mode in ("text", "json", "json_repaired")
+}
+
+
+REGISTRY.register(
+    CallbackMetric(
+        "testcase_parsed_cases_total",
+        "Test cases recovered from Gemini responses and blocks dropped, by parse mode.",
+        "counter",
+        ("mode", "outcome"),
+        lambda: [
+            ((mode, outcome), count)
+            for mode, counters in parse_counters.items()
+            for outcome, count in counters.items()
+        ],
+    )
+)
+REGISTRY.register(
+    CallbackMetric(
+        "testcase_gemini_events_total",
+        "Gemini pool events: calls, retries, coalesced calls, rate-limited attempts.",
+        "counter",
+        ("event",),
+        lambda: [
+            ((event,), gemini_pool.stats[event])
+            for event in ("calls", "retries", "coalesced", "rate_limited")
+        ],
+    )
+)
+REGISTRY.register(
+    CallbackMetric(
+        "testcase_gemini_tokens_total",
+        "Tokens reported by Gemini usage metadata.",
+        "counter",
+        ("kind",),
+        lambda: [
+            (("prompt",), gemini_pool.stats["prompt_tokens"]),
+            (("output",), gemini_pool.stats["output_tokens"]),
+        ],
+    )
+)
+REGISTRY.register(
+    CallbackMetric(
+        "testcase_gemini_calls_in_flight",
+        "Gemini calls running and waiting for a pool slot.",
+        "gauge",
+        ("state",),
+        lambda: [
+            (("running",), gemini_pool.in_flight),
+            (("waiting",), gemini_pool.waiting),
+        ],
+    )
+)
 
 
-class ExportRequest(BaseModel):
-    test_cases: List[TestCase]
+def gemini_error_to_http(e: Exception, loc: Dict[str, str]) -> HTTPException:
+    """Переводит ошибку вызова Gemini в HTTPException с локализованным сообщением."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, GeminiBusyError):
+        UPSTREAM_ERRORS.inc(kind="busy")
+    elif is_rate_limit_error(e):
+        UPSTREAM_ERRORS.inc(kind="rate_limited")
+    elif isinstance(e, GeminiTimeoutError):
+        UPSTREAM_ERRORS.inc(kind="timeout")
+    else:
+        UPSTREAM_ERRORS.inc(kind=type(e).__name__)
+    if isinstance(e, GeminiBusyError) or is_rate_limit_error(e):
+        # Своя очередь переполнена или квота Gemini исчерпана даже после повторов
+        print(f"Gemini call rejected: {e}")
+        return HTTPException(
+            status_code=503,
+            detail=loc.get(
+                "backend_error_gemini_busy",
+                "The service is busy. Please try again in a few seconds.",
+            ),
+            headers={"Retry-After": "5"},
+        )
+    if isinstance(e, GeminiTimeoutError):
+        print(f"Gemini call timed out: {e}")
+        return HTTPException(
+            status_code=504,
+            detail=loc.get(
+                "backend_error_gemini_timeout", "Timeout contacting Gemini API."
+            ),
+        )
+    print(f"Error calling Gemini API or processing response: {e}")
+    if "API key not valid" in str(e):
+        return HTTPException(
+            status_code=500,
+            detail=loc.get("backend_error_gemini_key_invalid", "Gemini API key error."),
+        )
+    elif "Deadline" in str(e) or "timeout" in str(e):
+        return HTTPException(
+            status_code=504,
+            detail=loc.get(
+                "backend_error_gemini_timeout", "Timeout contacting Gemini API."
+            ),
+        )
+    if hasattr(e, "message"):
+        error_detail_msg = e.message
+    else:
+        error_detail_msg = str(e)
+    error_message = loc.get(
+        "backend_error_gemini_api_error", "Error calling Gemini API: {error_detail}"
+    )
+    return HTTPException(
+        status_code=500, detail=error_message.format(error_detail=error_detail_msg)
+    )
 
 
-@app.get("/", response_class=HTMLResponse)
-async def get_index(
-    request: Request, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
-):
-    # lang будет автоматически валидироваться благодаря Literal
-    locale_strings = get_locale_strings(lang)
-    # Передаем текущий язык и все строки локализации в шаблон
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "lang": lang,
-            "locales": locale_strings,
-            "supported_languages": SUPPORTED_LANGUAGES.__args__,
-        },
+def empty_gemini_response_error(response, loc: Dict[str, str]) -> HTTPException:
+    """Ошибка для пустого ответа Gemini: блокировка по безопасности или просто пусто."""
+    blocked_category = get_blocked_category(response)
+    UPSTREAM_ERRORS.inc(kind="blocked" if blocked_category else "empty_response")
+    if blocked_category:
+        error_message = loc.get(
+            "backend_error_gemini_request_blocked",
+            "Request blocked due to safety settings: {category}. Try modifying the text.",
+        )
+        return HTTPException(
+            status_code=400,
+            detail=error_message.format(category=blocked_category),
+        )
+    return HTTPException(
+        status_code=500,
+        detail=loc.get(
+            "backend_error_gemini_text_response_failed",
+            "Failed to get text response from Gemini.",
+        ),
     )
 
 
-@app.post("/generate")
-async def generate_test_cases_endpoint(
-    request: Request,
-    requirements_text: Optional[str] = Form(None),
-    pdf_file: Optional[UploadFile] = File(None),
-    custom_prompt: Optional[str] = Form(None),
-    lang: Optional[SUPPORTED_LANGUAGES] = Form(
-        DEFAULT_LANGUAGE
-    ),  # Получаем язык из формы
+# Просьба продолжить ответ, оборванный по лимиту токенов
+CONTINUATION_INSTRUCTIONS = {
+    "text": (
+        "Ответ оборвался из-за ограничения длины. Продолжи со следующего "
+        "тест-кейса после последнего полностью приведённого, в том же формате "
+        "и не повторяя уже написанные тест-кейсы."
+    ),
+    "json": (
+        "Ответ оборвался из-за ограничения длины. Верни оставшиеся тест-кейсы "
+        "новым JSON-массивом по той же схеме, не повторяя уже написанные."
+    ),
+}
+
+
+def complete_response_prefix(generated_text: str, output_format: str) -> str:
+    """Оборванный ответ, урезанный до последнего целого тест-кейса."""
+    if output_format == "json":
+        return complete_json_items_prefix(generated_text)
+    return complete_cases_prefix(generated_text)
+
+
+def continuation_contents(
+    final_prompt: str, segments: List[str], output_format: str
+) -> List[Dict]:
+    """История диалога для дозапроса: промпт, полученные части ответа и просьба продолжить."""
+    contents = [{"role": "user", "parts": [final_prompt]}]
+    for segment in segments:
+        contents.append({"role": "model", "parts": [segment]})
+        contents.append(
+            {"role": "user", "parts": [CONTINUATION_INSTRUCTIONS[output_format]]}
+        )
+    return contents
+
+
+async def generate_text_with_gemini(
+    final_prompt: str,
+    loc: Dict[str, str],
+    output_format: str = "text",
+    usage: Optional[Dict[str, int]] = None,
+    generation_config: Optional[Dict] = None,
+) -> List[str]:
+    """
+    Отправляет промпт в Gemini через пул вызовов (не блокируя event loop).
+    Бюджет ответа подбирается под размер промпта; если ответ оборвался по
+    лимиту токенов, дозапрашивается продолжение после последнего целого
+    тест-кейса. Возвращает части ответа по порядку, расход токенов
+    прибавляется к usage. Ошибки переводятся в HTTPException.
+    """
+    if usage is None:
+        usage = new_token_usage()
+    prompt_tokens = estimate_tokens(final_prompt)
+    usage["estimated_prompt_tokens"] += prompt_tokens
+    max_output_tokens = estimate_output_tokens(prompt_tokens)
+    segments: List[str] = []
+    response = None
+    print(f"Sending prompt to Gemini (first 100 chars): {final_prompt[:100]}")
+    for call_index in range(GEMINI_MAX_CONTINUATIONS + 1):
+        if call_index:
+            usage["continuations"] += 1
+        contents = final_prompt
+        if segments:
+            contents = continuation_contents(final_prompt, segments, output_format)
+        call_config = {**(generation_config or {}), "max_output_tokens": max_output_tokens}
+        try:
+            with span("gemini"):
+                response = await gemini_pool.generate(
+                    get_model(), contents, generation_config=call_config
+                )
+            generated_text = extract_response_text(response)
+        except Exception as e:
+            raise gemini_error_to_http(e, loc)
+        usage["calls"] += 1
+        add_token_usage(usage, response)
+
+        if not is_truncated(response):
+            segments.append(generated_text)
+            break
+        complete_text = complete_response_prefix(generated_text, output_format)
+        if complete_text.strip():
+            segments.append(complete_text)
+        elif max_output_tokens >= GEMINI_MAX_OUTPUT_TOKENS:
+            # Даже один тест-кейс не уложился в потолок модели: разбираем как есть
+            segments.append(generated_text)
+            usage["truncated"] += 1
+            break
+        # Продолжение (или повтор, если не уложился ни один тест-кейс) - с запасом
+        max_output_tokens = min(GEMINI_MAX_OUTPUT_TOKENS, max_output_tokens * 2)
+    else:
+        usage["truncated"] += 1
+        print(
+            f"Warning: Gemini response is still truncated after "
+            f"{GEMINI_MAX_CONTINUATIONS} continuations."
+        )
+
+    if not "".join(segments).strip():
+        raise empty_gemini_response_error(response, loc)
+    return segments
+
+
+def prompt_cache_key(final_prompt: str, output_format: str = "text") -> str:
+    """Ключ кэша: промпт, модель и итоговые настройки генерации для режима вывода."""
+    generation_config = GENERATION_CONFIG
+    if output_format == "json":
+        generation_config = {**GENERATION_CONFIG, **JSON_GENERATION_CONFIG}
+    return make_cache_key(final_prompt, current_model_name(), generation_config)
+
+
+def record_parse_result(mode: str, recovered: int, dropped: int) -> None:
+    counters = parse_counters.setdefault(mode, {"recovered": 0, "dropped": 0})
+    counters["recovered"] += recovered
+    counters["dropped"] += dropped
+
+
+def validate_test_case_items(raw_items: Any) -> Optional[Tuple[List[Dict[str, str]], int]]:
+    """Проверяет элементы JSON-массива по одному. None - это не массив."""
+    if not isinstance(raw_items, list):
+        return None
+    validated = []
+    dropped = 0
+    for raw_item in raw_items:
+        try:
+            validated.append(TEST_CASE_ADAPTER.validate_python(raw_item))
+        except ValidationError:
+            dropped += 1
+    return validated, dropped
+
+
+def repair_json_response(generated_text: str) -> Optional[Tuple[List[Dict[str, str]], int]]:
+    """
+    Разбирает испорченный JSON-ответ: текст до "[" (например, "```json")
+    отбрасывается, оборванный массив урезается до последнего целого объекта
+    и закрывается. None - ни одного целого объекта нет.
+    """
+    start = generated_text.find("[")
+    if start < 0:
+        return None
+    repaired_text = complete_json_items_prefix(generated_text[start:])
+    if not repaired_text:
+        return None
+    try:
+        raw_items = json.loads(repaired_text)
+    except ValueError:
+        return None
+    return validate_test_case_items(raw_items)
+
+
+def parse_structured_response(
+    generated_text: str,
+) -> Optional[Tuple[List[Dict[str, str]], int, bool]]:
+    """
+    Разбирает JSON-ответ Gemini одной проверкой через TypeAdapter.
+    Если отдельные элементы невалидны, они отбрасываются по одному; оборванный
+    или обёрнутый в текст массив чинится (repair_json_response).
+    Возвращает (test_cases, dropped, repaired) или None, если JSON не спасти.
+    """
+    repaired = False
+    try:
+        validated = TEST_CASE_LIST_ADAPTER.validate_json(generated_text)
+        dropped = 0
+    except ValidationError:
+        try:
+            structured = validate_test_case_items(json.loads(generated_text))
+        except ValueError:
+            structured = repair_json_response(generated_text)
+            repaired = True
+        if structured is None:
+            return None
+        validated, dropped = structured
+
+    # Адаптер сразу отдаёт словари в порядке полей схемы
+    for test_case in validated:
+        if test_case["Тип"] not in ["Позитивный", "Негативный"]:
+            test_case["Тип"] = "Не определен"
+    return validated, dropped, repaired
+
+
+async def generate_test_cases_for_prompt(
+    final_prompt: str,
+    loc: Dict[str, str],
+    use_cache: bool = True,
+    cache_key: Optional[str] = None,
+    output_format: str = "text",
+    usage: Optional[Dict[str, int]] = None,
 ):
-    loc = get_locale_strings(lang)  # Получаем строки для текущего языка
+    """
+    Генерирует и парсит тест-кейсы для одного промпта с учётом кэша.
+    В режиме output_format="json" Gemini возвращает JSON по схеме тест-кейса;
+    оборванный JSON чинится, а если не спасти ни одного тест-кейса, промпт
+    запрашивается повторно (JSON_PARSE_RETRIES раз).
+    Части ответа, дозапрошенные после обрыва по лимиту токенов, склеиваются.
+    Возвращает (test_cases, cache_tier), где cache_tier = None при промахе.
+    """
+    if cache_key is None:
+        cache_key = prompt_cache_key(final_prompt, output_format)
+    if use_cache and GENERATION_CACHE_ENABLED:
+        with span("cache_lookup"):
+            cached_test_cases, cache_tier = await generation_cache.get(cache_key)
+        if cached_test_cases is not None:
+            return cached_test_cases, cache_tier
+
+    if output_format == "json":
+        # Ответ, в котором не нашлось ни одного целого тест-кейса, запрашивается
+        # ещё раз: промпт требует JSON, текстовому парсеру разбирать нечего
+        for attempt in range(1 + JSON_PARSE_RETRIES):
+            segments = await generate_text_with_gemini(
+                final_prompt, loc, "json", usage, generation_config=JSON_GENERATION_CONFIG
+            )
+            test_cases = []
+            unparsed_segments = 0
+            with span("parse"):
+                for generated_text in segments:
+                    structured = parse_structured_response(generated_text)
+                    if structured is None:
+                        unparsed_segments += 1
+                        continue
+                    segment_test_cases, dropped, repaired = structured
+                    record_parse_result(
+                        "json_repaired" if repaired else "json",
+                        len(segment_test_cases),
+                        dropped,
+                    )
+                    test_cases.extend(segment_test_cases)
+            if test_cases or not unparsed_segments:
+                break
+            record_parse_result("json", 0, unparsed_segments)
+            print(f"Malformed JSON from Gemini (attempt {attempt + 1}), no test cases recovered.")
+    else:
+        segments = await generate_text_with_gemini(final_prompt, loc, usage=usage)
+        # Каждая часть начинается с нового тест-кейса, поэтому их можно склеить
+        with span("parse"):
+            test_cases, dropped = parse_gemini_response_with_stats(
+                "\n".join(segments)
+            )  # parse_gemini_response должен быть нечувствителен к языку структуры
+        record_parse_result("text", len(test_cases), dropped)
+
+    if test_cases and GENERATION_CACHE_ENABLED:
+        await generation_cache.set(cache_key, test_cases)
+    return test_cases, None
+
+
+def start_chunk_tasks(
+    final_prompts: List[str],
+    loc: Dict[str, str],
+    use_cache: bool = True,
+    output_format: str = "text",
+    usage: Optional[Dict[str, int]] = None,
+) -> List[asyncio.Task]:
+    """Запускает генерацию кусков параллельно, не больше CHUNK_CONCURRENCY одновременно."""
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+    async def run_chunk(chunk_prompt: str):
+        async with semaphore:
+            return await generate_test_cases_for_prompt(
+                chunk_prompt, loc, use_cache, output_format=output_format, usage=usage
+            )
+
+    return [
+        asyncio.create_task(run_chunk(chunk_prompt)) for chunk_prompt in final_prompts
+    ]
+
+
+async def generate_test_cases_chunked(
+    final_prompts: List[str],
+    loc: Dict[str, str],
+    use_cache: bool = True,
+    output_format: str = "text",
+    usage: Optional[Dict[str, int]] = None,
+):
+    """
+    Map-reduce генерация: промпты кусков отправляются параллельно, результаты
+    склеиваются в исходном порядке. Возвращает (test_cases, cache_status, failed_chunks).
+    """
+    results = await asyncio.gather(
+        *start_chunk_tasks(final_prompts, loc, use_cache, output_format, usage),
+        return_exceptions=True,
+    )
+
+    test_cases: List[Dict[str, str]] = []
+    failed_chunks: List[int] = []
+    hits = 0
+    first_error: Optional[BaseException] = None
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            print(f"Chunk {index} failed: {result}")
+            failed_chunks.append(index)
+            first_error = first_error or result
+            continue
+        chunk_test_cases, cache_tier = result
+        test_cases.extend(chunk_test_cases)
+        if cache_tier:
+            hits += 1
+
+    if first_error is not None and len(failed_chunks) == len(final_prompts):
+        raise first_error
+    if hits == len(final_prompts):
+        cache_status = "HIT"
+    elif hits:
+        cache_status = "PARTIAL"
+    else:
+        cache_status = "MISS"
+    return test_cases, cache_status, failed_chunks
+
+
+async def stream_test_cases_for_prompt(
+    final_prompt: str,
+    loc: Dict[str, str],
+    use_cache: bool = True,
+    usage: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[Dict[str, str]]:
+    """
+    Потоковая генерация для одного промпта: тест-кейсы отдаются по мере того,
+    как Gemini их дописывает. Если ответ оборвался по лимиту токенов,
+    недописанный тест-кейс отбрасывается и продолжение запрашивается так же
+    потоково. Полный результат по завершении кладётся в кэш.
+    """
+    cache_key = prompt_cache_key(final_prompt)
+    if use_cache and GENERATION_CACHE_ENABLED:
+        with span("cache_lookup"):
+            cached_test_cases, _ = await generation_cache.get(cache_key)
+        if cached_test_cases is not None:
+            for test_case in cached_test_cases:
+                yield test_case
+            return
+
+    if usage is None:
+        usage = new_token_usage()
+    prompt_tokens = estimate_tokens(final_prompt)
+    usage["estimated_prompt_tokens"] += prompt_tokens
+    max_output_tokens = estimate_output_tokens(prompt_tokens)
+    segments: List[str] = []
+    test_cases: List[Dict[str, str]] = []
+    received_text = False
+    last_chunk = None
+    finished = False
+    print(f"Streaming prompt to Gemini (first 100 chars): {final_prompt[:100]}")
+    for call_index in range(GEMINI_MAX_CONTINUATIONS + 1):
+        if call_index:
+            usage["continuations"] += 1
+        contents = final_prompt
+        if segments:
+            contents = continuation_contents(final_prompt, segments, "text")
+        parser = IncrementalResponseParser()
+        chunk_texts: List[str] = []
+        last_chunk = None
+        stream_started_at = time.perf_counter()
+        try:
+            async for chunk in gemini_pool.stream(
+                get_model(),
+                contents,
+                generation_config={"max_output_tokens": max_output_tokens},
+            ):
+                last_chunk = chunk
+                chunk_text = extract_response_text(chunk)
+                if not chunk_text:
+                    continue
+                chunk_texts.append(chunk_text)
+                received_text = received_text or bool(chunk_text.strip())
+                for test_case in parser.feed(chunk_text):
+                    test_cases.append(test_case)
+                    yield test_case
+        except Exception as e:
+            raise gemini_error_to_http(e, loc)
+        # Вместе с разбором на лету: он идёт между кусками ответа
+        record_stage("gemini_stream", time.perf_counter() - stream_started_at)
+        usage["calls"] += 1
+        # Итоговый расход токенов приходит в последнем куске потока
+        add_token_usage(usage, last_chunk)
+
+        if not is_truncated(last_chunk):
+            finished = True
+            break
+        # Отданные тест-кейсы совпадают с целой частью ответа, недописанный
+        # хвост остаётся в парсере и отбрасывается
+        complete_text = complete_cases_prefix("".join(chunk_texts))
+        if complete_text.strip():
+            segments.append(complete_text)
+        elif max_output_tokens >= GEMINI_MAX_OUTPUT_TOKENS:
+            usage["truncated"] += 1
+            finished = True
+            break
+        max_output_tokens = min(GEMINI_MAX_OUTPUT_TOKENS, max_output_tokens * 2)
+    else:
+        usage["truncated"] += 1
+        print(
+            f"Warning: Gemini response is still truncated after "
+            f"{GEMINI_MAX_CONTINUATIONS} continuations."
+        )
+
+    if not received_text:
+        raise empty_gemini_response_error(last_chunk, loc)
+    if finished:
+        for test_case in parser.close():
+            test_cases.append(test_case)
+            yield test_case
+
+    if test_cases and GENERATION_CACHE_ENABLED:
+        await generation_cache.set(cache_key, test_cases)
+
+
+def sse_event(event: str, data) -> str:
+    """Форматирует одно событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def get_pdf_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Пул процессов для извлечения текста из PDF (создаётся при первом вызове).
+    При PDF_EXTRACT_WORKERS=0 возвращает None - тогда работает пул потоков по умолчанию.
+    """
+    global pdf_executor
+    if pdf_executor is None and PDF_EXTRACT_WORKERS > 0:
+        pdf_executor = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return pdf_executor
+
+
+def shutdown_pdf_executor() -> None:
+    """Останавливает процессы пула извлечения PDF (при остановке или перезагрузке)."""
+    global pdf_executor
+    if pdf_executor is not None:
+        pdf_executor.shutdown(cancel_futures=True)
+        pdf_executor = None
+
+
+async def spool_upload_to_disk(upload: UploadFile) -> Tuple[str, str]:
+    """
+    Копирует загруженный файл во временный файл на диске кусками.
+    Возвращает путь и SHA-256 содержимого (считается по ходу копирования).
+    """
+
+    def copy_to_disk() -> Tuple[str, str]:
+        upload.file.seek(0)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_file:
+            while True:
+                chunk = upload.file.read(UPLOAD_COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                tmp_file.write(chunk)
+            return tmp_file.name, hasher.hexdigest()
+
+    return await asyncio.to_thread(copy_to_disk)
+
+
+async def strip_boilerplate_with_stats(
+    page_texts: List[str], doc_hash: str
+) -> Tuple[List[str], Dict[str, int]]:
+    """Очищает страницы от служебного текста и считает, сколько сэкономлено."""
+    with span("pdf_strip_boilerplate"):
+        cleaned_texts = await asyncio.to_thread(strip_pdf_boilerplate, page_texts)
+    raw_text = "\n".join(page_texts)[:MAX_CHUNKED_INPUT_CHARS]
+    cleaned_text = "\n".join(cleaned_texts)[:MAX_CHUNKED_INPUT_CHARS]
+    stats = {
+        "chars_before": len(raw_text),
+        "chars_after": len(cleaned_text),
+        "chars_saved": len(raw_text) - len(cleaned_text),
+        "tokens_saved": max(estimate_tokens(raw_text) - estimate_tokens(cleaned_text), 0),
+    }
+    PDF_BOILERPLATE_REMOVED.inc(stats["chars_saved"], unit="chars")
+    PDF_BOILERPLATE_REMOVED.inc(stats["tokens_saved"], unit="tokens")
+    share = stats["chars_saved"] / stats["chars_before"] if stats["chars_before"] else 0.0
+    print(
+        f"PDF {doc_hash[:12]}: boilerplate removed {stats['chars_saved']} chars "
+        f"(~{stats['tokens_saved']} tokens, {share:.0%})"
+    )
+    return cleaned_texts, stats
+
+
+async def extract_pdf_text_cached(
+    pdf_path: str, doc_hash: str, stats: Optional[Dict[str, int]] = None
+) -> str:
+    """
+    Извлекает текст PDF с учётом кэша: для уже виденного файла (тот же SHA-256)
+    парсинг не нужен, для новой версии документа перечитываются только
+    страницы, содержимое которых изменилось. В кэше хранится исходный текст
+    страниц, очистка от колонтитулов выполняется после него; в stats
+    записывается, сколько символов и токенов она сэкономила.
+    """
+    executor = get_pdf_executor()
+    loop = asyncio.get_running_loop()
+    # Время воркеров по библиотекам (сумма по параллельным задачам)
+    library_timings: Dict[str, float] = {}
+    if pdf_text_cache.store is None:
+        with span("pdf_count_pages"):
+            page_count = await loop.run_in_executor(
+                executor, count_pdf_pages, pdf_path
+            )
+        with span("pdf_extract"):
+            page_texts = await extract_pdf_page_texts(
+                pdf_path,
+                page_count,
+                char_budget=MAX_CHUNKED_INPUT_CHARS,
+                executor=executor,
+                max_parallel_tasks=max(PDF_EXTRACT_WORKERS, 1),
+                timings=library_timings,
+            )
+    else:
+        with span("pdf_cache_lookup"):
+            page_hashes = await pdf_text_cache.get_page_hashes(doc_hash)
+        if page_hashes is None:
+            with span("pdf_fingerprint"):
+                page_hashes = await loop.run_in_executor(
+                    executor, fingerprint_pdf_pages, pdf_path
+                )
+        with span("pdf_cache_lookup"):
+            cached_texts = await pdf_text_cache.get_pages(page_hashes)
+        known_pages = {
+            page_number: cached_texts[page_hash]
+            for page_number, page_hash in enumerate(page_hashes)
+            if page_hash in cached_texts
+        }
+        with span("pdf_extract"):
+            page_texts = await extract_pdf_page_texts(
+                pdf_path,
+                len(page_hashes),
+                known_pages,
+                char_budget=MAX_CHUNKED_INPUT_CHARS,
+                executor=executor,
+                max_parallel_tasks=max(PDF_EXTRACT_WORKERS, 1),
+                timings=library_timings,
+            )
+        new_pages = {
+            page_hashes[page_number]: page_text
+            for page_number, page_text in enumerate(page_texts)
+            if page_number not in known_pages
+        }
+        print(
+            f"PDF {doc_hash[:12]}: {len(page_texts) - len(new_pages)} cached, "
+            f"{len(new_pages)} extracted of {len(page_hashes)} pages"
+        )
+        await pdf_text_cache.put(doc_hash, page_hashes, new_pages)
+    for library, seconds in library_timings.items():
+        if seconds:
+            record_stage(library, seconds)
+    if PDF_STRIP_BOILERPLATE:
+        page_texts, strip_stats = await strip_boilerplate_with_stats(
+            page_texts, doc_hash
+        )
+        if stats is not None:
+            stats.update(strip_stats)
+    return "\n".join(page_texts)[:MAX_CHUNKED_INPUT_CHARS]
+
+
+async def read_generation_input(
+    requirements_text: Optional[str],
+    pdf_file: Optional[UploadFile],
+    loc: Dict[str, str],
+    stats: Optional[Dict[str, int]] = None,
+) -> str:
+    """
+    Возвращает текст требований из формы или загруженного PDF. Для PDF в stats
+    попадает экономия от очистки служебного текста (см. extract_pdf_text_cached).
+    """
     input_text = ""
     if pdf_file:
         if pdf_file.content_type != "application/pdf":
@@ -155,10 +1048,11 @@ async def generate_test_cases_endpoint(
                 status_code=400,
                 detail=loc.get("backend_error_invalid_file_type", "Invalid file type."),
             )
+        pdf_path = None
         try:
-            contents = await pdf_file.read()
-            pdf_stream = io.BytesIO(contents)
-            extracted_text = extract_text_from_pdf(pdf_stream)
+            with span("read_upload"):
+                pdf_path, doc_hash = await spool_upload_to_disk(pdf_file)
+            extracted_text = await extract_pdf_text_cached(pdf_path, doc_hash, stats)
             if not extracted_text or not extracted_text.strip():
                 raise HTTPException(
                     status_code=400,
@@ -167,6 +1061,8 @@ async def generate_test_cases_endpoint(
                     ),
                 )
             input_text = extracted_text
+        except HTTPException:
+            raise
         except Exception as e:
             # Не используем loc здесь, так как это более общая ошибка сервера
             raise HTTPException(
@@ -174,6 +1070,8 @@ async def generate_test_cases_endpoint(
             )
         finally:
             await pdf_file.close()
+            if pdf_path:
+                os.unlink(pdf_path)
     elif requirements_text:
         input_text = requirements_text.strip()
     else:
@@ -188,209 +1086,897 @@ async def generate_test_cases_endpoint(
             detail=loc.get("backend_error_input_empty", "Input is empty."),
         )
 
-    MAX_INPUT_CHARS = 60000
-    if len(input_text) > MAX_INPUT_CHARS:
-        input_text = input_text[:MAX_INPUT_CHARS]
-        print(f"Warning: Input text was truncated to {MAX_INPUT_CHARS} characters.")
+    return input_text
+
+
+def drop_near_duplicates(
+    test_cases: List[Dict[str, str]], dedup: bool, threshold: float
+) -> Tuple[List[Dict[str, str]], int]:
+    """Схлопывает почти одинаковые тест-кейсы. Возвращает (кейсы, сколько удалено)."""
+    if not dedup or len(test_cases) < 2:
+        return test_cases, 0
+    with span("dedup"):
+        kept, _ = collapse_near_duplicates(test_cases, threshold)
+    return kept, len(test_cases) - len(kept)
+
+
+def select_prompt_template(custom_prompt: Optional[str], output_format: str) -> str:
+    """Пользовательский шаблон (если в нём есть {requirements_text}) или шаблон по умолчанию."""
+    if custom_prompt and "{requirements_text}" in custom_prompt:
+        return custom_prompt
+    if output_format == "json":
+        return DEFAULT_JSON_PROMPT_TEMPLATE
+    return DEFAULT_PROMPT_TEMPLATE
 
-    prompt_template_to_use = (
-        custom_prompt
-        if custom_prompt and "{requirements_text}" in custom_prompt
-        else DEFAULT_PROMPT_TEMPLATE
+
+def record_history(
+    user_id: Optional[str],
+    endpoint: str,
+    input_text: str,
+    custom_prompt: Optional[str],
+    output_format: str,
+    chunks: int,
+    cache_status: Optional[str],
+    test_cases: List[Dict[str, str]],
+    started_at: float,
+    extracted_at: float,
+) -> None:
+    """Ставит генерацию в очередь записи истории (без ожидания БД)."""
+    finished_at = time.perf_counter()
+    history_recorder.record(
+        user_id=user_id or "anonymous",
+        endpoint=endpoint,
+        input_hash=hashlib.sha256(input_text.encode("utf-8")).hexdigest(),
+        input_chars=len(input_text),
+        prompt=select_prompt_template(custom_prompt, output_format),
+        model=current_model_name(),
+        output_format=output_format,
+        chunks=chunks,
+        cache_status=cache_status,
+        test_case_count=len(test_cases),
+        test_cases=test_cases,
+        timings={
+            "extract_ms": round((extracted_at - started_at) * 1000, 1),
+            "generate_ms": round((finished_at - extracted_at) * 1000, 1),
+            "total_ms": round((finished_at - started_at) * 1000, 1),
+        },
     )
+
+
+def build_final_prompts(
+    input_text: str,
+    custom_prompt: Optional[str],
+    chunked: bool = False,
+    output_format: str = "text",
+) -> List[str]:
+    """
+    Собирает финальные промпты. Тексты длиннее MAX_INPUT_CHARS (или любые при
+    chunked=True) делятся на куски по разделам - по промпту на кусок.
+    """
+    prompt_template_to_use = select_prompt_template(custom_prompt, output_format)
     # Важно: DEFAULT_PROMPT_TEMPLATE тоже нужно бы локализовать или сделать так,
     # чтобы он был нейтральным к языку и Gemini генерировал на языке требований.
     # Пока оставим его как есть, т.к. он описывает структуру.
-    final_prompt = prompt_template_to_use.format(requirements_text=input_text)
 
-    try:
-        print(f"Sending prompt to Gemini (first 100 chars): {final_prompt[:100]}")
-        response = model.generate_content(final_prompt)
-        generated_text = ""
-        if hasattr(response, "text") and response.text:
-            generated_text = response.text
-        elif hasattr(response, "parts") and response.parts:
-            generated_text = "".join(
-                part.text for part in response.parts if hasattr(part, "text")
+    if not chunked and len(input_text) <= MAX_INPUT_CHARS:
+        return [prompt_template_to_use.format(requirements_text=input_text)]
+
+    if len(input_text) > MAX_CHUNKED_INPUT_CHARS:
+        input_text = input_text[:MAX_CHUNKED_INPUT_CHARS]
+        print(
+            f"Warning: Input text was truncated to {MAX_CHUNKED_INPUT_CHARS} characters."
+        )
+    chunks = split_requirements_into_chunks(input_text, CHUNK_MAX_CHARS)
+    print(f"Chunked generation: {len(chunks)} chunks.")
+    return [prompt_template_to_use.format(requirements_text=chunk) for chunk in chunks]
+
+
+@app.get("/", response_class=HTMLResponse)
+async def get_index(
+    request: Request, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
+):
+    # lang будет автоматически валидироваться благодаря Literal
+    locale_strings = get_locale_strings(lang)
+    # Передаем текущий язык и все строки локализации в шаблон
+    return templates.TemplateResponse(
+        "index.html",
+        {
+            "request": request,
+            "lang": lang,
+            "locales": locale_strings,
+            "supported_languages": SUPPORTED_LANGUAGES.__args__,
+        },
+    )
+
+
+@app.post("/generate")
+async def generate_test_cases_endpoint(
+    request: Request,
+    response: Response,
+    requirements_text: Optional[str] = Form(None),
+    pdf_file: Optional[UploadFile] = File(None),
+    custom_prompt: Optional[str] = Form(None),
+    lang: Optional[SUPPORTED_LANGUAGES] = Form(
+        DEFAULT_LANGUAGE
+    ),  # Получаем язык из формы
+    use_cache: bool = Form(True),  # False - принудительно перегенерировать
+    chunked: bool = Form(False),  # True - генерировать по кускам документа
+    output_format: OUTPUT_FORMATS = Form("text"),  # "json" - структурированный вывод
+    dedup: bool = Form(DEDUP_ENABLED),  # Схлопывать почти одинаковые тест-кейсы
+    dedup_threshold: float = Form(DEDUP_THRESHOLD, ge=0.0, le=1.0),
+    x_user_id: Optional[str] = Header(None),  # Владелец записи в истории
+):
+    started_at = time.perf_counter()
+    loc = get_locale_strings(lang)  # Получаем строки для текущего языка
+    # Сколько служебного текста PDF убрано до промпта (пусто для текста из формы)
+    input_stats: Dict[str, int] = {}
+    with span("read_input"):
+        input_text = await read_generation_input(
+            requirements_text, pdf_file, loc, input_stats
+        )
+    extracted_at = time.perf_counter()
+    final_prompts = build_final_prompts(
+        input_text, custom_prompt, chunked, output_format
+    )
+    usage = new_token_usage()
+
+    if len(final_prompts) > 1:
+        # Большой документ: куски генерируются параллельно
+        test_cases, cache_status, failed_chunks = await generate_test_cases_chunked(
+            final_prompts, loc, use_cache, output_format, usage
+        )
+        response.headers["X-Cache"] = cache_status
+        response.headers["X-Chunks"] = str(len(final_prompts))
+        result = {"test_cases": test_cases, "chunks": len(final_prompts)}
+        if failed_chunks:
+            result["failed_chunks"] = failed_chunks
+    else:
+        final_prompt = final_prompts[0]
+        cache_key = prompt_cache_key(final_prompt, output_format)
+        test_cases, cache_tier = await generate_test_cases_for_prompt(
+            final_prompt, loc, use_cache, cache_key, output_format, usage
+        )
+        response.headers["X-Cache-Key"] = cache_key
+        response.headers["X-Cache"] = "HIT" if cache_tier else "MISS"
+        if cache_tier:
+            response.headers["X-Cache-Tier"] = cache_tier
+        result = {"test_cases": test_cases}
+
+    test_cases, duplicates_removed = drop_near_duplicates(
+        test_cases, dedup, dedup_threshold
+    )
+    result["test_cases"] = test_cases
+    result["usage"] = usage
+    if input_stats:
+        result["boilerplate_removed"] = input_stats
+        response.headers["X-Boilerplate-Chars-Saved"] = str(input_stats["chars_saved"])
+    if duplicates_removed:
+        result["duplicates_removed"] = duplicates_removed
+    if test_cases:
+        # ID для GET /export/{result_id}: экспорт без повторной отправки тест-кейсов
+        result_id = await result_store.put(test_cases)
+        if result_id:
+            result["result_id"] = result_id
+
+    record_history(
+        x_user_id,
+        "generate",
+        input_text,
+        custom_prompt,
+        output_format,
+        len(final_prompts),
+        response.headers["X-Cache"],
+        test_cases,
+        started_at,
+        extracted_at,
+    )
+    if not test_cases:
+        result["message"] = loc.get(
+            "backend_error_parsing_failed", "Could not parse test cases."
+        )
+    # Тест-кейсы будут на том языке, на котором их сгенерировал Gemini.
+    # Ответ сериализуется сразу в байты, минуя jsonable_encoder
+    return fast_json_response(result, response)
+
+
+@app.post("/generate_stream")
+async def generate_test_cases_stream_endpoint(
+    request: Request,
+    requirements_text: Optional[str] = Form(None),
+    pdf_file: Optional[UploadFile] = File(None),
+    custom_prompt: Optional[str] = Form(None),
+    lang: Optional[SUPPORTED_LANGUAGES] = Form(DEFAULT_LANGUAGE),
+    use_cache: bool = Form(True),
+    chunked: bool = Form(False),
+    dedup: bool = Form(DEDUP_ENABLED),
+    dedup_threshold: float = Form(DEDUP_THRESHOLD, ge=0.0, le=1.0),
+    x_user_id: Optional[str] = Header(None),
+):
+    """
+    Потоковый вариант /generate (text/event-stream). События:
+    test_case - очередной тест-кейс, error - ошибка генерации, done - конец.
+    """
+    started_at = time.perf_counter()
+    loc = get_locale_strings(lang)
+    # Сколько служебного текста PDF убрано до промпта (пусто для текста из формы)
+    input_stats: Dict[str, int] = {}
+    with span("read_input"):
+        input_text = await read_generation_input(
+            requirements_text, pdf_file, loc, input_stats
+        )
+    extracted_at = time.perf_counter()
+    final_prompts = build_final_prompts(input_text, custom_prompt, chunked)
+
+    async def event_stream():
+        sent_test_cases: List[Dict[str, str]] = []
+        failed_chunks: List[int] = []
+        tasks: List[asyncio.Task] = []
+        # Дубли отсеиваются на лету, до отправки клиенту
+        duplicate_index = NearDuplicateIndex(dedup_threshold) if dedup else None
+        duplicates_removed = 0
+        usage = new_token_usage()
+
+        def accept(test_case: Dict[str, str]) -> bool:
+            nonlocal duplicates_removed
+            if duplicate_index and duplicate_index.add(test_case) is not None:
+                duplicates_removed += 1
+                return False
+            sent_test_cases.append(test_case)
+            return True
+
+        try:
+            if len(final_prompts) == 1:
+                async for test_case in stream_test_cases_for_prompt(
+                    final_prompts[0], loc, use_cache, usage
+                ):
+                    if accept(test_case):
+                        yield sse_event("test_case", test_case)
+            else:
+                # Куски генерируются параллельно, а отдаются в порядке документа
+                tasks = start_chunk_tasks(
+                    final_prompts, loc, use_cache, usage=usage
+                )
+                first_error: Optional[Exception] = None
+                for index, task in enumerate(tasks):
+                    try:
+                        chunk_test_cases, _ = await task
+                    except Exception as e:
+                        print(f"Chunk {index} failed: {e}")
+                        failed_chunks.append(index)
+                        first_error = first_error or e
+                        continue
+                    for test_case in chunk_test_cases:
+                        if accept(test_case):
+                            yield sse_event("test_case", test_case)
+                if first_error is not None and len(failed_chunks) == len(tasks):
+                    raise first_error
+        except Exception as e:
+            http_error = gemini_error_to_http(e, loc)
+            yield sse_event(
+                "error",
+                {"status_code": http_error.status_code, "detail": http_error.detail},
             )
-        elif isinstance(response, str):
-            generated_text = response
-
-        if not generated_text.strip():
-            if hasattr(response, "prompt_feedback") and response.prompt_feedback:
-                for rating in response.prompt_feedback.safety_ratings:
-                    if rating.blocked:
-                        error_message = loc.get(
-                            "backend_error_gemini_request_blocked",
-                            "Request blocked due to safety settings: {category}. Try modifying the text.",
-                        )
-                        raise HTTPException(
-                            status_code=400,
-                            detail=error_message.format(category=rating.category),
-                        )
-            raise HTTPException(
-                status_code=500,
-                detail=loc.get(
-                    "backend_error_gemini_text_response_failed",
-                    "Failed to get text response from Gemini.",
-                ),
+            return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        record_history(
+            x_user_id,
+            "generate_stream",
+            input_text,
+            custom_prompt,
+            "text",
+            len(final_prompts),
+            None,
+            sent_test_cases,
+            started_at,
+            extracted_at,
+        )
+        done = {
+            "count": len(sent_test_cases),
+            "chunks": len(final_prompts),
+            "usage": usage,
+        }
+        if failed_chunks:
+            done["failed_chunks"] = failed_chunks
+        if input_stats:
+            done["boilerplate_removed"] = input_stats
+        if duplicates_removed:
+            done["duplicates_removed"] = duplicates_removed
+        if sent_test_cases:
+            result_id = await result_store.put(sent_test_cases)
+            if result_id:
+                done["result_id"] = result_id
+        if not sent_test_cases:
+            done["message"] = loc.get(
+                "backend_error_parsing_failed", "Could not parse test cases."
             )
+        yield sse_event("done", done)
 
-    except Exception as e:
-        print(f"Error calling Gemini API or processing response: {e}")
-        if "API key not valid" in str(e):
-            raise HTTPException(
-                status_code=500,
-                detail=loc.get(
-                    "backend_error_gemini_key_invalid", "Gemini API key error."
-                ),
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if input_stats:
+        headers["X-Boilerplate-Chars-Saved"] = str(input_stats["chars_saved"])
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers=headers
+    )
+
+
+async def process_batch_item(item: Dict) -> Dict:
+    """Генерирует тест-кейсы для одного документа пакетного задания."""
+    # Этапы элементов пакета попадают в метрики с endpoint="batch_item"
+    start_request_timings("batch_item")
+    options = item["options"]
+    loc = get_locale_strings(options["lang"])
+    input_stats: Dict[str, int] = {}
+    with span("read_input"):
+        if item["kind"] == "pdf":
+            input_text = await extract_pdf_text_cached(
+                item["source_path"], item["source_hash"], input_stats
             )
-        elif "Deadline" in str(e) or "timeout" in str(e):
-            raise HTTPException(
-                status_code=504,
-                detail=loc.get(
-                    "backend_error_gemini_timeout", "Timeout contacting Gemini API."
-                ),
+        else:
+            input_text = await asyncio.to_thread(
+                Path(item["source_path"]).read_text, encoding="utf-8", errors="replace"
             )
-        if hasattr(e, "message"):
-            error_detail_msg = e.message
+    if not input_text.strip():
+        raise ValueError(loc.get("backend_error_input_empty", "Input is empty."))
+
+    output_format = options["output_format"]
+    final_prompts = build_final_prompts(
+        input_text, options["custom_prompt"], output_format=output_format
+    )
+    usage = new_token_usage()
+    try:
+        if len(final_prompts) > 1:
+            test_cases, _, failed_chunks = await generate_test_cases_chunked(
+                final_prompts, loc, options["use_cache"], output_format, usage
+            )
+            result = {"test_cases": test_cases, "chunks": len(final_prompts)}
+            if failed_chunks:
+                result["failed_chunks"] = failed_chunks
         else:
-            error_detail_msg = str(e)
-        error_message = loc.get(
-            "backend_error_gemini_api_error", "Error calling Gemini API: {error_detail}"
+            test_cases, _ = await generate_test_cases_for_prompt(
+                final_prompts[0],
+                loc,
+                options["use_cache"],
+                output_format=output_format,
+                usage=usage,
+            )
+            result = {"test_cases": test_cases}
+    except HTTPException as e:
+        # Перегрузка и таймауты Gemini - временные, элемент будет повторён
+        if e.status_code in (503, 504):
+            raise RetryLaterError(e.detail)
+        raise RuntimeError(e.detail)
+    # Задания, поставленные до появления дедупликации, не содержат этих опций
+    test_cases, duplicates_removed = drop_near_duplicates(
+        test_cases,
+        options.get("dedup", DEDUP_ENABLED),
+        options.get("dedup_threshold", DEDUP_THRESHOLD),
+    )
+    result["test_cases"] = test_cases
+    result["usage"] = usage
+    if input_stats:
+        result["boilerplate_removed"] = input_stats
+    if duplicates_removed:
+        result["duplicates_removed"] = duplicates_removed
+    if not test_cases:
+        result["message"] = loc.get(
+            "backend_error_parsing_failed", "Could not parse test cases."
+        )
+    return result
+
+
+@app.post("/batch", status_code=202)
+async def create_batch_job(
+    files: Optional[List[UploadFile]] = File(None),  # PDF, txt/md или ZIP с ними
+    texts: Optional[List[str]] = Form(None),
+    custom_prompt: Optional[str] = Form(None),
+    lang: Optional[SUPPORTED_LANGUAGES] = Form(DEFAULT_LANGUAGE),
+    use_cache: bool = Form(True),
+    output_format: OUTPUT_FORMATS = Form("text"),
+    dedup: bool = Form(DEDUP_ENABLED),
+    dedup_threshold: float = Form(DEDUP_THRESHOLD, ge=0.0, le=1.0),
+):
+    """Ставит пакет документов в очередь генерации и возвращает ID задания."""
+    loc = get_locale_strings(lang)
+    if batch_queue.store is None:
+        raise HTTPException(
+            status_code=503,
+            detail=loc.get("backend_error_batch_unavailable", "Batch is unavailable."),
         )
+    options = {
+        "custom_prompt": custom_prompt,
+        "lang": lang,
+        "use_cache": use_cache,
+        "output_format": output_format,
+        "dedup": dedup,
+        "dedup_threshold": dedup_threshold,
+    }
+    uploads = files or []
+    try:
+        job_id, item_count = await batch_queue.submit(
+            options,
+            texts or [],
+            [(upload.filename or "document", upload.file) for upload in uploads],
+        )
+    except BatchInputError as e:
         raise HTTPException(
-            status_code=500, detail=error_message.format(error_detail=error_detail_msg)
+            status_code=400,
+            detail=f"{loc.get('backend_error_batch_invalid_input', 'Invalid batch:')} {e}",
         )
+    finally:
+        for upload in uploads:
+            await upload.close()
+    return {"job_id": job_id, "status": "queued", "items": item_count}
 
-    test_cases = parse_gemini_response(
-        generated_text
-    )  # parse_gemini_response должен быть нечувствителен к языку структуры
 
-    if not test_cases:
-        return JSONResponse(
-            content={
-                "test_cases": [],
-                "message": loc.get(
-                    "backend_error_parsing_failed", "Could not parse test cases."
-                ),
-            },
-            status_code=200,
+async def get_batch_job_or_404(job_id: str, lang: str, with_results: bool = False):
+    loc = get_locale_strings(lang)
+    job = None
+    if batch_queue.store is not None:
+        job = await batch_queue.get_job(job_id, with_results)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=loc.get("backend_error_batch_not_found", "Batch job not found."),
         )
-    return {
-        "test_cases": test_cases
-    }  # Тест-кейсы будут на том языке, на котором их сгенерировал Gemini
+    return job, loc
 
 
-# Функции экспорта остаются без изменений в логике локализации,
-# так как они экспортируют уже полученные данные. Заголовки файлов будут на английском.
+@app.get("/batch/{job_id}")
+async def get_batch_job_status(
+    job_id: str, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
+):
+    """Статус задания и его документов."""
+    job, _ = await get_batch_job_or_404(job_id, lang)
+    counts = {status: 0 for status in ("pending", "running", "done", "failed")}
+    for item in job["items"]:
+        counts[item["status"]] += 1
+    job["counts"] = counts
+    return job
 
 
-@app.post("/export_csv")
-async def export_to_csv(payload: ExportRequest):
-    # ... (код как был, только исправления регулярных выражений)
-    test_cases_data = [tc.model_dump(by_alias=True) for tc in payload.test_cases]
-    if not test_cases_data:
-        # loc = get_locale_strings(DEFAULT_LANGUAGE) # Или получить язык из запроса, если это важно для этой ошибки
+@app.get("/batch/{job_id}/result")
+async def get_batch_job_result(
+    job_id: str, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
+):
+    """Тест-кейсы по каждому документу завершённого задания."""
+    job, loc = await get_batch_job_or_404(job_id, lang, with_results=True)
+    if job["status"] in ("queued", "running"):
         raise HTTPException(
-            status_code=400, detail="No data for export."
-        )  # Простое сообщение
+            status_code=409,
+            detail=loc.get(
+                "backend_error_batch_not_finished", "Batch job is not finished."
+            ),
+        )
+    return fast_json_response(job)
+
 
-    for tc_item in test_cases_data:
-        if "Шаги" in tc_item and isinstance(tc_item["Шаги"], str):
-            steps_str = tc_item["Шаги"]
-            steps_str = re.sub(r"(?<=[^\n])\s+(?=\d+\.\s)", r"\n", steps_str)
-            steps_str = re.sub(
-                r"^(?!\s*\d+\.\s)([^\n]*?)\s*(1\.\s)",
-                r"\1\n\2",
-                steps_str,
-                count=1,
-                flags=re.MULTILINE,
+def documents_unavailable_error(loc: Dict[str, str]) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=loc.get(
+            "backend_error_documents_unavailable", "Document versions are unavailable."
+        ),
+    )
+
+
+@app.post("/documents/{document_id}/generate")
+async def generate_document_version(
+    document_id: str,
+    response: Response,
+    requirements_text: Optional[str] = Form(None),
+    pdf_file: Optional[UploadFile] = File(None),
+    custom_prompt: Optional[str] = Form(None),
+    lang: Optional[SUPPORTED_LANGUAGES] = Form(DEFAULT_LANGUAGE),
+    use_cache: bool = Form(True),
+    output_format: OUTPUT_FORMATS = Form("text"),
+    dedup: bool = Form(DEDUP_ENABLED),
+    dedup_threshold: float = Form(DEDUP_THRESHOLD, ge=0.0, le=1.0),
+    x_user_id: Optional[str] = Header(None),
+):
+    """
+    Новая версия документа document_id. Текст делится на разделы, разделы
+    сравниваются с предыдущей версией по хэшам: в Gemini уходят только новые
+    и изменённые, тест-кейсы остальных переносятся. Статус каждого тест-кейса
+    (new, changed, carried_over) - в test_case_status.
+    """
+    started_at = time.perf_counter()
+    loc = get_locale_strings(lang)
+    if document_store.store is None:
+        raise documents_unavailable_error(loc)
+    input_stats: Dict[str, int] = {}
+    with span("read_input"):
+        input_text = await read_generation_input(
+            requirements_text, pdf_file, loc, input_stats
+        )
+    extracted_at = time.perf_counter()
+    prompt_template = select_prompt_template(custom_prompt, output_format)
+    sections = split_into_document_sections(
+        input_text[:MAX_CHUNKED_INPUT_CHARS], CHUNK_MAX_CHARS, DOCUMENT_SECTION_MIN_CHARS
+    )
+    # Смена промпта, модели или формата делает все разделы изменёнными
+    settings_key = prompt_cache_key(prompt_template, output_format)
+    usage = new_token_usage()
+
+    async with document_store.lock(document_id):
+        with span("document_diff"):
+            previous = await document_store.latest(document_id)
+            plan, removed = diff_sections(
+                previous["sections"] if previous else [], sections, settings_key
             )
-            tc_item["Шаги"] = steps_str.replace("\n", "; ")
+        to_generate = [entry for entry in plan if entry["status"] != SECTION_CARRIED_OVER]
+        print(
+            f"Document {document_id}: {len(to_generate)} of {len(plan)} sections "
+            f"to generate, {removed} removed"
+        )
+        results = await asyncio.gather(
+            *start_chunk_tasks(
+                [
+                    prompt_template.format(requirements_text=entry["text"])
+                    for entry in to_generate
+                ],
+                loc,
+                use_cache,
+                output_format,
+                usage,
+            ),
+            return_exceptions=True,
+        )
+        failed_sections: List[int] = []
+        first_error: Optional[BaseException] = None
+        for entry, section_result in zip(to_generate, results):
+            if isinstance(section_result, BaseException):
+                print(f"Section {entry['index']} failed: {section_result}")
+                failed_sections.append(entry["index"])
+                first_error = first_error or section_result
+                entry["test_cases"] = []
+                continue
+            entry["test_cases"] = section_result[0]
+        # Не удалось сгенерировать ни один из новых и изменённых разделов: ответ из
+        # одних перенесённых тест-кейсов выглядел бы успешным, но устаревшим
+        if first_error is not None and len(failed_sections) == len(to_generate):
+            raise first_error
+        # Несгенерированный раздел сохраняется без хэша и будет повторён в следующей версии
+        version = await document_store.add_version(
+            document_id,
+            [
+                {
+                    "hash": "" if entry["index"] in failed_sections else entry["hash"],
+                    "heading": entry["heading"],
+                    "test_cases": entry["test_cases"],
+                }
+                for entry in plan
+            ],
+        )
 
-    df = pd.DataFrame(test_cases_data)
-    stream = io.StringIO()
-    df.to_csv(stream, index=False, encoding="utf-8-sig")
+    test_cases: List[Dict[str, str]] = []
+    test_case_status: List[str] = []
+    for entry in plan:
+        test_cases.extend(entry["test_cases"])
+        test_case_status.extend([entry["status"]] * len(entry["test_cases"]))
+    duplicates_removed = 0
+    if dedup and len(test_cases) > 1:
+        # Дубли убираются только из ответа: в версии разделы хранятся целиком
+        with span("dedup"):
+            test_cases, clusters = collapse_near_duplicates(test_cases, dedup_threshold)
+        dropped = {position for cluster in clusters for position in cluster[1:]}
+        test_case_status = [
+            status
+            for position, status in enumerate(test_case_status)
+            if position not in dropped
+        ]
+        duplicates_removed = len(dropped)
 
-    response = StreamingResponse(
-        iter([stream.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=test_cases.csv"},
+    summary = {
+        status: sum(1 for entry in plan if entry["status"] == status)
+        for status in SECTION_STATUSES
+    }
+    summary["removed"] = removed
+    result = {
+        "document_id": document_id,
+        "version": version,
+        "previous_version": previous["version"] if previous else None,
+        "test_cases": test_cases,
+        "test_case_status": test_case_status,
+        "sections": [
+            {
+                "index": entry["index"],
+                "heading": entry["heading"],
+                "status": entry["status"],
+                "test_case_count": len(entry["test_cases"]),
+            }
+            for entry in plan
+        ],
+        "sections_summary": summary,
+        "usage": usage,
+    }
+    response.headers["X-Sections-Generated"] = str(len(to_generate))
+    if failed_sections:
+        result["failed_sections"] = failed_sections
+    if input_stats:
+        result["boilerplate_removed"] = input_stats
+    if duplicates_removed:
+        result["duplicates_removed"] = duplicates_removed
+    if test_cases:
+        result_id = await result_store.put(test_cases)
+        if result_id:
+            result["result_id"] = result_id
+
+    record_history(
+        x_user_id,
+        "documents",
+        input_text,
+        custom_prompt,
+        output_format,
+        len(to_generate),
+        None,
+        test_cases,
+        started_at,
+        extracted_at,
+    )
+    if not test_cases:
+        result["message"] = loc.get(
+            "backend_error_parsing_failed", "Could not parse test cases."
+        )
+    return fast_json_response(result, response)
+
+
+@app.get("/documents/{document_id}")
+async def get_document_version(
+    document_id: str, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
+):
+    """Последняя версия документа: разделы и их тест-кейсы."""
+    loc = get_locale_strings(lang)
+    if document_store.store is None:
+        raise documents_unavailable_error(loc)
+    latest = await document_store.latest(document_id)
+    if latest is None:
+        raise HTTPException(
+            status_code=404,
+            detail=loc.get("backend_error_document_not_found", "Document not found."),
+        )
+    return fast_json_response(
+        {
+            "document_id": document_id,
+            "version": latest["version"],
+            "created_at": latest["created_at"],
+            "sections": [
+                {
+                    "index": index,
+                    "heading": section["heading"],
+                    "test_cases": section["test_cases"],
+                }
+                for index, section in enumerate(latest["sections"])
+            ],
+        }
+    )
+
+
+@app.delete("/documents/{document_id}")
+async def delete_document(
+    document_id: str, lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE)
+):
+    """Удаляет все версии документа: следующая генерация будет полной."""
+    loc = get_locale_strings(lang)
+    if document_store.store is None:
+        raise documents_unavailable_error(loc)
+    versions_deleted = await document_store.delete(document_id)
+    return {"document_id": document_id, "versions_deleted": versions_deleted}
+
+
+def history_unavailable_error(loc: Dict[str, str]) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=loc.get("backend_error_history_unavailable", "History is unavailable."),
     )
-    return response
 
 
-@app.post("/export_excel")
-async def export_to_excel(payload: ExportRequest):
-    # ... (код как был, только исправления регулярных выражений)
-    test_cases_data = [tc.model_dump(by_alias=True) for tc in payload.test_cases]
-    if not test_cases_data:
-        # loc = get_locale_strings(DEFAULT_LANGUAGE)
+@app.get("/history")
+async def list_history(
+    limit: int = Query(20, ge=1, le=HISTORY_PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None),  # next_cursor из предыдущей страницы
+    lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE),
+    x_user_id: Optional[str] = Header(None),
+):
+    """История генераций пользователя, от новых к старым (keyset-пагинация)."""
+    loc = get_locale_strings(lang)
+    if not history_recorder.running:
+        raise history_unavailable_error(loc)
+    try:
+        items, next_cursor = await history_recorder.list_entries(
+            x_user_id or "anonymous", limit, cursor
+        )
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=400,
+            detail=loc.get("backend_error_history_invalid_cursor", "Invalid cursor."),
+        )
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.get("/history/{entry_id}")
+async def get_history_entry(
+    entry_id: int,
+    lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE),
+    x_user_id: Optional[str] = Header(None),
+):
+    """Полная запись истории: промпт, тест-кейсы и тайминги."""
+    loc = get_locale_strings(lang)
+    if not history_recorder.running:
+        raise history_unavailable_error(loc)
+    entry = await history_recorder.get_entry(x_user_id or "anonymous", entry_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=404,
+            detail=loc.get("backend_error_history_not_found", "History entry not found."),
+        )
+    return entry
+
+
+async def read_test_cases_payload(request: Request) -> List[Dict[str, str]]:
+    """Тело {"test_cases": [...]}, проверенное целиком одним адаптером."""
+    body = await request.body()
+    with span("validate"):
+        return validate_export_payload(body)
+
+
+async def read_export_rows(request: Request) -> List[TestCaseRow]:
+    """Тест-кейсы запроса экспорта в виде компактных строк (кортежей)."""
+    test_cases = await read_test_cases_payload(request)
+    if not test_cases:
         raise HTTPException(
             status_code=400, detail="No data for export."
         )  # Простое сообщение
+    return list(test_case_rows(test_cases))
 
-    for item in test_cases_data:
-        if "Шаги" in item and isinstance(item["Шаги"], str):
-            steps_str = item["Шаги"]
-            item["Шаги"] = re.sub(r"(?<=[^\n])\s+(?=\d+\.\s)", r"\n", steps_str)
-            item["Шаги"] = re.sub(
-                r"^(?!\s*\d+\.\s)([^\n]*?)\s*(1\.\s)",
-                r"\1\n\2",
-                item["Шаги"],
-                count=1,
-                flags=re.MULTILINE,
-            )
 
-    df = pd.DataFrame(test_cases_data)
-    stream = io.BytesIO()
-    with pd.ExcelWriter(stream, engine="openpyxl") as writer:
-        df.to_excel(
-            writer, index=False, sheet_name="Test-Cases"
-        )  # Sheet name in English
-        workbook = writer.book
-        worksheet = writer.sheets["Test-Cases"]
-
-        steps_col_letter = None
-        steps_col_idx_df_coord = -1
-        try:
-            steps_col_idx_df_coord = df.columns.get_loc("Шаги")
-            steps_col_letter = get_column_letter(steps_col_idx_df_coord + 1)
-        except KeyError:
-            print("Warning: Column 'Шаги' not found in DataFrame for Excel styling.")
-
-        if steps_col_letter and steps_col_idx_df_coord != -1:
-            # Индексы openpyxl для колонки начинаются с 1
-            openpyxl_col_idx = steps_col_idx_df_coord + 1
-            for row_idx in range(2, worksheet.max_row + 1):
-                cell = worksheet.cell(row=row_idx, column=openpyxl_col_idx)
-                cell.alignment = Alignment(wrap_text=True, vertical="top")
-
-            max_width = 0
-            for row_cells in worksheet.iter_rows(
-                min_col=openpyxl_col_idx,
-                max_col=openpyxl_col_idx,
-                min_row=1,
-                max_row=worksheet.max_row,
-            ):
-                for cell in row_cells:
-                    if cell.value:
-                        cell_content = str(cell.value)
-                        lines = cell_content.split("\n")
-                        for line in lines:
-                            if len(line) > max_width:
-                                max_width = len(line)
-            adjusted_width = min(max_width + 5, 70)
-            if adjusted_width > 10:
-                worksheet.column_dimensions[steps_col_letter].width = adjusted_width
-    stream.seek(0)
-    response = StreamingResponse(
-        stream,
+@app.post("/deduplicate", openapi_extra=EXPORT_REQUEST_OPENAPI)
+async def deduplicate_test_cases(
+    request: Request,
+    threshold: float = Query(DEDUP_THRESHOLD, ge=0.0, le=1.0),
+):
+    """
+    Схлопывает почти одинаковые тест-кейсы (MinHash + LSH по шинглам слов).
+    clusters - группы позиций во входном списке: первая оставлена, остальные удалены.
+    """
+    test_cases = await read_test_cases_payload(request)
+    kept, clusters = collapse_near_duplicates(test_cases, threshold)
+    return fast_json_response(
+        {
+            "test_cases": kept,
+            "duplicates_removed": len(test_cases) - len(kept),
+            "clusters": clusters,
+        }
+    )
+
+
+@app.get("/ready")
+async def get_readiness(response: Response):
+    """Готовность воркера: 503, пока идёт прогрев при старте или если он не удался."""
+    ready = warmup_state["status"] in ("done", "off")
+    if not ready:
+        response.status_code = 503
+    return {
+        "ready": ready,
+        "warmup": warmup_state,
+        "history": history_recorder.running,
+        "batch_queue": batch_queue.store is not None,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/stats/upstream")
+async def get_upstream_stats():
+    """Вызовы Gemini: выполнено, повторено, объединено одинаковых, упёрлось в квоту."""
+    return {
+        **gemini_pool.stats,
+        "in_flight": gemini_pool.in_flight,
+        "waiting": gemini_pool.waiting,
+        "api_keys": len(gemini_pool.api_keys),
+    }
+
+
+@app.get("/stats/parsing")
+async def get_parsing_stats():
+    """Счётчики распознанных и отброшенных тест-кейсов по режимам разбора."""
+    return parse_counters
+
+
+@app.delete("/admin/cache")
+async def purge_generation_cache(
+    key: Optional[str] = Query(None),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Очищает кэш генераций целиком или одну запись по ключу (X-Cache-Key)."""
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    purged = await generation_cache.purge(key)
+    return {"purged": purged}
+
+
+@app.delete("/admin/pdf_cache")
+async def purge_pdf_text_cache(x_admin_token: Optional[str] = Header(None)):
+    """Очищает кэш извлечённого из PDF текста."""
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden.")
+    purged = await pdf_text_cache.purge()
+    return {"purged": purged}
+
+
+# Функции экспорта остаются без изменений в логике локализации,
+# так как они экспортируют уже полученные данные. Заголовки файлов будут на английском.
+
+
+def csv_export_response(rows: Iterable[TestCaseRow]) -> StreamingResponse:
+    # CSV формируется генератором по мере отправки, без DataFrame и общего буфера
+    return StreamingResponse(
+        timed_iter("build_csv", iter_csv_rows(rows)),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=test_cases.csv"},
+    )
+
+
+async def excel_export_response(rows: Iterable[TestCaseRow]) -> StreamingResponse:
+    # Книга собирается в потоке, чтобы не блокировать event loop
+    with span("build_xlsx"):
+        excel_file = await asyncio.to_thread(build_excel_file_from_rows, rows)
+    return StreamingResponse(
+        timed_iter("send_xlsx", iter_file_chunks(excel_file)),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": "attachment; filename=test_cases.xlsx"},
     )
-    return response
+
+
+@app.post("/export_csv", openapi_extra=EXPORT_REQUEST_OPENAPI)
+async def export_to_csv(request: Request):
+    return csv_export_response(await read_export_rows(request))
+
+
+@app.post("/export_excel", openapi_extra=EXPORT_REQUEST_OPENAPI)
+async def export_to_excel(request: Request):
+    return await excel_export_response(await read_export_rows(request))
+
+
+@app.get("/export/{result_id}")
+async def export_stored_result(
+    result_id: str,
+    format: EXPORT_FORMATS = Query("csv"),
+    lang: Optional[SUPPORTED_LANGUAGES] = Query(DEFAULT_LANGUAGE),
+):
+    """
+    Экспорт результата /generate или /generate_stream по его result_id.
+    Тест-кейсы берутся из хранилища в том виде, в каком их вернула генерация,
+    без повторной проверки.
+    """
+    with span("result_lookup"):
+        test_cases = await result_store.get(result_id)
+    if not test_cases:
+        loc = get_locale_strings(lang)
+        raise HTTPException(
+            status_code=404,
+            detail=loc.get(
+                "backend_error_result_not_found",
+                "Result not found or expired. Generate test cases again.",
+            ),
+        )
+    if format == "xlsx":
+        return await excel_export_response(test_case_rows(test_cases))
+    if format == "jsonl":
+        return StreamingResponse(
+            timed_iter("build_jsonl", iter_jsonl_chunks(test_cases)),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": "attachment; filename=test_cases.jsonl"},
+        )
+    return csv_export_response(test_case_rows(test_cases))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# --- Метрики в формате Prometheus ---
+# Метрики живут в памяти процесса: при нескольких воркерах uvicorn каждый
+# отдаёт свои, суммирует их Prometheus
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Границы гистограмм длительностей (секунды): от быстрых этапов до вызовов Gemini
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: счётчики по корзинам (не накопительные), сумма, число
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = self.header()
+        labelnames = self.labelnames + ("le",)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(labelnames, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Значения читаются при каждом сборе из уже существующих счётчиков приложения."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.collect()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "testcase_request_duration_seconds",
+        "Request duration including streamed response body.",
+        ("endpoint", "status"),
+    )
+)
+REQUESTS_IN_FLIGHT = REGISTRY.register(
+    Gauge("testcase_requests_in_flight", "Requests being processed.", ("endpoint",))
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "testcase_stage_duration_seconds",
+        "Duration of request stages (upload, PDF extraction, Gemini, parsing, export).",
+        ("endpoint", "stage"),
+    )
+)
+UPSTREAM_ERRORS = REGISTRY.register(
+    Counter(
+        "testcase_upstream_errors_total",
+        "Gemini calls that failed after retries, by error kind.",
+        ("kind",),
+    )
+)
+PDF_BOILERPLATE_REMOVED = REGISTRY.register(
+    Counter(
+        "testcase_pdf_boilerplate_removed_total",
+        "PDF headers, footers, page numbers and tables of contents removed before prompting.",
+        ("unit",),
+    )
+)
+
+
+# --- Этапы запроса ---
+class RequestTimings:
+    """Длительности этапов одного запроса (или элемента пакетного задания)."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing (миллисекунды)."""
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()
+        )
+
+
+# Задачи и потоки, запущенные из запроса, наследуют его контекст
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request_timings(endpoint: str) -> RequestTimings:
+    timings = RequestTimings(endpoint)
+    _current_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+    if METRICS_ENABLED:
+        endpoint = timings.endpoint if timings is not None else "background"
+        STAGE_SECONDS.observe(seconds, endpoint=endpoint, stage=stage)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Замеряет блок кода как этап текущего запроса."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started_at)
+
+
+def timed_iter(stage: str, iterator: Iterable) -> Iterator:
+    """Оборачивает генератор тела ответа: время его работы - отдельный этап."""
+    elapsed = 0.0
+    iterator = iter(iterator)
+    try:
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started_at
+            yield item
+    finally:
+        record_stage(stage, elapsed)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware для отслеживаемых путей: число запросов в работе,
+    длительность до конца отправки тела, заголовок Server-Timing с этапами,
+    завершившимися до начала ответа, и передача медленных запросов профайлеру.
+    """
+
+    def __init__(self, app, endpoints: Sequence[str], profiler=None):
+        self.app = app
+        self.endpoints = {endpoint for endpoint in endpoints if "{" not in endpoint}
+        # Пути с параметром ("/export/{result_id}", "/documents/{document_id}/generate")
+        # сопоставляются по префиксу и окончанию, в метки попадает шаблон, а не
+        # конкретный путь
+        self.templates = [
+            (endpoint.split("{", 1)[0], endpoint.split("}", 1)[1], endpoint)
+            for endpoint in endpoints
+            if "{" in endpoint
+        ]
+        self.profiler = profiler
+
+    def _endpoint(self, path: str) -> Optional[str]:
+        if path in self.endpoints:
+            return path
+        for prefix, suffix, template in self.templates:
+            if (
+                path.startswith(prefix)
+                and path.endswith(suffix)
+                and len(path) > len(prefix) + len(suffix)
+                and "/" not in path[len(prefix) : len(path) - len(suffix)]
+            ):
+                return template
+        return None
+
+    async def __call__(self, scope, receive, send):
+        endpoint = self._endpoint(scope["path"]) if scope["type"] == "http" else None
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(endpoint)
+        token = _current_timings.set(timings)
+        status = "500"
+        started_at = time.perf_counter()
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if timings.stages:
+                    headers = list(message.get("headers", []))
+                    headers.append(
+                        (b"server-timing", timings.server_timing().encode("latin-1"))
+                    )
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        if METRICS_ENABLED:
+            REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            finished_at = time.perf_counter()
+            if METRICS_ENABLED:
+                REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+                REQUEST_SECONDS.observe(
+                    finished_at - started_at, endpoint=endpoint, status=status
+                )
+            _current_timings.reset(token)
+            if self.profiler is not None:
+                await self.profiler.maybe_dump(endpoint, started_at, finished_at, timings)
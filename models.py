@@ -0,0 +1,42 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import JSON, BigInteger, DateTime, Index, Integer, String, Text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class GenerationHistory(Base):
+    """Одна генерация тест-кейсов: вход, промпт, результат, модель и тайминги."""
+
+    __tablename__ = "generation_history"
+
+    # В SQLite автоинкремент работает только у INTEGER PRIMARY KEY
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True
+    )
+    user_id: Mapped[str] = mapped_column(String(128))
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    endpoint: Mapped[str] = mapped_column(String(32))
+    # SHA-256 текста требований (после извлечения из PDF)
+    input_hash: Mapped[str] = mapped_column(String(64), index=True)
+    input_chars: Mapped[int] = mapped_column(Integer)
+    # Шаблон промпта с плейсхолдером {requirements_text}
+    prompt: Mapped[str] = mapped_column(Text)
+    model: Mapped[str] = mapped_column(String(128))
+    output_format: Mapped[str] = mapped_column(String(16))
+    chunks: Mapped[int] = mapped_column(Integer, default=1)
+    cache_status: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    test_case_count: Mapped[int] = mapped_column(Integer)
+    test_cases: Mapped[List[Dict[str, Any]]] = mapped_column(JSON)
+    # Длительность этапов в миллисекундах: extract_ms, generate_ms, total_ms
+    timings: Mapped[Dict[str, float]] = mapped_column(JSON)
+
+    __table_args__ = (
+        # Листинг истории пользователя по убыванию времени (keyset-пагинация)
+        Index("ix_generation_history_user_created", "user_id", "created_at", "id"),
+        Index("ix_generation_history_created", "created_at"),
+    )
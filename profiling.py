@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+
+# --- Профилирование медленных запросов ---
+# Включается порогом: запросы дольше PROFILE_SLOW_REQUEST_SECONDS сохраняют
+# профиль в PROFILE_DIR. 0 - профайлер выключен и поток сэмплирования не запускается
+PROFILE_SLOW_REQUEST_SECONDS = float(os.getenv("PROFILE_SLOW_REQUEST_SECONDS", "0"))
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(
+    os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.01")
+)
+PROFILE_DIR = Path(
+    os.getenv("PROFILE_DIR", str(Path(__file__).resolve().parent / "profiles"))
+)
+# Сколько последних секунд сэмплов держать в памяти и сколько профилей хранить
+PROFILE_BUFFER_SECONDS = 300
+PROFILE_MAX_FILES = 100
+
+Sample = Tuple[float, str]
+
+
+def _frame_label(code) -> str:
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Статистический профайлер на стандартной библиотеке: фоновый поток раз в
+    interval снимает стеки всех потоков процесса (sys._current_frames) в
+    кольцевой буфер. Для медленного запроса сохраняются сэмплы за время его
+    выполнения в формате collapsed stacks ("поток;f1;f2 N"), который читают
+    flamegraph.pl, speedscope и подобные инструменты.
+
+    Пока запрос ждёт Gemini, его корутина не на стеке - в профиле видно, чем
+    в это время был занят процесс. PDF разбирается в дочерних процессах и
+    в профиль не попадает; его длительность видна в этапах запроса.
+    """
+
+    def __init__(
+        self,
+        threshold: float = PROFILE_SLOW_REQUEST_SECONDS,
+        interval: float = PROFILE_SAMPLE_INTERVAL_SECONDS,
+        output_dir: Path = PROFILE_DIR,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = output_dir
+        self._samples: Deque[Sample] = deque(
+            maxlen=max(int(PROFILE_BUFFER_SECONDS / interval), 1)
+        )
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.dumped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        print(
+            f"Sampling profiler: dumping requests slower than {self.threshold:g}s "
+            f"to {self.output_dir}"
+        )
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self._samples.append((now, ";".join(reversed(stack))))
+
+    def collapsed_stacks(self, started_at: float, finished_at: float) -> Counter:
+        """Сэмплы за интервал [started_at, finished_at] (time.perf_counter)."""
+        return Counter(
+            stack
+            for sampled_at, stack in list(self._samples)
+            if started_at <= sampled_at <= finished_at
+        )
+
+    def dump(self, endpoint: str, started_at: float, finished_at: float) -> Path:
+        duration_ms = int((finished_at - started_at) * 1000)
+        name = endpoint.strip("/").replace("/", "_") or "root"
+        # pid и номер: профили разных воркеров и одной секунды не перезаписываются
+        path = self.output_dir / (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.dumped:04d}"
+            f"-{name}-{duration_ms}ms.folded"
+        )
+        stacks = self.collapsed_stacks(started_at, finished_at)
+        with open(path, "w", encoding="utf-8") as profile_file:
+            for stack, count in stacks.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        self._remove_old_profiles()
+        self.dumped += 1
+        return path
+
+    def _remove_old_profiles(self) -> None:
+        profiles = sorted(self.output_dir.glob("*.folded"))
+        for old_profile in profiles[:-PROFILE_MAX_FILES]:
+            old_profile.unlink(missing_ok=True)
+
+    async def maybe_dump(
+        self, endpoint: str, started_at: float, finished_at: float, timings
+    ) -> None:
+        """Сохраняет профиль, если запрос выполнялся дольше порога."""
+        if not self.enabled or self._thread is None:
+            return
+        if finished_at - started_at < self.threshold:
+            return
+        try:
+            path = await asyncio.to_thread(self.dump, endpoint, started_at, finished_at)
+        except OSError as e:
+            print(f"Warning: failed to save request profile: {e}")
+            return
+        print(
+            f"Slow request {endpoint} ({finished_at - started_at:.2f}s, "
+            f"{timings.server_timing()}), profile saved to {path}"
+        )
+
+
+slow_request_profiler = SamplingProfiler()
@@ -0,0 +1,117 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import TypedDict
+
+from exporters import EXPORT_COLUMNS
+
+try:
+    import orjson
+except ImportError:  # Без orjson - стандартный json, результат тот же
+    orjson = None
+
+# --- Быстрая проверка и сериализация больших списков тест-кейсов ---
+# TypedDict вместо модели pydantic: проверка целиком выполняется в pydantic-core
+# и сразу даёт словари, без создания моделей и model_dump на каждую строку.
+# Pydantic на Python < 3.12 требует TypedDict из typing_extensions
+TestCaseDict = TypedDict(
+    "TestCaseDict",
+    {"Название": str, "Шаги": str, "Ожидаемый результат": str, "Тип": str},
+)
+ExportPayload = TypedDict("ExportPayload", {"test_cases": List[TestCaseDict]})
+
+TEST_CASE_ADAPTER = TypeAdapter(TestCaseDict)
+TEST_CASE_LIST_ADAPTER = TypeAdapter(List[TestCaseDict])
+EXPORT_PAYLOAD_ADAPTER = TypeAdapter(ExportPayload)
+
+# Тело запроса экспорта для OpenAPI (эндпоинты читают его сами)
+EXPORT_REQUEST_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "required": ["test_cases"],
+                    "properties": {
+                        "test_cases": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    column: {"type": "string"} for column in EXPORT_COLUMNS
+                                },
+                                "required": EXPORT_COLUMNS,
+                            },
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def validate_export_payload(body: bytes) -> List[Dict[str, str]]:
+    """
+    Проверяет тело {"test_cases": [...]} одним вызовом адаптера. С orjson тело
+    разбирается им: на длинных строках кириллицы это быстрее validate_json.
+    Ошибки - 422 в формате FastAPI, как при проверке моделью.
+    """
+    try:
+        if orjson is not None:
+            try:
+                raw_payload = orjson.loads(body)
+            except orjson.JSONDecodeError as e:
+                raise RequestValidationError(
+                    [
+                        {
+                            "type": "json_invalid",
+                            "loc": ("body", e.pos),
+                            "msg": "JSON decode error",
+                            "input": {},
+                            "ctx": {"error": e.msg},
+                        }
+                    ]
+                )
+            return EXPORT_PAYLOAD_ADAPTER.validate_python(raw_payload)["test_cases"]
+        return EXPORT_PAYLOAD_ADAPTER.validate_json(body)["test_cases"]
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+        )
+
+
+def dumps_bytes(content: Any) -> bytes:
+    """JSON сразу в байты: orjson, если установлен, иначе стандартный json."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON-ответ через dumps_bytes. Возвращается из эндпоинта напрямую, поэтому
+    FastAPI не прогоняет содержимое через jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+def fast_json_response(content: Any, response: Optional[Response] = None) -> FastJSONResponse:
+    """Ответ с заголовками, выставленными в параметре response эндпоинта."""
+    if response is None:
+        return FastJSONResponse(content)
+    return FastJSONResponse(
+        content, status_code=response.status_code or 200, headers=dict(response.headers)
+    )
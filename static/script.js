@@ -69,6 +69,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
 
     let allTestCases = [];
+    let currentResultId = null; // ID результата на сервере для GET /export/{id}
     let currentSortColumn = null;
     let currentSortOrder = 'asc';
 
@@ -183,6 +184,7 @@ document.addEventListener('DOMContentLoaded', function () {
             if (resultsSection) resultsSection.style.display = 'none';
             if (resultsTableBody) resultsTableBody.innerHTML = '';
             allTestCases = [];
+            currentResultId = null;
 
             const textContent = requirementsText ? requirementsText.value.trim() : '';
             const fileIsSelectedAndActive = pdfFile && pdfFile.files && pdfFile.files.length > 0 &&
@@ -227,7 +229,8 @@ document.addEventListener('DOMContentLoaded', function () {
             if (userPrompt) formData.append('custom_prompt', userPrompt);
 
             try {
-                const response = await fetch('/generate', {
+                // Потоковая генерация: строки таблицы добавляются по мере прихода тест-кейсов
+                const response = await fetch('/generate_stream', {
                     method: 'POST',
                     body: formData,
                 });
@@ -236,16 +239,28 @@ document.addEventListener('DOMContentLoaded', function () {
                     // Ошибка уже должна быть локализована бэкендом
                     throw new Error(errorDetail.detail || 'Server error'); 
                 }
-                const data = await response.json();
-                 if (data.message && !data.test_cases?.length) { // Если есть сообщение от бэкенда (например, о неудачном парсинге)
-                    showError(data.message); // Показываем локализованное сообщение от бэкенда
-                    allTestCases = [];
-                } else {
-                    allTestCases = data.test_cases || [];
+                let doneData = null;
+                await readEventStream(response, (eventName, data) => {
+                    if (eventName === 'test_case') {
+                        if (allTestCases.length === 0 && resultsSection) {
+                            resultsTableBody.innerHTML = '';
+                            resultsSection.style.display = 'block';
+                        }
+                        allTestCases.push(data);
+                        if (testCaseMatchesFilter(data)) appendTestCaseRow(data);
+                    } else if (eventName === 'error') {
+                        throw new Error(data.detail || 'Server error');
+                    } else if (eventName === 'done') {
+                        doneData = data;
+                        currentResultId = data.result_id || null;
+                    }
+                });
+                if (doneData && doneData.message && !allTestCases.length) { // Если есть сообщение от бэкенда (например, о неудачном парсинге)
+                    showError(doneData.message); // Показываем локализованное сообщение от бэкенда
                 }
-                displayTestCases(allTestCases);
+                displayTestCases(getFilteredAndSortedCases());
                 if (resultsSection && allTestCases.length > 0) resultsSection.style.display = 'block';
-                else if (!allTestCases.length && !data.message) { // Если нет тест-кейсов и нет сообщения об ошибке парсинга
+                else if (!allTestCases.length && !(doneData && doneData.message)) { // Если нет тест-кейсов и нет сообщения об ошибке парсинга
                      showError(L.no_test_cases_found || "Тест-кейсы не найдены или не удалось сгенерировать.");
                 }
 
@@ -276,32 +291,63 @@ document.addEventListener('DOMContentLoaded', function () {
             }
             return;
         }
-        // ... (остальная часть displayTestCases без изменений)
-        testCases.forEach(tc => {
-            const row = resultsTableBody.insertRow();
-            row.insertCell().innerHTML = tc['Название'] ? tc['Название'].replace(/\n/g, '<br>') : '-';
-            const stepsCell = row.insertCell();
-            if (tc['Шаги']) {
-                const stepsList = document.createElement('ol');
-                stepsList.style.paddingLeft = '20px';
-                stepsList.style.margin = '0';
-                const stepsArray = tc['Шаги'].split('\n').map(step => step.trim()).filter(step => step);
-                stepsArray.forEach(stepText => {
-                    const cleanedStepText = stepText.replace(/^[\d\*\-\+\.]+\s*/, '');
-                    if (cleanedStepText) {
-                        const listItem = document.createElement('li');
-                        listItem.textContent = cleanedStepText;
-                        stepsList.appendChild(listItem);
-                    }
+        testCases.forEach(appendTestCaseRow);
+    }
+
+    function appendTestCaseRow(tc) {
+        if (!resultsTableBody) return;
+        const row = resultsTableBody.insertRow();
+        row.insertCell().innerHTML = tc['Название'] ? tc['Название'].replace(/\n/g, '<br>') : '-';
+        const stepsCell = row.insertCell();
+        if (tc['Шаги']) {
+            const stepsList = document.createElement('ol');
+            stepsList.style.paddingLeft = '20px';
+            stepsList.style.margin = '0';
+            const stepsArray = tc['Шаги'].split('\n').map(step => step.trim()).filter(step => step);
+            stepsArray.forEach(stepText => {
+                const cleanedStepText = stepText.replace(/^[\d\*\-\+\.]+\s*/, '');
+                if (cleanedStepText) {
+                    const listItem = document.createElement('li');
+                    listItem.textContent = cleanedStepText;
+                    stepsList.appendChild(listItem);
+                }
+            });
+            if (stepsList.children.length > 0) stepsCell.appendChild(stepsList);
+            else stepsCell.textContent = '-';
+        } else {
+            stepsCell.textContent = '-';
+        }
+        row.insertCell().innerHTML = tc['Ожидаемый результат'] ? tc['Ожидаемый результат'].replace(/\n/g, '<br>') : '-';
+        row.insertCell().textContent = tc['Тип'] || (L.filter_option_undefined || 'Не определен'); // Локализуем "Не определен" если нужно
+    }
+
+    function testCaseMatchesFilter(tc) {
+        const filterValue = typeFilter ? typeFilter.value : 'all';
+        return filterValue === 'all' || (tc['Тип'] || (L.filter_option_undefined || 'Не определен')) === filterValue;
+    }
+
+    // Читает ответ text/event-stream и вызывает onEvent(eventName, data) для каждого события
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separatorIndex);
+                buffer = buffer.slice(separatorIndex + 2);
+                let eventName = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
                 });
-                if (stepsList.children.length > 0) stepsCell.appendChild(stepsList);
-                else stepsCell.textContent = '-';
-            } else {
-                stepsCell.textContent = '-';
+                if (dataLines.length) onEvent(eventName, JSON.parse(dataLines.join('\n')));
             }
-            row.insertCell().innerHTML = tc['Ожидаемый результат'] ? tc['Ожидаемый результат'].replace(/\n/g, '<br>') : '-';
-            row.insertCell().textContent = tc['Тип'] || (L.filter_option_undefined || 'Не определен'); // Локализуем "Не определен" если нужно
-        });
+        }
     }
 
     if (typeFilter) {
@@ -352,12 +398,20 @@ document.addEventListener('DOMContentLoaded', function () {
             return;
         }
         try {
-            // ... (fetch без изменений)
-            const response = await fetch(url, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ test_cases: cases }) // Данные уже на языке генерации
-            });
+            let response;
+            const filterValue = typeFilter ? typeFilter.value : 'all';
+            if (currentResultId && filterValue === 'all' && !currentSortColumn) {
+                // Весь результат без сортировки: сервер отдаёт сохранённую копию
+                response = await fetch(`/export/${currentResultId}?format=${fileType}&lang=${currentLang}`);
+                if (response.status === 404) currentResultId = null;
+            }
+            if (!response || !response.ok) {
+                response = await fetch(url, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ test_cases: cases }) // Данные уже на языке генерации
+                });
+            }
             if (!response.ok) {
                 const errorText = await response.text().catch(() => `Unknown export error ${fileType}`);
                 throw new Error(`Server error (${response.status}): ${errorText}`);
@@ -0,0 +1,606 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Хранилища на sqlite3 из стандартной библиотеки: кэш, очередь пакетов,
+# версии документов. SQLAlchemy (история, database.py) им не нужна
+BASE_DIR = Path(__file__).resolve().parent
+
+# --- SQLite-хранилище кэша генераций ---
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", str(BASE_DIR / "cache.sqlite3"))
+
+
+class SQLiteCacheStore:
+    """
+    Персистентный уровень кэша: ключ -> JSON-значение в SQLite.
+    Записи старше ttl_seconds считаются устаревшими, при превышении
+    max_entries удаляются самые старые.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_generation_cache_created_at "
+            "ON generation_cache (created_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and time.time() - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, value, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, payload, time.time()),
+            )
+            # Вытесняем самые старые записи, если превышен лимит
+            self._conn.execute(
+                """
+                DELETE FROM generation_cache WHERE key IN (
+                    SELECT key FROM generation_cache
+                    ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM generation_cache WHERE key = ?", (key,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def clear(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM generation_cache")
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class SQLitePdfTextStore:
+    """
+    Кэш извлечённого из PDF текста. Документ (SHA-256 файла) хранит список
+    отпечатков своих страниц, текст хранится по отпечатку страницы, поэтому
+    неизменённые страницы новой версии документа берутся из кэша.
+    При превышении max_bytes вытесняются давно не использованные страницы.
+    """
+
+    def __init__(self, path: str, max_bytes: int, max_documents: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_documents = max_documents
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdf_documents (
+                doc_hash TEXT PRIMARY KEY,
+                page_hashes TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pdf_pages (
+                page_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_pdf_documents_last_used "
+            "ON pdf_documents (last_used)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_pdf_pages_last_used ON pdf_pages (last_used)"
+        )
+        self._conn.commit()
+
+    def get_page_hashes(self, doc_hash: str) -> Optional[List[str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_hashes FROM pdf_documents WHERE doc_hash = ?", (doc_hash,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE pdf_documents SET last_used = ? WHERE doc_hash = ?",
+                (time.time(), doc_hash),
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def get_pages(self, page_hashes: List[str]) -> Dict[str, str]:
+        unique_hashes = list(dict.fromkeys(page_hashes))
+        found: Dict[str, str] = {}
+        with self._lock:
+            # Не больше 500 параметров на запрос (лимит SQLite - 999)
+            for offset in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[offset : offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT page_hash, text FROM pdf_pages "
+                    f"WHERE page_hash IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE pdf_pages SET last_used = ? WHERE page_hash = ?",
+                    [(now, page_hash) for page_hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put(self, doc_hash: str, page_hashes: List[str], pages: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdf_documents (doc_hash, page_hashes, last_used) "
+                "VALUES (?, ?, ?)",
+                (doc_hash, json.dumps(page_hashes), now),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pdf_pages (page_hash, text, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (page_hash, text, len(text.encode("utf-8")), now)
+                    for page_hash, text in pages.items()
+                ],
+            )
+            self._conn.execute(
+                """
+                DELETE FROM pdf_documents WHERE doc_hash IN (
+                    SELECT doc_hash FROM pdf_documents
+                    ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_documents,),
+            )
+            self._evict_pages()
+            self._conn.commit()
+
+    def _evict_pages(self) -> None:
+        """Удаляет давно не использованные страницы, пока объём больше max_bytes."""
+        (total_bytes,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pdf_pages"
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT page_hash, size FROM pdf_pages ORDER BY last_used"
+        ).fetchall()
+        evicted = []
+        for page_hash, size in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((page_hash,))
+            total_bytes -= size
+        self._conn.executemany("DELETE FROM pdf_pages WHERE page_hash = ?", evicted)
+
+    def clear(self) -> int:
+        with self._lock:
+            self._conn.execute("DELETE FROM pdf_documents")
+            cursor = self._conn.execute("DELETE FROM pdf_pages")
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class SQLiteResultStore:
+    """
+    Результаты генераций для экспорта по ID: тест-кейсы хранятся как JSON Lines
+    (по объекту на строку) и живут ttl_seconds. Просроченные записи удаляются
+    при каждой записи, при превышении max_entries - самые старые.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generation_results (
+                result_id TEXT PRIMARY KEY,
+                test_cases TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_generation_results_expires_at "
+            "ON generation_results (expires_at)"
+        )
+        self._conn.commit()
+
+    def get(self, result_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT test_cases FROM generation_results "
+                "WHERE result_id = ? AND expires_at > ?",
+                (result_id, time.time()),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, result_id: str, test_cases_jsonl: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM generation_results WHERE expires_at <= ?", (now,)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_results "
+                "(result_id, test_cases, expires_at) VALUES (?, ?, ?)",
+                (result_id, test_cases_jsonl, now + self.ttl_seconds),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM generation_results WHERE result_id IN (
+                    SELECT result_id FROM generation_results
+                    ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM generation_results")
+            self._conn.commit()
+            return cursor.rowcount
+
+
+# --- SQLite-очередь пакетных заданий ---
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", str(BASE_DIR / "jobs.sqlite3"))
+
+
+class SQLiteJobStore:
+    """
+    Персистентная очередь пакетных заданий. Задание состоит из элементов
+    (по одному на документ), статус задания выводится из статусов элементов:
+    pending -> running -> done | failed. Очередь переживает перезапуск и
+    может разбираться несколькими процессами: элемент в running держит
+    аренду, которую обработчик продлевает (touch_item); элемент с истёкшей
+    арендой считается брошенным и забирается снова. Номер попытки (attempts)
+    служит ключом аренды: завершить элемент может только тот, кто его забрал.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                job_id TEXT PRIMARY KEY,
+                options TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_items (
+                job_id TEXT NOT NULL,
+                item_index INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, item_index)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_batch_items_status "
+            "ON batch_items (status, not_before)"
+        )
+        self._conn.commit()
+
+    def create_job(self, job_id: str, options: Dict, items: List[Dict]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO batch_jobs (job_id, options, created_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(options, ensure_ascii=False), now),
+            )
+            self._conn.executemany(
+                "INSERT INTO batch_items (job_id, item_index, name, kind, source_path, "
+                "source_hash, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)",
+                [
+                    (
+                        job_id,
+                        index,
+                        item["name"],
+                        item["kind"],
+                        item["source_path"],
+                        item["source_hash"],
+                        now,
+                    )
+                    for index, item in enumerate(items)
+                ],
+            )
+            self._conn.commit()
+
+    def claim_next_item(self, lease_seconds: float) -> Optional[Dict]:
+        """
+        Переводит самый старый готовый к обработке элемент (или элемент с
+        истёкшей арендой) в running и возвращает его. UPDATE проверяет, что
+        элемент не успел забрать другой процесс, иначе берётся следующий.
+        """
+        while True:
+            now = time.time()
+            stale_before = now - lease_seconds
+            with self._lock:
+                row = self._conn.execute(
+                    """
+                    SELECT i.*, j.options FROM batch_items i
+                    JOIN batch_jobs j ON j.job_id = i.job_id
+                    WHERE (i.status = 'pending' AND i.not_before <= ?)
+                       OR (i.status = 'running' AND i.updated_at < ?)
+                    ORDER BY j.created_at, i.item_index LIMIT 1
+                    """,
+                    (now, stale_before),
+                ).fetchone()
+                if row is None:
+                    return None
+                cursor = self._conn.execute(
+                    "UPDATE batch_items SET status = 'running', attempts = attempts + 1, "
+                    "updated_at = ? WHERE job_id = ? AND item_index = ? AND attempts = ? "
+                    "AND (status = 'pending' OR (status = 'running' AND updated_at < ?))",
+                    (now, row["job_id"], row["item_index"], row["attempts"], stale_before),
+                )
+                self._conn.commit()
+            if cursor.rowcount == 1:
+                break
+        item = dict(row)
+        item["attempts"] += 1
+        item["options"] = json.loads(item["options"])
+        return item
+
+    def touch_item(self, job_id: str, item_index: int, attempts: int) -> bool:
+        """Продлевает аренду элемента. False - элемент уже забрал другой обработчик."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batch_items SET updated_at = ? WHERE job_id = ? AND item_index = ? "
+                "AND status = 'running' AND attempts = ?",
+                (time.time(), job_id, item_index, attempts),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def finish_item(
+        self,
+        job_id: str,
+        item_index: int,
+        attempts: int,
+        result: Optional[Any] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """
+        Завершает элемент: done с результатом или failed с ошибкой.
+        False - аренда потеряна и элемент уже обрабатывает другой обработчик.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batch_items SET status = ?, result = ?, error = ?, updated_at = ? "
+                "WHERE job_id = ? AND item_index = ? AND status = 'running' AND attempts = ?",
+                (
+                    "failed" if error else "done",
+                    None if result is None else json.dumps(result, ensure_ascii=False),
+                    error,
+                    time.time(),
+                    job_id,
+                    item_index,
+                    attempts,
+                ),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def retry_item(
+        self,
+        job_id: str,
+        item_index: int,
+        attempts: int,
+        error: Optional[str],
+        delay: float,
+    ) -> bool:
+        """Возвращает элемент в очередь, но не раньше чем через delay секунд."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batch_items SET status = 'pending', error = ?, not_before = ?, "
+                "updated_at = ? WHERE job_id = ? AND item_index = ? "
+                "AND status = 'running' AND attempts = ?",
+                (error, now + delay, now, job_id, item_index, attempts),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def reset_running(self, lease_seconds: float) -> int:
+        """Возвращает в pending элементы, аренда которых истекла (их обработчик остановлен)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batch_items SET status = 'pending' "
+                "WHERE status = 'running' AND updated_at < ?",
+                (time.time() - lease_seconds,),
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def next_ready_at(self) -> Optional[float]:
+        """Когда ближайший ожидающий элемент станет доступен (None - очередь пуста)."""
+        with self._lock:
+            (not_before,) = self._conn.execute(
+                "SELECT MIN(not_before) FROM batch_items WHERE status = 'pending'"
+            ).fetchone()
+        return not_before
+
+    def get_job(self, job_id: str, with_results: bool = False) -> Optional[Dict]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT * FROM batch_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            items = self._conn.execute(
+                "SELECT * FROM batch_items WHERE job_id = ? ORDER BY item_index",
+                (job_id,),
+            ).fetchall()
+        result = {
+            "job_id": job_id,
+            "created_at": job["created_at"],
+            "items": [],
+        }
+        for item in items:
+            item_info = {
+                "index": item["item_index"],
+                "name": item["name"],
+                "status": item["status"],
+                "attempts": item["attempts"],
+            }
+            if item["error"]:
+                item_info["error"] = item["error"]
+            if with_results and item["result"] is not None:
+                item_info.update(json.loads(item["result"]))
+            result["items"].append(item_info)
+        return result
+
+    def count_unfinished_items(self, job_id: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM batch_items "
+                "WHERE job_id = ? AND status IN ('pending', 'running')",
+                (job_id,),
+            ).fetchone()
+        return count
+
+
+# --- SQLite-хранилище версий документов ---
+DOCUMENTS_DB_PATH = os.getenv("DOCUMENTS_DB_PATH", str(BASE_DIR / "documents.sqlite3"))
+
+
+class SQLiteDocumentStore:
+    """
+    Версии документов для инкрементальной генерации: у каждой версии список
+    разделов с хэшами и тест-кейсами (JSON). Хранятся последние
+    versions_kept версий каждого документа.
+    """
+
+    def __init__(self, path: str, versions_kept: int):
+        self.path = path
+        self.versions_kept = versions_kept
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS document_versions (
+                document_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                sections TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (document_id, version)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def latest(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Последняя версия документа: {"version", "sections", "created_at"}."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, sections, created_at FROM document_versions "
+                "WHERE document_id = ? ORDER BY version DESC LIMIT 1",
+                (document_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"version": row[0], "sections": json.loads(row[1]), "created_at": row[2]}
+
+    def add_version(self, document_id: str, sections: List[Dict[str, Any]]) -> int:
+        """Сохраняет новую версию и возвращает её номер."""
+        sections_json = json.dumps(sections, ensure_ascii=False)
+        with self._lock:
+            (last_version,) = self._conn.execute(
+                "SELECT COALESCE(MAX(version), 0) FROM document_versions "
+                "WHERE document_id = ?",
+                (document_id,),
+            ).fetchone()
+            version = last_version + 1
+            self._conn.execute(
+                "INSERT INTO document_versions (document_id, version, sections, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (document_id, version, sections_json, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM document_versions WHERE document_id = ? AND version <= ?",
+                (document_id, version - self.versions_kept),
+            )
+            self._conn.commit()
+        return version
+
+    def delete(self, document_id: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM document_versions WHERE document_id = ?", (document_id,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
@@ -1,20 +1,31 @@
-import PyPDF2
-import pdfplumber
+import os
 import re
 import json
-from typing import List, Dict, Optional
+import asyncio
+import time
+import hashlib
+from concurrent.futures import Executor
+from typing import List, Dict, Optional, Tuple
 
 
 # --- PDF Processing ---
+# PyPDF2 и pdfplumber импортируются внутри функций: они нужны только при
+# разборе PDF и не должны замедлять старт приложения
+
+# Сколько страниц PDF обрабатывает одна задача в пуле процессов
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Префикс формата отпечатков страниц: отпечатки прежних форматов в кэше
+# не используются
+PDF_FINGERPRINT_PREFIX = "r2-"
+
+
 def extract_text_from_pdf_pypdf2(file_stream) -> Optional[str]:
     """Извлекает текст из PDF с помощью PyPDF2."""
+    import PyPDF2
+
     try:
         pdf_reader = PyPDF2.PdfReader(file_stream)
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text()
-        return text
+        return "".join(page.extract_text() or "" for page in pdf_reader.pages)
     except Exception as e:
         print(f"Error extracting text with PyPDF2: {e}")
         return None
@@ -22,32 +33,535 @@ def extract_text_from_pdf_pypdf2(file_stream) -> Optional[str]:
 
 def extract_text_from_pdf_pdfplumber(file_stream) -> Optional[str]:
     """Извлекает текст из PDF с помощью pdfplumber."""
+    import pdfplumber
+
     try:
-        text = ""
+        page_texts = []
         with pdfplumber.open(file_stream) as pdf:
             for page in pdf.pages:
                 page_text = page.extract_text()
                 if page_text:
-                    text += page_text + "\n"
-        return text
+                    page_texts.append(page_text + "\n")
+        return "".join(page_texts)
     except Exception as e:
         print(f"Error extracting text with pdfplumber: {e}")
         return None
 
 
-def extract_text_from_pdf(file_stream) -> Optional[str]:
-    """Пытается извлечь текст из PDF, используя сначала pdfplumber, затем PyPDF2."""
-    # pdfplumber обычно лучше, но может потребовать больше зависимостей (для некоторых PDF)
-    # PyPDF2 более легковесный
+def count_pdf_pages(pdf_source) -> int:
+    """Число страниц в PDF (путь к файлу или поток)."""
+    import PyPDF2
+    import pdfplumber
+
+    try:
+        return len(PyPDF2.PdfReader(pdf_source).pages)
+    except Exception as e:
+        print(f"PyPDF2 could not count pages, trying pdfplumber: {e}")
+        if hasattr(pdf_source, "seek"):
+            pdf_source.seek(0)
+        with pdfplumber.open(pdf_source) as pdf:
+            return len(pdf.pages)
+
+
+def _extract_page_pypdf2(pdf_reader, page_number: int) -> str:
+    try:
+        return pdf_reader.pages[page_number].extract_text() or ""
+    except Exception as e:
+        print(f"Error extracting page {page_number + 1} with PyPDF2: {e}")
+        return ""
+
+
+def extract_pdf_pages(
+    pdf_source,
+    start: int = 0,
+    stop: Optional[int] = None,
+    char_budget: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Извлекает текст страниц [start, stop) списком, страница за страницей.
+    Страницы, где pdfplumber ничего не нашёл, дочитываются через PyPDF2.
+    Останавливается, как только набрано char_budget символов.
+    В timings (если передан) накапливается время pdfplumber и PyPDF2 в секундах.
+    """
+    if timings is None:
+        timings = {}
+    timings.setdefault("pdfplumber", 0.0)
+    timings.setdefault("pypdf2_fallback", 0.0)
+    import PyPDF2
+    import pdfplumber
+
+    page_texts: List[str] = []
+    total_chars = 0
+    pypdf2_reader = None
+    started_at = time.perf_counter()
+    try:
+        pdf = pdfplumber.open(pdf_source)
+    except Exception as e:
+        print(f"Error opening PDF with pdfplumber, using PyPDF2 only: {e}")
+        pdf = None
+    timings["pdfplumber"] += time.perf_counter() - started_at
+
+    try:
+        page_count = len(pdf.pages) if pdf is not None else None
+        if page_count is None:
+            pypdf2_reader = PyPDF2.PdfReader(pdf_source)
+            page_count = len(pypdf2_reader.pages)
+        stop = page_count if stop is None else min(stop, page_count)
+
+        for page_number in range(start, stop):
+            page_text = ""
+            if pdf is not None:
+                started_at = time.perf_counter()
+                page = pdf.pages[page_number]
+                try:
+                    page_text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"Error extracting page {page_number + 1} with pdfplumber: {e}")
+                finally:
+                    page.close()  # Освобождаем кэш объектов страницы
+                timings["pdfplumber"] += time.perf_counter() - started_at
+            if not page_text.strip():
+                started_at = time.perf_counter()
+                if pypdf2_reader is None:
+                    pypdf2_reader = PyPDF2.PdfReader(pdf_source)
+                page_text = _extract_page_pypdf2(pypdf2_reader, page_number)
+                timings["pypdf2_fallback"] += time.perf_counter() - started_at
+
+            page_texts.append(page_text)
+            total_chars += len(page_text) + 1
+            if char_budget and total_chars >= char_budget:
+                break
+    finally:
+        if pdf is not None:
+            pdf.close()
+    return page_texts
+
+
+def extract_pdf_pages_timed(
+    pdf_source,
+    start: int = 0,
+    stop: Optional[int] = None,
+    char_budget: Optional[int] = None,
+) -> Tuple[List[str], Dict[str, float]]:
+    """extract_pdf_pages для пула процессов: тексты страниц и время по библиотекам."""
+    timings: Dict[str, float] = {}
+    page_texts = extract_pdf_pages(pdf_source, start, stop, char_budget, timings)
+    return page_texts, timings
+
+
+def extract_text_from_pdf(file_stream, char_budget: Optional[int] = None) -> Optional[str]:
+    """Извлекает текст из PDF: pdfplumber, а для пустых страниц - PyPDF2."""
     file_stream.seek(0)  # Важно сбросить указатель файла перед повторным чтением
-    text = extract_text_from_pdf_pdfplumber(file_stream)
-    if text and text.strip():
-        return text
+    try:
+        page_texts = extract_pdf_pages(file_stream, char_budget=char_budget)
+    except Exception as e:
+        print(f"Error extracting text from PDF: {e}")
+        return None
+    text = "\n".join(page_texts)
+    return text[:char_budget] if char_budget else text
+
+
+def _pdf_object_digest(obj, memo: Dict[Tuple[int, int], bytes], stack: set) -> bytes:
+    """
+    SHA-256 объекта PDF со всем, на что он ссылается (словари, массивы,
+    данные потоков). Косвенные объекты хэшируются один раз на документ,
+    обратные ссылки (/Parent, циклы) не обходятся.
+    """
+    from PyPDF2.generic import IndirectObject
+
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in memo:
+            return memo[key]
+        if key in stack:
+            return b"cycle"
+        stack.add(key)
+        digest = _pdf_object_digest(obj.get_object(), memo, stack)
+        stack.discard(key)
+        memo[key] = digest
+        return digest
+
+    hasher = hashlib.sha256()
+    if isinstance(obj, dict):
+        hasher.update(b"dict")
+        for name in sorted(obj):
+            if name == "/Parent":
+                continue
+            hasher.update(str(name).encode("utf-8", "replace"))
+            hasher.update(_pdf_object_digest(obj.raw_get(name), memo, stack))
+        if hasattr(obj, "get_data"):
+            try:
+                hasher.update(obj.get_data())
+            except Exception:
+                hasher.update(getattr(obj, "_data", b"") or b"")
+    elif isinstance(obj, list):
+        hasher.update(b"array")
+        for item in obj:
+            hasher.update(_pdf_object_digest(item, memo, stack))
+    else:
+        hasher.update(repr(obj).encode("utf-8", "replace"))
+    return hasher.digest()
+
+
+def fingerprint_pdf_pages(pdf_source) -> List[str]:
+    """
+    SHA-256 каждой страницы: content stream, размер страницы и ресурсы
+    (шрифты с кодировками, XObject-формы и изображения). Без ресурсов
+    страницы вида "/Fm0 Do" или с тем же текстом в другом шрифте совпадали
+    бы в разных документах, а кэш страниц общий для всех документов.
+    Дешевле извлечения текста и позволяет узнать неизменённые страницы
+    в новой версии документа.
+    """
+    import PyPDF2
+
+    pdf_reader = PyPDF2.PdfReader(pdf_source)
+    fingerprints = []
+    # Общие для страниц ресурсы (шрифты, формы) хэшируются один раз
+    memo: Dict[Tuple[int, int], bytes] = {}
+    for page in pdf_reader.pages:
+        hasher = hashlib.sha256()
+        contents = page.get_contents()
+        if contents is not None:
+            hasher.update(contents.get_data())
+        hasher.update(repr(list(page.mediabox)).encode("ascii"))
+        # /Resources может наследоваться от узла /Pages - берётся итоговый
+        resources = page.get("/Resources")
+        if resources is not None:
+            hasher.update(_pdf_object_digest(resources, memo, set()))
+        fingerprints.append(PDF_FINGERPRINT_PREFIX + hasher.hexdigest())
+    return fingerprints
+
+
+def _missing_page_ranges(
+    page_count: int, known_pages: Dict[int, str], pages_per_task: int
+) -> List[Tuple[int, int]]:
+    """Диапазоны подряд идущих неизвестных страниц, не длиннее pages_per_task."""
+    ranges = []
+    start = None
+    for page_number in range(page_count + 1):
+        missing = page_number < page_count and page_number not in known_pages
+        if missing and start is None:
+            start = page_number
+        if start is not None and (
+            not missing or page_number - start == pages_per_task
+        ):
+            ranges.append((start, page_number))
+            start = page_number if missing else None
+    return ranges
+
+
+def _known_prefix_chars(page_count: int, known_pages: Dict[int, str]) -> int:
+    total_chars = 0
+    for page_number in range(page_count):
+        if page_number not in known_pages:
+            break
+        total_chars += len(known_pages[page_number]) + 1
+    return total_chars
+
+
+async def extract_pdf_page_texts(
+    path: str,
+    page_count: int,
+    known_pages: Optional[Dict[int, str]] = None,
+    char_budget: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = PDF_PAGES_PER_TASK,
+    max_parallel_tasks: int = 4,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Извлекает текст страниц PDF-файла вне event loop. Уже известные страницы
+    (known_pages, например из кэша) не перечитываются, остальные делятся на
+    диапазоны и обрабатываются параллельно в executor (обычно пул процессов).
+    Диапазоны запускаются волнами по max_parallel_tasks, новые волны не
+    запускаются, когда бюджет символов уже набран.
+    В timings суммируется время воркеров по библиотекам (см. extract_pdf_pages).
+    Возвращает тексты страниц с начала документа.
+    """
+    loop = asyncio.get_running_loop()
+    pages = dict(known_pages or {})
+    page_ranges = _missing_page_ranges(page_count, pages, pages_per_task)
+
+    for wave_start in range(0, len(page_ranges), max_parallel_tasks):
+        if char_budget and _known_prefix_chars(page_count, pages) >= char_budget:
+            break
+        wave = page_ranges[wave_start : wave_start + max_parallel_tasks]
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    executor, extract_pdf_pages_timed, path, start, stop, char_budget
+                )
+                for start, stop in wave
+            )
+        )
+        for (start, _), (range_texts, range_timings) in zip(wave, results):
+            if timings is not None:
+                for library, seconds in range_timings.items():
+                    timings[library] = timings.get(library, 0.0) + seconds
+            for offset, page_text in enumerate(range_texts):
+                pages[start + offset] = page_text
+
+    page_texts: List[str] = []
+    for page_number in range(page_count):
+        if page_number not in pages:
+            break
+        page_texts.append(pages[page_number])
+    return page_texts
+
+
+# --- Очистка текста PDF от служебных элементов ---
+# Колонтитулы, номера страниц, оглавление и лист регистрации изменений не несут
+# требований, но уходят в промпт и расходуют лимит MAX_INPUT_CHARS.
+# Колонтитулом считается строка у края страницы (первые/последние
+# BOILERPLATE_EDGE_LINES непустых строк), которая встречается не меньше чем
+# на BOILERPLATE_MIN_PAGES страницах и на доле BOILERPLATE_PAGE_SHARE страниц
+# документа. Строки сравниваются по хэшу без учёта регистра и пробелов, а
+# строки, не похожие на заголовок раздела, - ещё и без учёта цифр ("Стр. 3",
+# дата печати).
+BOILERPLATE_EDGE_LINES = int(os.getenv("BOILERPLATE_EDGE_LINES", "3"))
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+BOILERPLATE_PAGE_SHARE = float(os.getenv("BOILERPLATE_PAGE_SHARE", "0.5"))
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"[ \t\u00a0\u2000-\u200b\u3000]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+# "12", "- 12 -", "Page 12", "Стр. 12 из 40", "12 / 40", "Лист 3"
+_PAGE_NUMBER_RE = re.compile(
+    r"^[-–—\s]*(?:(?:page|p\.|стр\.?|страница|с\.|лист)\s*)?\d{1,4}"
+    r"(?:\s*(?:of|из|/)\s*\d{1,4})?[-–—\s]*$",
+    re.IGNORECASE,
+)
+# Пункт оглавления: заголовок, точки-заполнители и номер страницы
+_TOC_ENTRY_RE = re.compile(r"^\S.*?(?:\.{4,}|…{2,}|(?:\. ){3,}\.?|_{4,})\s*\d{1,4}$")
+_TOC_HEADING_RE = re.compile(
+    r"^(?:содержание|оглавление|contents|table of contents)$", re.IGNORECASE
+)
+_REVISION_HEADING_RE = re.compile(
+    r"^(?:история изменений|лист регистрации изменений|история версий"
+    r"|revision history|change history|document history|version history)$",
+    re.IGNORECASE,
+)
+# Строка таблицы версий: номер версии и дата; шапка таблицы: "Версия ... Дата"
+_REVISION_ROW_RE = re.compile(
+    r"^(?:v|ver\.?|версия)?\s*\d+(?:\.\d+)+\s.*\b\d{1,4}[./-]\d{1,2}[./-]\d{1,4}\b",
+    re.IGNORECASE,
+)
+_REVISION_COLUMNS_RE = re.compile(
+    r"(?:версия|ревизия|version|revision|rev\.).*(?:дата|date)"
+    r"|(?:дата|date).*(?:версия|ревизия|version|revision|rev\.)",
+    re.IGNORECASE,
+)
+
+
+def _line_hashes(line: str) -> Tuple[bytes, bytes]:
+    """Хэши строки для поиска колонтитулов: как есть и без учёта цифр."""
+    normalized = line.lower().strip()
+    return (
+        hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(),
+        hashlib.blake2b(
+            _DIGITS_RE.sub("#", normalized).encode("utf-8"), digest_size=8
+        ).digest(),
+    )
+
+
+def _is_repeated(line: str, hashes: Tuple[bytes, bytes], repeated: set) -> bool:
+    # "Раздел 2", "3.1 Вход" отличаются от соседних страниц только цифрами,
+    # но это содержание
+    exact_hash, digits_hash = hashes
+    return exact_hash in repeated or (
+        digits_hash in repeated and not HEADING_RE.match(line)
+    )
+
+
+def _edge_line_indexes(lines: List[str], edge_lines: int) -> List[int]:
+    """
+    Индексы первых и последних edge_lines непустых строк страницы. На коротких
+    страницах - только первая и последняя строка, чтобы не задеть основной текст.
+    """
+    non_empty = [index for index, line in enumerate(lines) if line.strip()]
+    if len(non_empty) <= 3 * edge_lines:
+        edge_lines = 1
+    if len(non_empty) <= 2 * edge_lines:
+        return non_empty
+    return non_empty[:edge_lines] + non_empty[-edge_lines:]
+
+
+def _is_toc_entry(line: str) -> bool:
+    # Проверка последнего символа отсекает почти все строки без регулярного выражения
+    return line[-1:].isdigit() and _TOC_ENTRY_RE.match(line) is not None
+
+
+def _drop_blocks(lines: List[str]) -> List[str]:
+    """Убирает оглавление и таблицу версий вместе с их заголовками."""
+    kept: List[str] = []
+    in_toc = in_revisions = False
+    for index, line in enumerate(lines):
+        if in_toc and (not line or _is_toc_entry(line)):
+            continue
+        if in_revisions and (
+            not line or _REVISION_ROW_RE.match(line) or _REVISION_COLUMNS_RE.search(line)
+        ):
+            continue
+        in_toc = in_revisions = False
+        if _is_toc_entry(line):
+            continue
+        if len(line) <= 40:
+            if _TOC_HEADING_RE.match(line):
+                # Заголовок убирается, только если за ним действительно оглавление
+                following = next((l for l in lines[index + 1 :] if l), "")
+                if _is_toc_entry(following):
+                    in_toc = True
+                    continue
+            if _REVISION_HEADING_RE.match(line):
+                in_revisions = True
+                continue
+        kept.append(line)
+    return kept
+
+
+def strip_pdf_boilerplate(
+    page_texts: List[str],
+    edge_lines: int = BOILERPLATE_EDGE_LINES,
+    min_pages: int = BOILERPLATE_MIN_PAGES,
+    page_share: float = BOILERPLATE_PAGE_SHARE,
+) -> List[str]:
+    """
+    Убирает из текстов страниц повторяющиеся колонтитулы, номера страниц,
+    оглавление и таблицу версий, схлопывает пробелы и пустые строки.
+    Возвращает очищенные тексты страниц в исходном порядке.
+    """
+    pages = [_SPACES_RE.sub(" ", page_text).splitlines() for page_text in page_texts]
+
+    # Хэши строк у краёв каждой страницы и число страниц, на которых
+    # встречается каждый хэш
+    page_counts: Dict[bytes, int] = {}
+    edge_hashes: List[Dict[int, Tuple[bytes, bytes]]] = []
+    for lines in pages:
+        hashes = {
+            index: _line_hashes(lines[index])
+            for index in _edge_line_indexes(lines, edge_lines)
+        }
+        for line_hash in {h for pair in hashes.values() for h in pair}:
+            page_counts[line_hash] = page_counts.get(line_hash, 0) + 1
+        edge_hashes.append(hashes)
+    threshold = max(min_pages, page_share * len(pages))
+    repeated = {line_hash for line_hash, count in page_counts.items() if count >= threshold}
+
+    cleaned_pages: List[str] = []
+    for lines, hashes in zip(pages, edge_hashes):
+        kept = [
+            line.strip()
+            for index, line in enumerate(lines)
+            if index not in hashes
+            or not (
+                _is_repeated(line, hashes[index], repeated) or _PAGE_NUMBER_RE.match(line)
+            )
+        ]
+        text = "\n".join(_drop_blocks(kept)).strip()
+        cleaned_pages.append(_BLANK_LINES_RE.sub("\n\n", text))
+    return cleaned_pages
+
+
+# --- Разбиение больших документов ---
+# Строка-заголовок: "1.", "2.3.1 Название", "Раздел 4", "Глава 2", "Section 5", "# Заголовок"
+# или короткая строка ЗАГЛАВНЫМИ буквами.
+HEADING_RE = re.compile(
+    r"^\s*(?:"
+    r"#{1,6}\s+\S"
+    r"|(?:\d+\.)+\d*\s+\S"
+    r"|\d+\.\d+(?:\.\d+)*\s*\S"
+    r"|(?:Раздел|Глава|Часть|Приложение|Section|Chapter|Part|Appendix)\s+[\dA-ZА-ЯIVX]"
+    r"|[A-ZА-ЯЁ0-9][A-ZА-ЯЁ0-9 ,.:()\-]{3,80}$"
+    r")"
+)
+
+
+def split_into_sections(text: str) -> List[str]:
+    """Делит текст на разделы по строкам-заголовкам. Заголовок остаётся в начале раздела."""
+    sections: List[str] = []
+    current: List[str] = []
+    for line in text.splitlines():
+        if current and HEADING_RE.match(line) and any(l.strip() for l in current):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
 
-    print("pdfplumber failed or returned empty text, trying PyPDF2...")
-    file_stream.seek(0)  # Сброс указателя для PyPDF2
-    text = extract_text_from_pdf_pypdf2(file_stream)
-    return text
+def _split_oversized(text: str, max_chars: int) -> List[str]:
+    """Режет слишком большой раздел по абзацам, затем по строкам, затем жёстко."""
+    for separator in ("\n\n", "\n"):
+        parts = text.split(separator)
+        if len(parts) > 1:
+            return _pack(parts, max_chars, separator)
+    return [text[i : i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def _pack(parts: List[str], max_chars: int, separator: str) -> List[str]:
+    """Жадно склеивает части в куски не длиннее max_chars, сохраняя порядок."""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for part in parts:
+        if len(part) > max_chars:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_len = [], 0
+            chunks.extend(_split_oversized(part, max_chars))
+            continue
+        added_len = len(part) + (len(separator) if current else 0)
+        if current and current_len + added_len > max_chars:
+            chunks.append(separator.join(current))
+            current, current_len = [], 0
+            added_len = len(part)
+        current.append(part)
+        current_len += added_len
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_requirements_into_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    Делит текст требований на куски размером не больше max_chars,
+    стараясь резать по границам разделов и заголовков.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    chunks = _pack(split_into_sections(text), max_chars, "\n")
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def split_into_document_sections(text: str, max_chars: int, min_chars: int) -> List[str]:
+    """
+    Делит документ на разделы для инкрементальной генерации. Разделы короче
+    min_chars (например, заголовок главы без текста) присоединяются к
+    следующему, длиннее max_chars - режутся по абзацам. В отличие от
+    split_requirements_into_chunks соседние разделы не склеиваются до
+    max_chars: правка одного раздела не должна менять границы остальных.
+    """
+    sections: List[str] = []
+    pending: List[str] = []
+    for section in split_into_sections(text):
+        pending.append(section)
+        if sum(len(part) for part in pending) >= min_chars:
+            sections.append("\n".join(pending))
+            pending = []
+    if pending:
+        if sections:
+            sections[-1] += "\n" + "\n".join(pending)
+        else:
+            sections.append("\n".join(pending))
+    result: List[str] = []
+    for section in sections:
+        if len(section) > max_chars:
+            result.extend(_split_oversized(section, max_chars))
+        else:
+            result.append(section)
+    return [section for section in result if section.strip()]
 
 
 # --- Gemini Response Parsing ---
@@ -72,95 +586,338 @@ DEFAULT_PROMPT_TEMPLATE = """
 """
 
 
-def parse_gemini_response(text_response: str) -> List[Dict[str, str]]:
+DEFAULT_JSON_PROMPT_TEMPLATE = """
+На основе этого текста сгенерируй тест-кейсы.
+Верни JSON-массив, каждый элемент которого - объект с полями:
+"Название" - краткое и ясное название тест-кейса;
+"Шаги" - нумерованные шаги, каждый с новой строки ("1. ...\\n2. ...");
+"Ожидаемый результат" - что должно произойти после выполнения шагов;
+"Тип" - "Позитивный" или "Негативный".
+
+Вот текст требований:
+---
+{requirements_text}
+---
+"""
+
+# Схема ответа для режима структурированного вывода (совпадает с моделью TestCase)
+TEST_CASES_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "Название": {"type": "string"},
+            "Шаги": {"type": "string"},
+            "Ожидаемый результат": {"type": "string"},
+            "Тип": {"type": "string", "enum": ["Позитивный", "Негативный"]},
+        },
+        "required": ["Название", "Шаги", "Ожидаемый результат", "Тип"],
+    },
+}
+
+
+# Маркеры полей тест-кейса. Шаблоны не содержат вложенных квантификаторов
+# и применяются к отдельным строкам, поэтому разбор линеен по длине ответа.
+_CASE_START_RE = re.compile(r"(?<!\w)Название:")
+_CASE_NUMBER_PREFIX_RE = re.compile(r"(?<!\w)[0-9]+\.\s*$")
+_NAME_MARKER_RE = re.compile(r"Название:", re.IGNORECASE)
+_STEPS_MARKER_RE = re.compile(r"Шаги:", re.IGNORECASE)
+_EXPECTED_MARKER_RE = re.compile(r"Ожидаемый результат:", re.IGNORECASE)
+_TYPE_MARKER_RE = re.compile(r"Тип:", re.IGNORECASE)
+_TYPE_VALUE_RE = re.compile(r"\s*(Позитивный|Негативный)", re.IGNORECASE)
+_STEPS_END_RE = re.compile(r"Ожидаемый результат:|Тип:", re.IGNORECASE)
+_STEPS_END_AT_LINE_START_RE = re.compile(
+    r"\s*(?:Ожидаемый результат:|Тип:)", re.IGNORECASE
+)
+_NUMBERED_STEP_RE = re.compile(r"\s*\d+\.")
+# Строка "Тип: ..." (можно с номером "4." и разметкой "**") со значением -
+# последняя строка тест-кейса. "Тип:" внутри шага ("(тип: admin)") и "Тип:"
+# без значения (оно на следующей строке) конец тест-кейса не означают
+_CASE_END_LINE_RE = re.compile(r"[\s*]*(?:\d+\.[\s*]*)?Тип:[\s*]*[^\s*]", re.IGNORECASE)
+
+# Состояния разбора шагов
+_STEPS_NOT_FOUND = 0
+_STEPS_HEADER = 1  # Встретили "Шаги:", ждём первую непустую строку
+_STEPS_NUMBERED = 2  # Нумерованные шаги: до первого маркера в любом месте строки
+_STEPS_FREEFORM = 3  # Ненумерованные шаги: до строки, начинающейся с маркера
+_STEPS_DONE = 4
+
+
+class _CaseBlockParser:
+    """Построчный конечный автомат для одного блока тест-кейса."""
+
+    __slots__ = (
+        "lines",
+        "name",
+        "name_pending",
+        "expected_result",
+        "expected_pending",
+        "test_type",
+        "type_pending",
+        "steps_state",
+        "steps_lines",
+        "steps",
+        "dropped",
+    )
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self.name: Optional[str] = None
+        self.name_pending = False
+        self.expected_result: Optional[str] = None
+        self.expected_pending = False
+        self.test_type: Optional[str] = None
+        self.type_pending = False
+        self.steps_state = _STEPS_NOT_FOUND
+        self.steps_lines: List[str] = []
+        self.steps = ""
+        self.dropped = False
+
+    def add_line(self, line: str) -> None:
+        self.lines.append(line)
+        stripped = line.strip()
+
+        # Название: остаток строки или, если он пуст, следующая непустая строка
+        if self.name is None:
+            if self.name_pending:
+                if stripped:
+                    self.name = stripped
+            else:
+                match = _NAME_MARKER_RE.search(line)
+                if match:
+                    self.name = line[match.end() :].strip() or None
+                    self.name_pending = self.name is None
+
+        # Ожидаемый результат: так же, как название, но без хвоста "Тип:"
+        if self.expected_result is None:
+            value = None
+            if self.expected_pending:
+                value = stripped or None
+            else:
+                match = _EXPECTED_MARKER_RE.search(line)
+                if match:
+                    value = line[match.end() :].strip() or None
+                    self.expected_pending = value is None
+            if value is not None:
+                if "Тип:" in value:
+                    value = value.split("Тип:")[0].strip()
+                self.expected_result = value
+
+        # Тип: первое вхождение "Тип:", за которым следует Позитивный/Негативный
+        if self.test_type is None:
+            if self.type_pending and stripped:
+                self.type_pending = False
+                self._match_type(line)
+            if self.test_type is None:
+                for match in _TYPE_MARKER_RE.finditer(line):
+                    rest = line[match.end() :]
+                    if not rest.strip():
+                        self.type_pending = True
+                    elif self._match_type(rest):
+                        break
+
+        self._add_steps_line(line, stripped)
+
+    def _match_type(self, text: str) -> bool:
+        match = _TYPE_VALUE_RE.match(text)
+        if match:
+            self.test_type = match.group(1).strip().capitalize()
+            return True
+        return False
+
+    def _add_steps_line(self, line: str, stripped: str) -> None:
+        state = self.steps_state
+        if state == _STEPS_NOT_FOUND:
+            # Шаги начинаются со следующей строки, поэтому после "Шаги:" - только пробелы
+            last_match = None
+            for last_match in _STEPS_MARKER_RE.finditer(line):
+                pass
+            if last_match is not None and not line[last_match.end() :].strip():
+                self.steps_state = _STEPS_HEADER
+        elif state == _STEPS_HEADER:
+            if stripped:
+                self.steps_lines.append(line)
+                if _NUMBERED_STEP_RE.match(line) and not _STEPS_END_RE.search(line):
+                    self.steps_state = _STEPS_NUMBERED
+                else:
+                    self.steps_state = _STEPS_FREEFORM
+        elif state == _STEPS_NUMBERED:
+            if _STEPS_END_RE.search(line):
+                self._finish_steps()
+            else:
+                self.steps_lines.append(line)
+        elif state == _STEPS_FREEFORM:
+            if _STEPS_END_AT_LINE_START_RE.match(line):
+                self._finish_steps()
+            else:
+                self.steps_lines.append(line)
+
+    def _finish_steps(self) -> None:
+        self.steps = "\n".join(self.steps_lines).strip()
+        self.steps_lines = []
+        self.steps_state = _STEPS_DONE
+
+    def finish(self) -> Optional[Dict[str, str]]:
+        """Возвращает тест-кейс или None, если в блоке нет названия."""
+        if self.steps_state == _STEPS_NUMBERED:
+            # Нумерованные шаги без маркера после них идут до конца блока
+            self._finish_steps()
+
+        if self.name:
+            return {
+                "Название": self.name,
+                "Шаги": self.steps,  # Сохраняем как строку, форматирование будет на фронте
+                "Ожидаемый результат": self.expected_result or "",
+                "Тип": (
+                    self.test_type
+                    if self.test_type in ["Позитивный", "Негативный"]
+                    else "Не определен"
+                ),
+            }
+        case_text = "\n".join(self.lines).strip()
+        if case_text and len(case_text) > 20:
+            # Если есть какой-то текст, но не распарсился как надо
+            print(f"Could not parse block: {case_text[:100]}...")
+            self.dropped = True
+        return None
+
+
+def parse_gemini_response_with_stats(
+    text_response: str,
+) -> Tuple[List[Dict[str, str]], int]:
     """
     Парсит текстовый ответ от Gemini в структурированные тест-кейсы.
     Предполагается, что Gemini следует запрошенному формату.
+
+    Разбор однопроходный: ответ читается построчно, каждый тест-кейс начинается
+    с "Название:" (номер перед ним, например "1. ", отбрасывается), поля
+    извлекает _CaseBlockParser. Возвращает (test_cases, число отброшенных блоков).
     """
     test_cases = []
-    # Разделяем ответ на отдельные тест-кейсы.
-    # Ищем паттерн, который начинает каждый тест-кейс, например, "1. Название:"
-    # или просто "Название:" если нумерация не строгая.
-    # Используем lookahead (?=...) чтобы не потреблять разделитель
-    raw_cases = re.split(r"(?=\b(?:[0-9]+\.\s*)?Название:)", text_response.strip())
-
-    for case_text in raw_cases:
-        case_text = case_text.strip()
-        if not case_text:
-            continue
+    dropped = 0
+    block = _CaseBlockParser()
+    for line in text_response.strip().split("\n"):
+        position = 0
+        for match in _CASE_START_RE.finditer(line):
+            head = line[position : match.start()]
+            prefix_match = _CASE_NUMBER_PREFIX_RE.search(head)
+            if prefix_match:
+                head = head[: prefix_match.start()]
+            if head or position == 0:
+                block.add_line(head)
+            test_case = block.finish()
+            if test_case:
+                test_cases.append(test_case)
+            elif block.dropped:
+                dropped += 1
+            block = _CaseBlockParser()
+            position = match.start()
+        block.add_line(line[position:] if position else line)
 
-        name = ""
-        steps_str = ""
-        expected_result = ""
-        test_type = ""
+    test_case = block.finish()
+    if test_case:
+        test_cases.append(test_case)
+    elif block.dropped:
+        dropped += 1
+    return test_cases, dropped
 
-        # Извлекаем Название
-        name_match = re.search(
-            r"(?:[0-9]+\.\s*)?Название:\s*(.+)", case_text, re.IGNORECASE
-        )
-        if name_match:
-            name = name_match.group(1).strip()
 
-        # Извлекаем Шаги
+def parse_gemini_response(text_response: str) -> List[Dict[str, str]]:
+    """Парсит текстовый ответ от Gemini в структурированные тест-кейсы."""
+    return parse_gemini_response_with_stats(text_response)[0]
+
 
+def complete_cases_prefix(text_response: str) -> str:
+    """
+    Начало оборванного текстового ответа, в котором только целые тест-кейсы.
+    Тест-кейс считается целым, если целиком дошла строка, начинающаяся с "Тип:"
+    со значением, или строка начала следующего - по тем же правилам, что и в
+    IncrementalResponseParser.
+    """
+    cut = 0
+    offset = 0
+    # Последняя строка может быть дописана не до конца - её не учитываем
+    for line in text_response.split("\n")[:-1]:
+        if _CASE_START_RE.search(line):
+            cut = offset
+        if _CASE_END_LINE_RE.match(line):
+            cut = offset + len(line) + 1
+        offset += len(line) + 1
+    return text_response[:cut]
 
-        # Извлекаем Шаги
-        # Шаги могут быть многострочными и нумерованными
-        steps_match = re.search(
-            r'Шаги:\s*\n((?:\s*\d+\.\s*(?:(?!Ожидаемый результат:|Тип:)[\s\S])+(?:\n|$))+)',
-            case_text,
-            re.IGNORECASE
-        )
-        if steps_match:
-            steps_str = steps_match.group(1).strip()
-        else:  # Попробуем найти шаги без строгой нумерации
-            steps_match_alt = re.search(
-                r'Шаги:\s*\n([\s\S]+?)(?=\s*\n\s*(?:Ожидаемый результат:|Тип:|$))',
-                case_text,
-                re.IGNORECASE
-            )
-            if steps_match_alt:
-                steps_str = steps_match_alt.group(1).strip()
-
-        # Извлекаем Ожидаемый результат
-        er_match = re.search(r"Ожидаемый результат:\s*(.+)", case_text, re.IGNORECASE)
-        if er_match:
-            expected_result = er_match.group(1).strip()
-            # Убираем "Тип:" если он захватился
-            if "Тип:" in expected_result:
-                expected_result = expected_result.split("Тип:")[0].strip()
-
-        # Извлекаем Тип
-        type_match = re.search(
-            r"Тип:\s*(Позитивный|Негативный)", case_text, re.IGNORECASE
-        )
-        if type_match:
-            test_type = type_match.group(1).strip().capitalize()
-
-        # Если какой-то из ключевых элементов не найден, но текст есть,
-        # это может быть неполный тест-кейс или мусор. Проверяем наличие названия.
-        if name:
-            test_cases.append(
-                {
-                    "Название": name,
-                    "Шаги": steps_str,  # Сохраняем как строку, форматирование будет на фронте
-                    "Ожидаемый результат": expected_result,
-                    "Тип": (
-                        test_type
-                        if test_type in ["Позитивный", "Негативный"]
-                        else "Не определен"
-                    ),
-                }
-            )
-        elif (
-            case_text and len(case_text) > 20
-        ):  # Если есть какой-то текст, но не распарсился как надо
-            print(f"Could not parse block: {case_text[:100]}...")
 
-    return test_cases
+def complete_json_items_prefix(json_response: str) -> str:
+    """
+    Оборванный JSON-массив тест-кейсов, урезанный до последнего целого объекта
+    и закрытый "]". Пустая строка, если целых объектов нет.
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    cut = 0
+    for position, char in enumerate(json_response):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if char == "}" and depth == 1:
+                cut = position + 1
+    if not cut:
+        return ""
+    return json_response[:cut] + "]"
+
+
+class IncrementalResponseParser:
+    """
+    Потоковый вариант parse_gemini_response: принимает ответ Gemini кусками
+    и отдаёт тест-кейс, как только пришла строка, начинающаяся с "Тип:" и его
+    значения (иначе - когда начался следующий тест-кейс). Каждый блок
+    разбирается тем же parse_gemini_response.
+    """
+
+    def __init__(self):
+        self._partial_line = ""
+        self._block_lines: List[str] = []
+
+    def feed(self, text: str) -> List[Dict[str, str]]:
+        """Добавляет кусок текста и возвращает тест-кейсы, которые стали полными."""
+        parsed: List[Dict[str, str]] = []
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            parsed.extend(self._add_line(line))
+        return parsed
+
+    def close(self) -> List[Dict[str, str]]:
+        """Завершает разбор и возвращает оставшиеся тест-кейсы."""
+        parsed: List[Dict[str, str]] = []
+        if self._partial_line:
+            parsed.extend(self._add_line(self._partial_line))
+            self._partial_line = ""
+        parsed.extend(self._flush())
+        return parsed
+
+    def _add_line(self, line: str) -> List[Dict[str, str]]:
+        parsed: List[Dict[str, str]] = []
+        if _CASE_START_RE.search(line) and any(l.strip() for l in self._block_lines):
+            parsed.extend(self._flush())
+        self._block_lines.append(line)
+        if _CASE_END_LINE_RE.match(line):
+            parsed.extend(self._flush())
+        return parsed
 
-# --- (Опционально) SQLite History ---
-# Функции для работы с базой данных будут здесь, если решим добавить историю
-# async def init_db(): ...
-# async def add_history_entry(): ...
-# async def get_history(): ...
+    def _flush(self) -> List[Dict[str, str]]:
+        block = "\n".join(self._block_lines)
+        self._block_lines = []
+        if not block.strip():
+            return []
+        return parse_gemini_response(block)